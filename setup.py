@@ -17,5 +17,7 @@ setup(
     author_email='alys.clark@auckland.ac.nz',
     test_suite='nose.collector',
     tests_require=['nose'],
+    extras_require={'numba': ['numba']},
+    python_requires='>=3.7',
     description=''
 )
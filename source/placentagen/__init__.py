@@ -2,3 +2,4 @@ from .generate_shapes import *
 from .imports_and_exports import *
 from .grow_tree import *
 from .analyse_tree import *
+from .compact_tree import *
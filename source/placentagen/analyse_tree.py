@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import hashlib
+
 import numpy as np
 from . import pg_utilities
 import time
@@ -36,7 +38,7 @@ def calc_terminal_branch(node_loc, elems):
     # inputs are node locations and elements
     num_elems = len(elems)
     num_nodes = len(node_loc)
-    elem_cnct = pg_utilities.element_connectivity_1D(node_loc, elems)
+    elem_cnct = tree_property(node_loc, elems, 'connectivity')
 
     terminal_branches = np.zeros(num_elems, dtype=int)
     terminal_nodes = np.zeros(num_nodes, dtype=int)
@@ -64,7 +66,7 @@ def evaluate_orders(node_loc, elems):
     # elems = array with location of elements
     num_elems = len(elems)
     # Calculate connectivity of elements
-    elem_connect = pg_utilities.element_connectivity_1D(node_loc, elems)
+    elem_connect = tree_property(node_loc, elems, 'connectivity')
     elem_upstream = elem_connect['elem_up']
     elem_downstream = elem_connect['elem_down']
     # Initialise order definition arrays
@@ -121,6 +123,65 @@ def evaluate_orders(node_loc, elems):
     return {'strahler': strahler, 'horsfield': horsfield, 'generation': generation}
 
 
+tree_cache = {}  # derived properties of recently used trees, by tree_fingerprint
+tree_cache_size = 4  # number of trees kept in tree_cache
+
+
+def tree_property(node_loc, elems, name):
+    # A property derived from a tree, computed the first time it is asked for and then kept until the nodes or
+    # elements change (in place or for new arrays, e.g. from refine_1D or add_stem_villi), so analyses of the same
+    # tree share the work. The arrays returned are read only, copy them to change them
+    # name = 'connectivity' (pg_utilities.element_connectivity_1D), 'terminals' (calc_terminal_branch),
+    #   'orders' (evaluate_orders), 'lengths' (length of each element) or 'terminal_coords' (location of the end
+    #   node of each terminal element)
+    fingerprint = tree_fingerprint(node_loc, elems)
+    if fingerprint not in tree_cache:
+        if len(tree_cache) >= tree_cache_size:
+            tree_cache.pop(next(iter(tree_cache)))  # forget the tree used longest ago
+        tree_cache[fingerprint] = {}
+    properties = tree_cache.pop(fingerprint)
+    tree_cache[fingerprint] = properties  # now the most recently used
+    if name not in properties:
+        if name == 'connectivity':
+            value = pg_utilities.element_connectivity_1D(node_loc, elems)
+        elif name == 'terminals':
+            value = calc_terminal_branch(node_loc, elems)
+        elif name == 'orders':
+            value = evaluate_orders(node_loc, elems)
+        elif name == 'lengths':
+            ends = np.asarray(node_loc, dtype=float)[np.asarray(elems, dtype=int)[:, 1:3]]
+            value = np.linalg.norm(ends[:, 0, 1:4] - ends[:, 1, 1:4], axis=1)
+        elif name == 'terminal_coords':
+            terminals = tree_property(node_loc, elems, 'terminals')
+            value = np.asarray(node_loc, dtype=float)[terminals['terminal_nodes'], 1:4]
+        else:
+            raise ValueError('Unknown tree property ' + str(name))
+        properties[name] = read_only(value)
+
+    return properties[name]
+
+
+def tree_fingerprint(node_loc, elems):
+    # Hash of the contents of a tree's node and element arrays
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for array in [np.ascontiguousarray(node_loc, dtype=float), np.ascontiguousarray(elems, dtype=int)]:
+        fingerprint.update(str(array.shape).encode())
+        fingerprint.update(array.data)
+
+    return fingerprint.hexdigest()
+
+
+def read_only(value):
+    # Marks an array, or the arrays in a dict, as read only
+    if isinstance(value, dict):
+        for key in value:
+            read_only(value[key])
+    elif isinstance(value, np.ndarray):
+        value.flags.writeable = False
+
+    return value
+
+
 def define_radius_by_order(node_loc, elems, system, inlet_elem, inlet_radius, radius_ratio):
     # This function defines radii in a branching tree by 'order' of the vessel
     # Inputs are:
@@ -133,7 +194,7 @@ def define_radius_by_order(node_loc, elems, system, inlet_elem, inlet_radius, ra
     num_elems = len(elems)
     radius = np.zeros(num_elems)  # initialise radius array
     # Evaluate orders in the system
-    orders = evaluate_orders(node_loc, elems)
+    orders = tree_property(node_loc, elems, 'orders')
     elem_order = orders[system]
     ne = inlet_elem
     n_max_ord = elem_order[ne]
@@ -155,7 +216,7 @@ def tree_statistics(node_loc, elems, radius, orders):
 
     num_elems = len(elems)
     diameters = 2.0 * radius
-    connectivity = pg_utilities.element_connectivity_1D(node_loc, elems)
+    connectivity = tree_property(node_loc, elems, 'connectivity')
     elem_upstream = connectivity['elem_up']
     elem_downstream = connectivity['elem_down']
     num_schemes = 3
@@ -167,7 +228,7 @@ def tree_statistics(node_loc, elems, radius, orders):
 
     # local arrays
     # length array
-    lengths = np.zeros(num_elems)
+    lengths = tree_property(node_loc, elems, 'lengths')
     # ratios: index i is order, index j is ratios of branching (j=1), length (j=2), and diameter (j=3)
 
     nbranches = np.zeros((num_schemes + 1, num_elems))
@@ -175,13 +236,6 @@ def tree_statistics(node_loc, elems, radius, orders):
     # j = 0 length, j = 1 diameter, j = 4 L/D
     branches = np.zeros((5, num_elems))
 
-    for ne in range(0, num_elems):
-        np1 = elems[ne][1]
-        np2 = elems[ne][2]
-        point1 = node_loc[np1][1:4]
-        point2 = node_loc[np2][1:4]
-        lengths[ne] = np.linalg.norm(point1 - point2)
-
     ntotal = 0
     num_dpp = 0
     num_llp = 0
@@ -294,7 +348,7 @@ def terminals_in_sampling_grid(rectangular_mesh, placenta_list, terminal_list, n
     return {'terminals_in_grid': terminals_in_grid, 'terminal_elems': terminal_elems}
 
 
-def ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, num_test_points):
+def ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, num_test_points, symmetry=False):
     # This subroutine calculates the placental volume associated with each element in a samplling grid
     # inputs are:
     # rectangular_mesh = the sampling grid nodes and elements
@@ -302,108 +356,324 @@ def ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, num
     # thickness = placental thickness
     # ellipiticity = placental ellipticity
     # num_test_points = resolution of integration quadrature
+    # symmetry = if True, only calculate the volume of the elements in one octant and mirror it to the others (falls
+    #   back to every element if the grid is not symmetric about the origin, see grid_octant_cells)
     total_elems = rectangular_mesh['total_elems']
-    elems = rectangular_mesh['elems']
-    nodes = rectangular_mesh['nodes']
+    elems = np.asarray(rectangular_mesh['elems'])
+    nodes = np.asarray(rectangular_mesh['nodes'], dtype=float)
     radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
     z_radius = radii['z_radius']
     x_radius = radii['x_radius']
     y_radius = radii['y_radius']
 
-    # Initialise the array that defines the volume of placenta in each grid element
-    pl_vol_in_grid = np.zeros(total_elems)
-    non_empty_loc = np.zeros(total_elems, dtype=int)
-    non_empty_count = 0
-
-    for ne in range(0, len(elems)):  # looping through elements
-        count_in_range = 0
-        nod_in_range = np.zeros(8, dtype=int)
-        # define range of x, y , and z in the element
-        startx = nodes[elems[ne][1]][0]
-        endx = nodes[elems[ne][8]][0]
-        starty = nodes[elems[ne][1]][1]
-        endy = nodes[elems[ne][8]][1]
-        startz = nodes[elems[ne][1]][2]
-        endz = nodes[elems[ne][8]][2]
-        for nod in range(1, 9):
-            check_in_range = pg_utilities.check_in_ellipsoid(nodes[elems[ne][nod]][0], nodes[elems[ne][nod]][1],
-                                                             nodes[elems[ne][nod]][2], x_radius, y_radius, z_radius)
-            check_on_range = pg_utilities.check_on_ellipsoid(nodes[elems[ne][nod]][0], nodes[elems[ne][nod]][1],
-                                                             nodes[elems[ne][nod]][2], x_radius, y_radius, z_radius)
-            if check_in_range or check_on_range:
-                count_in_range = count_in_range + 1
-                nod_in_range[nod - 1] = 1
-        if count_in_range == 8:  # if all 8 nodes are inside the ellipsoid
-            non_empty_loc[non_empty_count] = ne
-            non_empty_count = non_empty_count + 1
-            pl_vol_in_grid[ne] = (endx - startx) * (endy - starty) * (
-                    endz - startz)  # the placental vol in that samp_grid_el is same as vol of samp_grid_el
-        elif count_in_range == 0:  # if all 8 nodes are outside the ellpsiod
-            # since this samp_grid_el is completely outside, the placental vol is zero
-            pl_vol_in_grid[ne] = 0
-        else:  # if some nodes in and some nodes out, the samp_grid_el is at the edge of ellipsoid
-            # Use trapezoidal quadrature to caculate the volume under the surface of the ellipsoid in each element
-            non_empty_loc[non_empty_count] = ne
-            non_empty_count = non_empty_count + 1
-            # need to map to positive quadrant
-            repeat = False
-            if (startz < 0 and endz <= 0):
-                # need to project to positive z axis
-                startz = abs(nodes[elems[ne][8]][2])
-                endz = abs(nodes[elems[ne][1]][2])
-            elif (startz < 0 and endz > 0):
-                # Need to split into components above and below the axis and sum the two
-                startz = 0
-                endz = abs(nodes[elems[ne][1]][2])
-                startz_2 = 0
-                endz_2 = nodes[elems[ne][8]][2]
-                repeat = True
-            xVector = np.linspace(startx, endx, num_test_points)
-            yVector = np.linspace(starty, endy, num_test_points)
-            xv, yv = np.meshgrid(xVector, yVector)
-            zv = z_radius ** 2 * (1 - (xv / x_radius) ** 2 - (yv / y_radius) ** 2)
-            for i in range(num_test_points):
-                for j in range(num_test_points):
-                    if zv[i, j] <= startz ** 2:
-                        zv[i, j] = startz ** 2
-                    zv[i, j] = np.sqrt(zv[i, j])
-                    if zv[i, j] > endz:
-                        zv[i, j] = endz
-                    elif zv[i, j] < startz:
-                        zv[i, j] = startz
-            intermediate = np.zeros(num_test_points)
-            for i in range(0, num_test_points):
-                intermediate[i] = np.trapz(zv[:, i], xVector)
-            Value1 = np.trapz(intermediate, yVector)
-            pl_vol_in_grid[ne] = (Value1 - startz * (endx - startx) * (endy - starty))
-            if repeat:
-                xVector = np.linspace(startx, endx, num_test_points)
-                yVector = np.linspace(starty, endy, num_test_points)
-                xv, yv = np.meshgrid(xVector, yVector)
-                zv = z_radius ** 2 * (1 - (xv / x_radius) ** 2 - (yv / y_radius) ** 2)
-                for i in range(num_test_points):
-                    for j in range(num_test_points):
-                        if zv[i, j] <= startz_2 ** 2:
-                            zv[i, j] = startz_2 ** 2
-                        zv[i, j] = np.sqrt(zv[i, j])
-                        if zv[i, j] > endz_2:
-                            zv[i, j] = endz_2
-                        elif zv[i, j] < startz_2:
-                            zv[i, j] = startz_2
-                intermediate = np.zeros(num_test_points)
-                for i in range(0, num_test_points):
-                    intermediate[i] = np.trapz(zv[:, i], xVector)
-                Value1 = np.trapz(intermediate, yVector)
-                pl_vol_in_grid[ne] = pl_vol_in_grid[ne] + (Value1 - startz_2 * (endx - startx) * (
-                        endy - starty))
-
-    print('Number of Non-empty cells: ' + str(non_empty_count))
+    octant = None
+    if symmetry:
+        octant = grid_octant_cells(nodes, elems)
+        if octant is None:
+            print('WARNING: sampling grid is not symmetric about the origin, calculating every element')
+    if octant is None:
+        cells = np.arange(total_elems)
+    else:
+        cells = octant['cells']
+
+    # Initialise the array that defines the volume of placenta in each grid element calculated
+    pl_vol_in_grid = np.zeros(len(cells))
+
+    # count the nodes of each element that are in or on the ellipsoid, all elements at once
+    corners = nodes[elems[cells, 1:9]]
+    coord_check = (corners[:, :, 0] / x_radius) ** 2 + (corners[:, :, 1] / y_radius) ** 2 + (
+            corners[:, :, 2] / z_radius) ** 2
+    count_in_range = np.sum((coord_check < 1.0) | (np.abs(coord_check - 1.0) < 1e-14), axis=1)
+    # define range of x, y , and z in each element
+    start = corners[:, 0, :]
+    end = corners[:, 7, :]
+
+    # if all 8 nodes are inside the ellipsoid the placental vol in that samp_grid_el is same as vol of samp_grid_el
+    # if all 8 nodes are outside the ellpsiod the placental vol is zero
+    inside = np.flatnonzero(count_in_range == 8)
+    pl_vol_in_grid[inside] = (end[inside, 0] - start[inside, 0]) * (end[inside, 1] - start[inside, 1]) * (
+            end[inside, 2] - start[inside, 2])
+
+    # if some nodes in and some nodes out, the samp_grid_el is at the edge of ellipsoid. Use trapezoidal quadrature to
+    # calculate the volume under the surface of the ellipsoid in each element, mapped to the positive z quadrant
+    edge = np.flatnonzero((count_in_range > 0) & (count_in_range < 8))
+    startz = start[edge, 2]
+    endz = end[edge, 2]
+    below = (startz < 0) & (endz <= 0)  # project to positive z axis
+    across = (startz < 0) & (endz > 0)  # split into components above and below the axis and sum the two
+    z_from = np.where(below, np.abs(endz), np.where(across, 0.0, startz))
+    z_to = np.where(below | across, np.abs(startz), endz)
+    pl_vol_in_grid[edge] = trapezoid_volume_under_ellipsoid(start[edge, 0], end[edge, 0], start[edge, 1],
+                                                            end[edge, 1], z_from, z_to, radii, num_test_points)
+    split = edge[across]
+    pl_vol_in_grid[split] = pl_vol_in_grid[split] + trapezoid_volume_under_ellipsoid(
+        start[split, 0], end[split, 0], start[split, 1], end[split, 1], np.zeros(len(split)), end[split, 2], radii,
+        num_test_points)
+    if octant is not None:
+        pl_vol_in_grid = pl_vol_in_grid[octant['mirror']]
+        count_in_range = count_in_range[octant['mirror']]
+
+    non_empty_loc = np.flatnonzero(count_in_range > 0)
+    print('Number of Non-empty cells: ' + str(len(non_empty_loc)))
     print('Total number of cells: ' + str(total_elems))
-    non_empty_loc = np.resize(non_empty_loc, non_empty_count)
 
     return {'pl_vol_in_grid': pl_vol_in_grid, 'non_empty_rects': non_empty_loc}
 
 
+def grid_octant_cells(nodes, elems):
+    # The elements of a sampling grid that is symmetric about the origin (as from gen_rectangular_mesh) needed to
+    # find a value for every element when the value is the same for an element and its mirror images in the x, y and
+    # z planes. Returns cells, the elements to calculate (those in the octant with coordinates >= 0 where they are in
+    # the grid), and mirror, for each element the position in cells of its mirror image. The distinct coordinates of
+    # the nodes along each axis have to be symmetric about 0 (pg_utilities.mirror_fold), and None is returned if not
+    elems = np.asarray(elems)
+    key = np.zeros(len(elems), dtype=np.int64)
+    upper = np.ones(len(elems), dtype=bool)
+    for nj in range(0, 3):
+        coords = np.unique(nodes[:, nj])
+        fold = pg_utilities.mirror_fold(coords)
+        if fold is None:
+            return None
+        index = np.searchsorted(coords, nodes[:, nj])
+        start = index[elems[:, 1]]
+        end = index[elems[:, 8]]
+        # an element and its mirror image fold onto the same pair of coordinates, numbered in the order they come
+        pairs, pair = np.unique(np.minimum(fold[start], fold[end]) * len(coords) + np.maximum(fold[start], fold[end]),
+                                return_inverse=True)
+        key = key * len(pairs) + pair
+        upper = upper & (start + end >= len(coords) - 1)
+    # elements in the upper octant come first, so they are the ones calculated where they are in the grid
+    order = np.argsort(~upper, kind='stable')
+    found, first, inverse = np.unique(key[order], return_index=True, return_inverse=True)
+    mirror = np.zeros(len(elems), dtype=int)
+    mirror[order] = inverse
+
+    return {'cells': order[first], 'mirror': mirror}
+
+
+grid_chunk_bytes = 1 << 26  # size of the (cells x points x points) arrays integrated at a time
+
+
+def trapezoid_volume_under_ellipsoid(startx, endx, starty, endy, startz, endz, radii, num_test_points):
+    # Volume of ellipsoid (radii from pg_utilities.calculate_ellipse_radii) in each box startx..endx, starty..endy,
+    # startz..endz (arrays of one entry per box, z >= 0) with num_test_points x num_test_points trapezoidal
+    # quadrature of the clamped ellipsoid surface height. Boxes are integrated a chunk at a time as
+    # (boxes x points x points) arrays. The sums are taken along contiguous rows in the same order as np.trapz of
+    # one box, so the result is bit for bit the same as integrating the boxes one by one
+    volumes = np.zeros(len(startx))
+    points = np.arange(0, num_test_points, dtype=float)
+    chunk = max(1, int(grid_chunk_bytes // (8 * num_test_points ** 2)))
+    for first in range(0, len(startx), chunk):
+        box = slice(first, first + chunk)
+        xVector = box_linspace(startx[box], endx[box], points)
+        yVector = box_linspace(starty[box], endy[box], points)
+        start2 = (startz[box] ** 2)[:, None, None]
+        # zv[box, i, j] is the height at x = xVector[j], y = yVector[i], as from np.meshgrid(xVector, yVector)
+        zv = radii['z_radius'] ** 2 * (1 - (xVector[:, None, :] / radii['x_radius']) ** 2 - (
+                yVector[:, :, None] / radii['y_radius']) ** 2)
+        zv = np.sqrt(np.where(zv <= start2, start2, zv))
+        z_lo = startz[box][:, None, None]
+        z_hi = endz[box][:, None, None]
+        zv = np.where(zv > z_hi, z_hi, np.where(zv < z_lo, z_lo, zv))
+        # trapezoidal rule down each column of zv (against xVector as in the loop version), then along the result
+        zv = np.ascontiguousarray(np.swapaxes(zv, 1, 2))
+        dx = np.diff(xVector, axis=1)[:, None, :]
+        intermediate = np.add.reduce(dx * (zv[:, :, 1:] + zv[:, :, :-1]) / 2.0, axis=-1)
+        dy = np.diff(yVector, axis=1)
+        Value1 = np.add.reduce(dy * (intermediate[:, 1:] + intermediate[:, :-1]) / 2.0, axis=-1)
+        volumes[box] = Value1 - startz[box] * (endx[box] - startx[box]) * (endy[box] - starty[box])
+
+    return volumes
+
+
+def box_linspace(start, stop, points):
+    # np.linspace(start[n], stop[n], len(points)) for every n, computed as np.linspace does for one (points is
+    # np.arange(0, num_points) as floats)
+    values = points[None, :] * ((stop - start) / (len(points) - 1))[:, None] + start[:, None]
+    values[:, -1] = stop
+
+    return values
+
+
+def ellipse_volume_to_grid_adaptive(rectangular_mesh, volume, thickness, ellipticity, tolerance=1e-8):
+    # Calculates the placental volume in each element of a sampling grid, as ellipse_volume_to_grid, to a given
+    # accuracy rather than with a fixed quadrature resolution
+    # inputs are:
+    # rectangular_mesh = the sampling grid nodes and elements
+    # volume = placental volume
+    # thickness = placental thickness
+    # ellipiticity = placental ellipticity
+    # tolerance = largest error allowed in the total placental volume of the grid (shared between the elements
+    #   that are cut by the surface of the ellipsoid, in proportion to their size). Parts of an element are not
+    #   refined beyond the round-off error of their volume, so a tolerance below that (even 0) gives the most
+    #   accurate volumes that can be found rather than running on (see adaptive_gauss_legendre)
+    # Elements inside the ellipsoid have the volume of the element. For elements cut by its surface, the volume is
+    # integrated in x and z exactly and in y by adaptive Gauss-Legendre quadrature. vol_error_in_grid is the
+    # estimated error of the volume in each element
+    total_elems = rectangular_mesh['total_elems']
+    elems = np.asarray(rectangular_mesh['elems'])
+    nodes = np.asarray(rectangular_mesh['nodes'], dtype=float)
+    radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
+    scale = np.array([radii['x_radius'], radii['y_radius'], radii['z_radius']])
+
+    pl_vol_in_grid = np.zeros(total_elems)
+    vol_error_in_grid = np.zeros(total_elems)
+    corners = nodes[elems[:, 1:9]]
+    start = np.min(corners, axis=1)
+    end = np.max(corners, axis=1)
+    # scaled so that the ellipsoid is the unit sphere, an element is inside if all its corners are and cut by the
+    # surface if it is not inside and its point closest to the centre is
+    coord_check = np.sum((corners / scale) ** 2, axis=2)
+    inside = np.all(coord_check <= 1.0, axis=1)
+    closest = np.sum((np.clip(0.0, start, end) / scale) ** 2, axis=1)
+    edge = np.flatnonzero(~inside & (closest < 1.0))
+    pl_vol_in_grid[inside] = np.prod(end[inside] - start[inside], axis=1)
+
+    if len(edge) > 0:
+        # the volume of an element is the integral over y of the area of its x-z section, found exactly. The section
+        # is only non-zero for |y| < y_section, so the quadrature is kept to that range and cannot miss a small
+        # part of the ellipsoid that just reaches into the element
+        closest_xz = np.sum((np.clip(0.0, start[edge][:, [0, 2]], end[edge][:, [0, 2]]) / scale[[0, 2]]) ** 2, axis=1)
+        y_section = radii['y_radius'] * np.sqrt(np.maximum(1.0 - closest_xz, 0.0))
+        y_from = np.maximum(start[edge, 1], -y_section)
+        y_to = np.minimum(end[edge, 1], y_section)
+        # the section area has kinks where the edges of its flat top and of the ellipse pass the corners of the
+        # element, so the range is split there and the quadrature only sees smooth pieces
+        kinks = [np.zeros(len(edge))]
+        for x in [start[edge, 0], end[edge, 0], np.zeros(len(edge))]:
+            for z in [start[edge, 2], end[edge, 2], np.zeros(len(edge))]:
+                kink = radii['y_radius'] * np.sqrt(np.maximum(1.0 - (x / scale[0]) ** 2 - (z / scale[2]) ** 2, 0.0))
+                kinks = kinks + [kink, -kink]
+        breaks = np.sort(np.column_stack([y_from, y_to] + kinks), axis=1)
+        breaks = np.clip(breaks, y_from[:, None], y_to[:, None])
+        piece_cell = np.repeat(np.arange(len(edge)), breaks.shape[1] - 1)
+        piece_from = breaks[:, :-1].ravel()
+        piece_to = breaks[:, 1:].ravel()
+        cell_volume = np.prod(end[edge] - start[edge], axis=1)
+        piece_tolerance = tolerance * cell_volume[piece_cell] / np.sum(cell_volume) * np.divide(
+            piece_to - piece_from, (y_to - y_from)[piece_cell], out=np.zeros(len(piece_cell)),
+            where=y_to[piece_cell] > y_from[piece_cell])
+        section = lambda piece, y: ellipsoid_section_area(y, start[edge[piece_cell[piece]], 0],
+                                                          end[edge[piece_cell[piece]], 0],
+                                                          start[edge[piece_cell[piece]], 2],
+                                                          end[edge[piece_cell[piece]], 2], radii)
+        # the section area is a difference of integrals over the x-z extent of the element, so its round-off is
+        # relative to the area of the element in x-z
+        area_xz = (end[edge, 0] - start[edge, 0]) * (end[edge, 2] - start[edge, 2])
+        integral = adaptive_gauss_legendre(section, piece_from, piece_to, piece_tolerance, area_xz[piece_cell])
+        np.add.at(pl_vol_in_grid, edge[piece_cell], integral['integral'])
+        np.add.at(vol_error_in_grid, edge[piece_cell], integral['error'])
+
+    non_empty_loc = np.flatnonzero(pl_vol_in_grid > 0)
+    print('Number of Non-empty cells: ' + str(len(non_empty_loc)))
+    print('Total number of cells: ' + str(total_elems))
+
+    return {'pl_vol_in_grid': pl_vol_in_grid, 'non_empty_rects': non_empty_loc, 'vol_error_in_grid': vol_error_in_grid}
+
+
+def ellipsoid_section_area(y, startx, endx, startz, endz, radii):
+    # Area of the section at y of the ellipsoid (radii from pg_utilities.calculate_ellipse_radii) inside the
+    # rectangles startx..endx, startz..endz (arrays, one value of each per rectangle)
+    # With h(x) the height of the ellipsoid above the x-y plane, this is the integral over x of the overlap of
+    # startz..endz with -h..h, which is capped(endz) - capped(startz) for capped(z) the integral of sign(z) min(|z|, h)
+    c = np.maximum(1.0 - (y / radii['y_radius']) ** 2, 0.0)
+
+    return np.sign(endz) * capped_section_integral(np.abs(endz), c, startx, endx, radii) - np.sign(
+        startz) * capped_section_integral(np.abs(startz), c, startx, endx, radii)
+
+
+def capped_section_integral(t, c, startx, endx, radii):
+    # Integral from startx to endx of min(t, h(x)), h(x) = z_radius sqrt(c - (x / x_radius)^2) (0 where that is not
+    # real). h >= t for |x| <= b and h > 0 for |x| < a, and h has the antiderivative
+    # z_radius / x_radius (x r + a^2 arctan(x / r)) / 2 with r = sqrt(a^2 - x^2), which (unlike the arcsin form)
+    # stays accurate near |x| = a as it does not change to first order with a rounding error in r
+    a = radii['x_radius'] * np.sqrt(c)
+    b = radii['x_radius'] * np.sqrt(np.maximum(c - (t / radii['z_radius']) ** 2, 0.0))
+
+    def h_integral(bound):
+        # integral of h over startx..endx clipped to -bound..bound
+        x = np.stack([np.clip(startx, -bound, bound), np.clip(endx, -bound, bound)])
+        r = np.sqrt(np.maximum((a - np.abs(x)) * (a + np.abs(x)), 0.0))
+        antiderivative = (x * r + a ** 2 * np.arctan2(x, r)) / 2
+        return radii['z_radius'] / radii['x_radius'] * (antiderivative[1] - antiderivative[0])
+
+    capped_length = np.maximum(np.minimum(endx, b) - np.maximum(startx, -b), 0.0)
+
+    return t * capped_length + h_integral(a) - h_integral(b)
+
+
+gauss_legendre_points = 8  # order of the Gauss-Legendre rule of adaptive_gauss_legendre
+adaptive_max_levels = 40  # times an interval can be halved by adaptive_gauss_legendre
+adaptive_roundoff = 100 * np.finfo(float).eps  # relative error of an interval that is accepted whatever the tolerance
+adaptive_chunk_size = 1 << 16  # integrals that adaptive_gauss_legendre works on at a time
+adaptive_max_intervals = 1 << 18  # intervals that adaptive_gauss_legendre can be working on at a time
+
+
+def adaptive_gauss_legendre(function, lower, upper, tolerance, scale=None):
+    # Integrals of function(n, x) over x from lower[n] to upper[n] for every n, each to within tolerance[n]
+    # (function takes arrays of n and x of the same length). An interval is accepted when the Gauss-Legendre rule
+    # over it and the sum over its two halves differ by no more than its share of tolerance (that difference is the
+    # error estimate), and otherwise its halves are tried. A share of tolerance smaller than the round-off error of
+    # the integral over the interval can't be reached, so an interval is also accepted when the difference is within
+    # adaptive_roundoff of scale[n] (the size of the terms function(n, x) is found from, if they cancel) times the
+    # length of the interval, or of the integral over the interval if scale is not given. The integrals are worked
+    # on adaptive_chunk_size at a time, with all their intervals at once. If an interval has been halved
+    # adaptive_max_levels times, or there would be more than adaptive_max_intervals intervals, the intervals left are
+    # accepted with a warning
+    # Returns integral and error, arrays with an entry per n
+    abscissae, weights = np.polynomial.legendre.leggauss(gauss_legendre_points)
+    integral = np.zeros(len(lower))
+    error = np.zeros(len(lower))
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=float), lower.shape)
+    if scale is not None:
+        scale = np.broadcast_to(np.asarray(scale, dtype=float), lower.shape)
+
+    def rule(owner, left, right):
+        x = (left[:, None] + right[:, None]) / 2.0 + (right - left)[:, None] / 2.0 * abscissae[None, :]
+        values = function(np.repeat(owner, len(abscissae)), x.ravel()).reshape(x.shape)
+        return (right - left) / 2.0 * np.sum(values * weights[None, :], axis=1)
+
+    not_reached = 0
+    to_integrate = np.flatnonzero(upper > lower)
+    for first in range(0, len(to_integrate), adaptive_chunk_size):
+        owner = to_integrate[first:first + adaptive_chunk_size]
+        left = lower[owner]
+        right = upper[owner]
+        length = right - left  # length of the whole range of each n, for its share of tolerance
+        whole = rule(owner, left, right)
+        for level in range(0, adaptive_max_levels + 1):
+            middle = (left + right) / 2.0
+            halves = rule(np.concatenate([owner, owner]), np.concatenate([left, middle]),
+                          np.concatenate([middle, right]))
+            left_half = halves[0:len(owner)]
+            right_half = halves[len(owner):]
+            estimate = np.abs(left_half + right_half - whole)
+            if scale is None:
+                roundoff = adaptive_roundoff * np.abs(left_half + right_half)
+            else:
+                roundoff = adaptive_roundoff * scale[owner] * (right - left)
+            share = np.maximum(tolerance[owner] * (right - left) / length, roundoff)
+            done = estimate <= share
+            if level == adaptive_max_levels or 2 * np.count_nonzero(~done) > adaptive_max_intervals:
+                not_reached = not_reached + np.count_nonzero(~done)
+                done[:] = True
+            np.add.at(integral, owner[done], left_half[done] + right_half[done])
+            np.add.at(error, owner[done], estimate[done])
+            if np.all(done):
+                break
+            keep = ~done
+            owner = np.concatenate([owner[keep], owner[keep]])
+            length = np.concatenate([length[keep], length[keep]])
+            whole = np.concatenate([left_half[keep], right_half[keep]])
+            left, right = np.concatenate([left[keep], middle[keep]]), np.concatenate([middle[keep], right[keep]])
+    if not_reached > 0:
+        print('WARNING: adaptive quadrature did not reach the tolerance in ' + str(not_reached) + ' intervals')
+
+    return {'integral': integral, 'error': error}
+
+
 def cal_br_vol_samp_grid(rectangular_mesh, eldata, nodedata, volume, thickness, ellipticity, p_vol):
     '''
     This subroutine is to:
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import numpy as np
+
+from . import pg_utilities
+
+"""
+.. module:: compact_tree
+  :synopsis: Trees stored as contiguous coordinate and element arrays with CSR connectivity.
+
+:synopsis: A compact tree is a dict of
+  coords = number of nodes x 3 array of node locations (node n is row n),
+  edges = number of elements x 2 array of the start and end node of each element (element ne is row ne),
+  child_offsets, children = the children of element ne are children[child_offsets[ne]:child_offsets[ne + 1]],
+  parent_offsets, parents = the parents of element ne are parents[parent_offsets[ne]:parent_offsets[ne + 1]].
+  Element and node numbers are not stored, and an element can have any number of children. Node and element indices
+  are 32 bit integers unless the tree is too big for them. geom_from_compact_tree and compact_tree_from_geom convert
+  to and from the geometry dicts (nodes, elems, elem_up, elem_down) used by the rest of placentagen.
+
+"""
+
+
+def compact_tree(coords, edges):
+    # Builds a compact tree from node locations (number of nodes x 3) and the start and end nodes of each element
+    # (number of elements x 2). The children of an element are the elements that start at its end node, its parents
+    # the elements that end at its start node, each in element order
+    coords = np.ascontiguousarray(coords, dtype=float)
+    index_type = index_dtype(max(len(coords), len(edges)) + 1)
+    edges = np.ascontiguousarray(edges, dtype=index_type)
+    elems_from = pg_utilities.group_by_index(edges[:, 0], len(coords))
+    elems_to = pg_utilities.group_by_index(edges[:, 1], len(coords))
+    children = pg_utilities.gather_groups(elems_from, edges[:, 1])
+    parents = pg_utilities.gather_groups(elems_to, edges[:, 0])
+
+    return {'coords': coords, 'edges': edges, 'child_offsets': children['offsets'].astype(index_type),
+            'children': children['members'].astype(index_type),
+            'parent_offsets': parents['offsets'].astype(index_type), 'parents': parents['members'].astype(index_type)}
+
+
+def index_dtype(max_index):
+    # Smallest integer type used to store node and element indices up to max_index
+    if max_index < np.iinfo(np.int32).max:
+        return np.int32
+
+    return np.int64
+
+
+def compact_tree_from_geom(geom):
+    # Compact tree of a geometry dict (nodes, elems, ...). Nodes and elements are taken in row order, which is their
+    # number in the geometries placentagen makes, and connectivity is found again from the nodes elements share
+    nodes = np.asarray(geom['nodes'], dtype=float)
+    elems = np.asarray(geom['elems'])
+
+    return compact_tree(nodes[:, 1:4], elems[:, 1:3])
+
+
+def geom_from_compact_tree(tree):
+    # Geometry dict (nodes, elems, elem_up, elem_down) of a compact tree, so it can be used by the rest of placentagen
+    # elem_up and elem_down have a column for the count and then one per parent or child, at least three columns as
+    # usual, and more if an element has more than two children or parents
+    num_nodes = len(tree['coords'])
+    num_elems = len(tree['edges'])
+    nodes = np.zeros((num_nodes, 4))
+    nodes[:, 0] = np.arange(num_nodes)
+    nodes[:, 1:4] = tree['coords']
+    elems = np.zeros((num_elems, 3), dtype=int)
+    elems[:, 0] = np.arange(num_elems)
+    elems[:, 1:3] = tree['edges']
+
+    return {'nodes': nodes, 'elems': elems,
+            'elem_up': pg_utilities.padded_connectivity(tree['parent_offsets'], tree['parents']),
+            'elem_down': pg_utilities.padded_connectivity(tree['child_offsets'], tree['children'])}
+
+
+def children_of(tree, ne):
+    # Children of element ne, a view into the compact tree
+    return tree['children'][tree['child_offsets'][ne]:tree['child_offsets'][ne + 1]]
+
+
+def parents_of(tree, ne):
+    # Parents of element ne, a view into the compact tree
+    return tree['parents'][tree['parent_offsets'][ne]:tree['parent_offsets'][ne + 1]]
+
+
+def num_children(tree):
+    # Number of children of every element
+    return np.diff(tree['child_offsets'])
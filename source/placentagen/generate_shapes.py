@@ -13,7 +13,7 @@ from . import pg_utilities
  
 """
 
-def equispaced_data_in_ellipsoid(n, volume, thickness, ellipticity):
+def equispaced_data_in_ellipsoid(n, volume, thickness, ellipticity, symmetry=False):
     """ Generates equally spaced data points in an ellipsoid.
 
     Inputs:
@@ -21,6 +21,8 @@ def equispaced_data_in_ellipsoid(n, volume, thickness, ellipticity):
        - volume: volume of ellipsoid
        - thickness: placental thickness (z-dimension)
        - ellipticity: ratio of y to x axis dimensions
+       - symmetry: if True, only test the points of one octant of the grid against the ellipsoid and mirror the
+         result to the others (falls back to testing every point if the grid is not symmetric about the origin)
 
     Returns:
        - Edata: A nx3 array of datapoints, with each point being defined by its x-,y-, and z- coordinates
@@ -67,16 +69,35 @@ def equispaced_data_in_ellipsoid(n, volume, thickness, ellipticity):
     # Use these vectors to form a unifromly spaced grid
     data_coords = np.vstack(np.meshgrid(x_coord, y_coord, z_coord)).reshape(3, -1).T
 
-    # Store nodes that lie within ellipsoid
-    Edata = np.zeros((nd_x * nd_y * nd_z, 3))
-    for i in range(len(data_coords)):  # Loop through grid
-        coord_check = pg_utilities.check_in_ellipsoid(data_coords[i][0], data_coords[i][1], data_coords[i][2], x_radius,
-                                                      y_radius, z_radius)
-
-        if coord_check is True:  # Has to be strictly in the ellipsoid
-            Edata[num_data, :] = data_coords[i, :]  # add to data array
-            num_data = num_data + 1
-    Edata.resize(num_data, 3)  # resize data array to correct size
+    if symmetry:
+        folds = [pg_utilities.mirror_fold(x_coord), pg_utilities.mirror_fold(y_coord),
+                 pg_utilities.mirror_fold(z_coord)]
+        if any(fold is None for fold in folds):
+            print('WARNING: data grid is not symmetric about the origin, testing every point')
+            symmetry = False
+
+    if symmetry:
+        # Test the points with coordinates >= 0 (the upper half of each linspace), which are in the same order as the
+        # grid (y, then x, then z), and mirror the result to the other octants
+        x_half = x_coord[nd_x // 2:]
+        y_half = y_coord[nd_y // 2:]
+        z_half = z_coord[nd_z // 2:]
+        coord_check = (x_half[None, :, None] / x_radius) ** 2 + (y_half[:, None, None] / y_radius) ** 2 + (
+                z_half[None, None, :] / z_radius) ** 2
+        in_octant = coord_check < 1.0  # Has to be strictly in the ellipsoid
+        in_grid = in_octant[np.ix_(folds[1] - nd_y // 2, folds[0] - nd_x // 2, folds[2] - nd_z // 2)]
+        Edata = data_coords[in_grid.ravel()]
+    else:
+        # Store nodes that lie within ellipsoid
+        Edata = np.zeros((nd_x * nd_y * nd_z, 3))
+        for i in range(len(data_coords)):  # Loop through grid
+            coord_check = pg_utilities.check_in_ellipsoid(data_coords[i][0], data_coords[i][1], data_coords[i][2],
+                                                          x_radius, y_radius, z_radius)
+
+            if coord_check is True:  # Has to be strictly in the ellipsoid
+                Edata[num_data, :] = data_coords[i, :]  # add to data array
+                num_data = num_data + 1
+        Edata.resize(num_data, 3)  # resize data array to correct size
 
     print('Data points within ellipsoid allocated. Total = ' + str(len(Edata)))
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+import numpy as np
+
+from . import pg_utilities
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The loops below are compiled with numba (when it is installed) to give the 'numba' backend of
+# grow_tree.growth_kernels. They do the arithmetic of grow_tree's mesh_com, data_splitby_xy, data_splitby_plane,
+# data_to_mesh and give_back_to_parent in the same order so that trees are bit for bit the same as with the python
+# backend. Squares are taken as x ** power with power = 2.0 passed in at run time: Python squares a float with the C
+# pow function, whereas a constant exponent would be compiled to x * x, which rounds differently.
+# All five kernels are used by the loop engine of grow_chorionic_surface. The loop engine of grow_large_tree only uses
+# data_to_mesh, as it finds centres of mass, splits seed points and gives them back on slices of its seed partition
+# with numpy (grow_tree.seed_slice_com, split_seed_slice and closest_seed_in_slice), so backend='numba' does less there.
+
+compiled = {}  # compiled kernels, filled in the first time they are needed
+
+
+def mesh_com_loop(ld_val, ld, datapoints):
+    dat = 0
+    com = np.zeros(3)
+    for nd in range(0, len(datapoints)):
+        if ld[nd] == ld_val:
+            dat = dat + 1
+            for nj in range(0, 3):
+                com[nj] = com[nj] + datapoints[nd, nj]
+    if dat != 0:
+        com = com / dat
+
+    return com
+
+
+def splitby_xy_loop(ld, datapoints, x0, x1, ne_parent, ne_current):
+    npoints = 0
+    dat1 = 0
+    dat2 = 0
+    for nd in range(0, len(datapoints)):
+        if ld[nd] == ne_parent:
+            npoints = npoints + 1
+            checkvalue = (x1[0] - x0[0]) * (datapoints[nd, 1] - x0[1]) - (datapoints[nd, 0] - x0[0]) * (x1[1] - x0[1])
+            if checkvalue >= 0:
+                dat1 = dat1 + 1
+                ld[nd] = ne_current + 1
+            else:
+                dat2 = dat2 + 1
+                ld[nd] = ne_current + 2
+
+    return npoints, dat1, dat2
+
+
+def splitby_plane_loop(ld, datapoints, plane, ne_parent, ne_current):
+    npoints = 0
+    dat1 = 0
+    dat2 = 0
+    for nd in range(0, len(datapoints)):
+        if ld[nd] == ne_parent:
+            npoints = npoints + 1
+            checkvalue = 0.0
+            for i in range(0, 3):
+                checkvalue = checkvalue + plane[i] * datapoints[nd, i]
+            checkvalue = -1.0 * checkvalue - plane[3]
+            if checkvalue >= 0:
+                dat1 = dat1 + 1
+                ld[nd] = ne_current + 1
+            else:
+                dat2 = dat2 + 1
+                ld[nd] = ne_current + 2
+
+    return npoints, dat1, dat2
+
+
+def data_to_mesh_loop(ld, datapoints, parentlist, node_loc, elems, power):
+    for nd in range(0, len(datapoints)):
+        if ld[nd] != 0:
+            ne_min = 0
+            min_dist = 1e10
+            for noelem in range(0, len(parentlist)):
+                ne = parentlist[noelem]
+                nnod = elems[ne, 2]
+                dist = np.sqrt((node_loc[nnod, 1] - datapoints[nd, 0]) ** power +
+                               (node_loc[nnod, 2] - datapoints[nd, 1]) ** power +
+                               (node_loc[nnod, 3] - datapoints[nd, 2]) ** power)
+                if dist < min_dist:
+                    ne_min = ne
+                    min_dist = dist
+            ld[nd] = ne_min
+
+
+def give_back_to_parent_loop(ld, datapoints, ne_parent, ne_current, node, power):
+    min_dist = 1.0e10
+    nd_min = -1
+    for nd in range(0, len(datapoints)):
+        if ld[nd] != 0:
+            if ld[nd] == ne_current + 1:
+                ld[nd] = ne_parent
+            if ld[nd] == ne_current + 2:
+                ld[nd] = ne_parent
+            dist = np.sqrt((datapoints[nd, 0] - node[0]) ** power + (datapoints[nd, 1] - node[1]) ** power +
+                           (datapoints[nd, 2] - node[2]) ** power)
+            if dist < min_dist:
+                if ld[nd] == ne_parent:
+                    nd_min = nd
+                    min_dist = dist
+
+    return nd_min
+
+
+def compiled_kernels():
+    # Kernels with the same arguments and results as the python backend of grow_tree.growth_kernels, running the loops
+    # above compiled by numba. Returns None if numba is not installed
+    if numba is None:
+        return None
+    if len(compiled) == 0:
+        for loop in [mesh_com_loop, splitby_xy_loop, splitby_plane_loop, data_to_mesh_loop, give_back_to_parent_loop]:
+            compiled[loop.__name__] = numba.njit(loop)
+
+    return {'mesh_com': mesh_com, 'data_splitby_xy': data_splitby_xy, 'data_splitby_plane': data_splitby_plane,
+            'data_to_mesh': data_to_mesh, 'give_back_to_parent': give_back_to_parent}
+
+
+def mesh_com(ld_val, ld, datapoints):
+    return compiled['mesh_com_loop'](ld_val, np.asarray(ld), np.asarray(datapoints, dtype=float))
+
+
+def data_splitby_xy(ld, datapoints, x0, x1, ne_parent, ne_current, point_limit):
+    counts = compiled['splitby_xy_loop'](ld, np.asarray(datapoints, dtype=float), np.asarray(x0, dtype=float),
+                                         np.asarray(x1, dtype=float), ne_parent, ne_current)
+
+    return {'enough_points': enough_points(counts, point_limit)}
+
+
+def data_splitby_plane(ld, datapoints, x0, x1, x2, ne_parent, ne_current, point_limit):
+    colinear = pg_utilities.check_colinear(x0, x1, x2)
+    if colinear:
+        print('WARNING: Colinear is true')
+    plane = pg_utilities.plane_from_3_pts(x0, x1, x2, False)
+    counts = compiled['splitby_plane_loop'](ld, np.asarray(datapoints, dtype=float), plane, ne_parent, ne_current)
+
+    return {'enough_points': enough_points(counts, point_limit)}
+
+
+def enough_points(counts, point_limit):
+    # Whether a split (npoints, dat1, dat2) left enough seed points to branch, as in grow_tree.data_splitby_plane
+    npoints, dat1, dat2 = counts
+    ss = [True, True]
+    if npoints < point_limit:
+        ss[0] = False
+        ss[1] = False
+    else:
+        if dat1 < point_limit:
+            ss[0] = False
+        if dat2 < point_limit:
+            ss[0] = False
+
+    return ss
+
+
+def data_to_mesh(ld, datapoints, parentlist, node_loc, elems):
+    compiled['data_to_mesh_loop'](ld, np.asarray(datapoints, dtype=float), np.asarray(parentlist, dtype=int),
+                                  np.asarray(node_loc, dtype=float), np.asarray(elems, dtype=int), 2.0)
+
+    return ld
+
+
+def give_back_to_parent(ld, datapoints, ne_parent, ne_current, node):
+    return compiled['give_back_to_parent_loop'](ld, np.asarray(datapoints, dtype=float), ne_parent, ne_current,
+                                                np.asarray(node, dtype=float), 2.0)
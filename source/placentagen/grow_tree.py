@@ -1,50 +1,74 @@
 #!/usr/bin/env python
+import multiprocessing
+import os
+import time
+
 import numpy as np
 
+from . import analyse_tree
+from . import grow_kernels
 from . import pg_utilities
 
 
 def grow_large_tree(angle_max, angle_min, fraction, min_length, point_limit,
-                    volume, thickness, ellipticity, datapoints, initial_geom):
+                    volume, thickness, ellipticity, datapoints, initial_geom, vectorised=False, processes=1,
+                    reassign='full', backend=None, checkpoint=None, checkpoint_every=1, max_elements=None,
+                    max_generations=None, wall_time_budget=None, sink=None, orders=False, legacy_angles=False):
+    # vectorised = True grows each generation with array operations over all parents at once (see
+    # grow_generations), this gives the same tree as the loop below
+    # processes > 1 also grows the stems at the same time in that many worker processes
+    # reassign = 'incremental' (vectorised only) gives new parents only to the seed points of branches that have
+    # become terminals, rather than reassigning every seed point whenever any are lost (see grow_generations)
+    # backend = kernels for the loop below, 'python' or 'numba' (see growth_kernels). The vectorised engine has no
+    #   backends, so giving one for a run that is vectorised is an error. Here the backend only changes data_to_mesh:
+    #   the centre of mass, plane split and give back steps work on the contiguous slices of the seed partition
+    #   (seed_slice_com, split_seed_slice, closest_seed_in_slice) with numpy and are not compiled. The other compiled
+    #   kernels are used by grow_chorionic_surface
+    # checkpoint = file name, if given the state of growth is saved to this file every checkpoint_every generations
+    #   so that an interrupted run can be continued with resume_tree_growth. Checkpointed runs are vectorised
+    # max_elements, max_generations (of each stem), wall_time_budget (seconds) = budgets for growth. If any are given
+    #   growth stops at the end of a generation once a budget is reached, and the geometry returned has a 'status' of
+    #   which budget stopped growth (None if none did) and how many seed points were left unassigned. Runs with
+    #   budgets are vectorised
+    # sink = function called as sink(nodes, elems) with the nodes and elements of initial_geom and then with the new
+    #   nodes and elements of each generation as they are grown (rows as in the geometry returned), e.g. to write
+    #   them out with imports_and_exports.write_ex_stream. Runs with a sink are vectorised. The sink only streams
+    #   the output: the whole tree is still kept in memory while it grows and is returned as usual, so peak memory is
+    #   not reduced
+    # orders = True to keep track of the generation, Strahler and Horsfield order of each element as the tree grows,
+    #   these are returned as 'generation', 'strahler' and 'horsfield' in the geometry (the same as
+    #   analyse_tree.evaluate_orders gives for the grown tree). Runs with orders are vectorised
+    # legacy_angles = True to correct branch angles as earlier versions of placentagen did, which does not keep
+    #   branches in the range angle_min to angle_max but grows the same trees as those versions (see mesh_check_angles)
+    if vectorised or processes > 1 or reassign != 'full' or checkpoint is not None or max_elements is not None or \
+            max_generations is not None or wall_time_budget is not None or sink is not None or orders:
+        if backend is not None:
+            raise ValueError('backend ' + str(backend) + ' is for the loop engine, this run is vectorised')
+        return grow_large_tree_vectorised(angle_max, angle_min, fraction, min_length, point_limit,
+                                          volume, thickness, ellipticity, datapoints, initial_geom, processes,
+                                          reassign, checkpoint, checkpoint_every, max_elements, max_generations,
+                                          wall_time_budget, sink, orders, legacy_angles)
     # Calulate axis dimensions of ellipsoid with given volume, thickness and ellipticity
     radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
     z_radius = radii['z_radius']
     x_radius = radii['x_radius']
     y_radius = radii['y_radius']
 
-    # We can estimate the number of elements in the generated model based on the number of data (seed points) to
-    #  pre-allocate data arrays.
-    est_generation = int(np.ceil(np.log(len(datapoints)) / np.log(2)))
-    total_estimated = 0
-
-    for i in range(0, est_generation + 1):
-        total_estimated = total_estimated + 2 ** i
-    # Define the total number of nodes and elements prior to growing, plus the new number expected
-    num_elems_old = len(initial_geom["elems"])
-    num_nodes_old = len(initial_geom["nodes"])
-    num_elems_new = num_elems_old + total_estimated
-    num_nodes_new = num_nodes_old + total_estimated
-    original_data_length = len(datapoints)
-    # Pre-allocation of data arrays
-    # elem_directions = np.zeros((num_elems_new, 3))
-    # elem_order = np.zeros((num_elems_new, 3))
-    node_loc = np.zeros((num_nodes_new, 4))
-    node_loc[0:num_nodes_old][:] = initial_geom["nodes"]
-    elems = np.zeros((num_elems_new, 3), dtype=int)
-    elems[0:num_elems_old][:] = initial_geom["elems"]
-    elem_upstream = np.zeros((num_elems_new, 3), dtype=int)
-    elem_upstream[0:num_elems_old][:] = initial_geom['elem_up']
-    elem_downstream = np.zeros((num_elems_new, 3), dtype=int)
-    elem_downstream[0:num_elems_old][:] = initial_geom['elem_down']
+    # Node and element arrays, these grow as needed while the tree is grown (see reserve_grown_tree)
+    tree = allocate_grown_tree(initial_geom, len(datapoints))
+    node_loc = tree['nodes']
+    elems = tree['elems']
+    elem_upstream = tree['elem_up']
+    elem_downstream = tree['elem_down']
+    tb_list = tree['tb_list']  # list of terminal bronchioles
+    kernels = growth_kernels(backend)
 
     # local arrays
-    nstem = np.zeros((num_elems_new, 2), dtype=int)  # number of seeds per parent
     map_seed_to_elem = np.zeros(len(datapoints), dtype=int)  # seed to elem - initial array for groupings
-    tb_list = np.zeros(2 * len(datapoints), dtype=int)  # number of terminal bronchioles
 
     # Set initial values for local and global nodes and elements
-    ne = num_elems_old - 1  # current maximum element number
-    nnod = num_nodes_old - 1  # current maximum node number
+    ne = tree['ne']  # current maximum element number
+    nnod = tree['nnod']  # current maximum node number
     numtb = 0  # count of terminals
 
     parentlist = group_elem_parent_term(0, initial_geom['elem_down'])  # master parent list
@@ -54,29 +78,20 @@ def grow_large_tree(angle_max, angle_min, fraction, min_length, point_limit,
     # it; for multiple parents data_to_mesh is called to calculate
     # the closest parent end-point to each seed point.
     map_seed_to_elem = map_seed_to_elem + parentlist[0]
-    map_seed_to_elem = data_to_mesh(map_seed_to_elem, datapoints, parentlist, node_loc, elems)
+    map_seed_to_elem = kernels['data_to_mesh'](map_seed_to_elem, datapoints, parentlist, node_loc, elems)
+    # The seed points of each stem (and then of each branch grown from it) are a contiguous slice of one permuted
+    # copy of the data, so datapoints itself is never changed
+    seeds = partition_seeds(map_seed_to_elem, datapoints, len(elems))
 
     for npar in range(0, len(parentlist)):
         print('Generating children for parent ' + str(npar) + '(elem #' + str(parentlist[npar]) + ') of a total of ' + str(len(parentlist)))
         current_parent = parentlist[npar]
         num_next_parents = 1
-        data_current_parent = np.zeros((len(datapoints), 3))
-        nd_for_parent = 0
-        for nd in range(0, len(datapoints)):
-            if map_seed_to_elem[nd] == current_parent:
-                data_current_parent[nd_for_parent] = datapoints[nd][:]
-                map_seed_to_elem[nd] = 0
-                datapoints[nd][:] = 0
-                nd_for_parent = nd_for_parent + 1
-
-        datapoints = datapoints[np.nonzero(map_seed_to_elem)] #remove the datapoints you are currently analysing from master list
-        map_seed_to_elem = map_seed_to_elem[np.nonzero(map_seed_to_elem)] #remove parent you are currently analysing from master list
-        data_current_parent.resize(nd_for_parent, 3)
-        local_parent_temp = np.zeros(num_elems_new, dtype=int)  # rezero local parent arrays
-        local_parent = np.zeros(num_elems_new, dtype=int)
-        local_parent[0] = current_parent
-        map_seed_to_elem_new = np.zeros(len(data_current_parent), dtype=int)
-        map_seed_to_elem_new = map_seed_to_elem_new + current_parent
+        stem_first = seeds['first'][current_parent]
+        stem_last = seeds['last'][current_parent]
+        data_current_parent = seeds['points'][stem_first:stem_last]  # views into the partition
+        map_seed_to_elem_new = seeds['elem'][stem_first:stem_last]
+        local_parent = np.array([current_parent])
         remaining_data = len(data_current_parent)
         original_data = len(data_current_parent)
 
@@ -91,24 +106,32 @@ def grow_large_tree(angle_max, angle_min, fraction, min_length, point_limit,
             ngen = ngen + 1  # increment generation from parent for output
             num_parents = num_next_parents  # update the number of current parents
             num_next_parents = 0  # reset the number of local parents for next iteration
+            local_parent_temp = np.zeros(2 * num_parents, dtype=int)
             noelem_gen = 0
             for m in range(0, num_parents):
                 ne_parent = local_parent[m]
-                com = mesh_com(ne_parent, map_seed_to_elem_new, data_current_parent)
+                # Make room for the two branches (and their seed points) this parent could have
+                reserve_grown_tree(tree, ne + 3, nnod + 3)
+                reserve_rows(seeds, ['first', 'last'], ne + 3)
+                node_loc = tree['nodes']
+                elems = tree['elems']
+                elem_upstream = tree['elem_up']
+                elem_downstream = tree['elem_down']
+                tb_list = tree['tb_list']
+                com = seed_slice_com(seeds, ne_parent)
                 np_start = int(elems[ne_parent][2])
                 np_prt_start = int(elems[ne_parent][1])
                 # Split the seed points by the plane defined by the parent branch and the com of the
                 # seedpoints attached to it
-                split_data = data_splitby_plane(map_seed_to_elem_new, data_current_parent, com,
-                                                node_loc[np_prt_start][1:4],
-                                                node_loc[np_start][1:4], ne_parent, ne, point_limit)
+                split_data = split_seed_slice(seeds, com, node_loc[np_prt_start][1:4], node_loc[np_start][1:4],
+                                              ne_parent, ne, point_limit)
                 # Check that there ar enough seedpoints in both groups to proceed
                 # Note long term one could allow one group to continue and the other not to
                 if split_data['enough_points'][0] and split_data['enough_points'][1]:
                     for n in range(0, 2):
                         branch = True
                         # Calculate centre of mass to grow toward
-                        com = mesh_com(ne + 1, map_seed_to_elem_new, data_current_parent)
+                        com = seed_slice_com(seeds, ne + 1)
                         # location of start of new element
                         start_node_loc = node_loc[np_start][1:4]
                         # length of new branch
@@ -122,7 +145,7 @@ def grow_large_tree(angle_max, angle_min, fraction, min_length, point_limit,
                             (com - start_node_loc))
                         # Checks that branch angles are appropriate
                         end_node_loc = mesh_check_angle(angle_min, angle_max, node_loc[elems[ne_parent][1]][1:4],
-                                                        start_node_loc, end_node_loc, ne_parent, ne + 1)
+                                                        start_node_loc, end_node_loc, ne_parent, ne + 1, legacy_angles)
 
                         # Create new elements and nodes
                         elems[ne + 1][0] = ne + 1  # creating new element
@@ -143,123 +166,195 @@ def grow_large_tree(angle_max, angle_min, fraction, min_length, point_limit,
 
                         noelem_gen = noelem_gen + 1  # Only used for runtime output, number of new elements created in current generation
 
-                        nstem[ne][0] = nstem[ne_parent][0]
-
                         if branch:
                             # We are making a new branch so this one becomes a parent for next time
                             local_parent_temp[num_next_parents] = ne
                             num_next_parents = num_next_parents + 1
                         else:
-                            # Need to modify down the line not to branch in the next generation
-                            local_parent_temp[num_next_parents] = ne
-                            num_next_parents = num_next_parents + 1
-                            # numtb = numtb + 1
+                            # The branch is too short to grow further, so it becomes a terminal and its seed points
+                            # are removed
+                            tb_list[numtb] = ne
+                            numtb = numtb + 1
+                            seeds['elem'][seeds['first'][ne]:seeds['last'][ne]] = 0
+                            remaining_data = remaining_data - (seeds['last'][ne] - seeds['first'][ne])
 
                 else:  # Not ss so no splitting
                     # Not enough seed points in the set during the split parent branch becomes a terminal
                     tb_list[numtb] = ne_parent
                     numtb = numtb + 1
-                    min_dist = 1.0e10
-                    count_data = 0
-                    for nd in range(0, len(data_current_parent)):
-                        if map_seed_to_elem_new[nd] != 0:
-                            if map_seed_to_elem_new[nd] == ne + 1:
-                                map_seed_to_elem_new[nd] = ne_parent  # give back to parent
-                            if map_seed_to_elem_new[nd] == ne + 2:
-                                map_seed_to_elem_new[nd] = ne_parent
-                            dist = dist_two_vectors(data_current_parent[nd][:], node_loc[int(elems[ne_parent][2])][1:4])
-                            if dist < min_dist:
-                                if map_seed_to_elem_new[nd] == ne_parent:
-                                    count_data = count_data + 1
-                                    nd_min = nd
-                                    min_dist = dist
-                    if count_data != 0:  # If there were any data points associated
-                        map_seed_to_elem_new[nd_min] = 0
+                    # The seed points stay with the parent, and the one closest to its end is removed
+                    nd_min = closest_seed_in_slice(seeds, ne_parent, node_loc[int(elems[ne_parent][2])][1:4])
+                    if nd_min >= 0:  # If there were any data points associated
+                        seeds['elem'][nd_min] = 0
                         remaining_data = remaining_data - 1
 
             # .......Copy the temporary list of branches to NE_OLD. These become the
             # .......parent elements for the next branching
 
-            for n in range(0, num_next_parents):
-                local_parent[n] = local_parent_temp[n]
-                nstem[int(local_parent[n])][1] = 0  # initia count of data points
+            local_parent = local_parent_temp[0:num_next_parents]
 
             if remaining_data < original_data:  # only need to reallocate data if we have lost some data points
                 original_data = remaining_data
                 # reallocate datapoints
-                map_seed_to_elem_new = data_to_mesh(map_seed_to_elem_new, data_current_parent,
-                                                    local_parent[0:num_next_parents], node_loc,
-                                                    elems)
+                map_seed_to_elem_new = kernels['data_to_mesh'](map_seed_to_elem_new, data_current_parent,
+                                                               local_parent, node_loc, elems)
+                repartition_seeds(seeds, stem_first, stem_last, local_parent)
             # Could make this an optional output at a later date
             # print('   ' + str(ngen) + '   ' + str(noelem_gen) + '   ' + str(ne) +
             #      '   ' + str(numtb) + '   ' + str(remaining_data))
 
-    elems.resize(ne + 1, 3, refcheck=False)
-    elem_upstream.resize(ne + 1, 3, refcheck=False)
-    elem_downstream.resize(ne + 1, 3, refcheck=False)
-    node_loc.resize(nnod + 1, 4, refcheck=False)
+    tree['ne'] = ne
+    tree['nnod'] = nnod
 
-    return {'nodes': node_loc, 'elems': elems, 'elem_up': elem_upstream, 'elem_down': elem_downstream}
+    return trim_grown_tree(tree)
 
 
 def data_with_parent(current_parent, map_seed_to_elem, datapoints):
-    new_datapoints = np.zeros((len(datapoints), 3))
-    nd_for_parent = 0
-    for nd in range(0, len(datapoints)):
-        if map_seed_to_elem[nd] == current_parent:
-            new_datapoints[nd_for_parent] = datapoints[nd][:]
-            map_seed_to_elem[nd] = 0
-            datapoints[nd][:] = 0
-            nd_for_parent = nd_for_parent + 1
-    datapoints = datapoints[np.nonzero(map_seed_to_elem)]
-    map_seed_to_elem = map_seed_to_elem[np.nonzero(map_seed_to_elem)]
-    new_datapoints.resize(nd_for_parent, 3)
+    # Returns the seed points mapped to current_parent, in their original order. The inputs are not changed
+    new_datapoints = np.asarray(datapoints)[np.asarray(map_seed_to_elem) == current_parent]
 
     return new_datapoints
 
 
+def partition_seeds(map_seed_to_elem, datapoints, num_elems):
+    # Groups seed points by the element they are mapped to. The seed points of element ne are the contiguous slice
+    # first[ne]:last[ne] of the partition, which holds:
+    # order = original number of each seed point, points = its location (a copy of datapoints in partition order),
+    # elem = the element it is mapped to (0 once a seed point has been removed)
+    # Within a slice seed points stay in their original order, so sums over a slice are the same as over datapoints
+    map_seed_to_elem = np.asarray(map_seed_to_elem)
+    order = np.argsort(map_seed_to_elem, kind='stable')
+    seeds = {'order': order, 'points': np.array(datapoints, dtype=float)[order], 'elem': map_seed_to_elem[order],
+             'first': np.zeros(num_elems, dtype=int), 'last': np.zeros(num_elems, dtype=int)}
+    set_seed_slices(seeds, 0, len(order), np.unique(seeds['elem']))
+
+    return seeds
+
+
+def set_seed_slices(seeds, region_first, region_last, elem_list):
+    # Finds the slices of the elements in elem_list, all of whose seed points are in the (sorted) region
+    # region_first:region_last of the partition
+    elem_list = np.asarray(elem_list)
+    elem_list = elem_list[elem_list != 0]
+    region_elem = seeds['elem'][region_first:region_last]
+    seeds['first'][elem_list] = region_first + np.searchsorted(region_elem, elem_list, side='left')
+    seeds['last'][elem_list] = region_first + np.searchsorted(region_elem, elem_list, side='right')
+
+
+def repartition_seeds(seeds, region_first, region_last, elem_list):
+    # Re-sorts a region of the partition after its seed points have been remapped (e.g. by data_to_mesh),
+    # elem_list = the elements the seed points in the region can now be mapped to
+    region = slice(region_first, region_last)
+    reorder = np.lexsort((seeds['order'][region], seeds['elem'][region]))
+    for key in ['order', 'points', 'elem']:
+        seeds[key][region] = seeds[key][region][reorder]
+    set_seed_slices(seeds, region_first, region_last, elem_list)
+
+
+def seed_slice_com(seeds, ne):
+    # As mesh_com, for the seed points in the slice of element ne
+    points = seeds['points'][seeds['first'][ne]:seeds['last'][ne]]
+    com = np.zeros(3)
+    if len(points) != 0:
+        com = np.sum(points, axis=0) / len(points)
+
+    return com
+
+
+def split_seed_slice(seeds, x0, x1, x2, ne_parent, ne_current, point_limit):
+    # As data_splitby_plane, for the seed points in the slice of ne_parent
+    # If there are enough seed points on both sides of the plane the slice is partitioned in place (keeping the order
+    # of the seed points on each side) into the slices of elements ne_current + 1 and ne_current + 2
+    colinear = pg_utilities.check_colinear(x0, x1, x2)
+    if colinear:
+        print('WARNING: Colinear is true')
+    plane = pg_utilities.plane_from_3_pts(x0, x1, x2, False)
+    first = seeds['first'][ne_parent]
+    last = seeds['last'][ne_parent]
+    points = seeds['points'][first:last]
+    checkvalue = plane[0] * points[:, 0] + plane[1] * points[:, 1] + plane[2] * points[:, 2]
+    checkvalue = -1.0 * checkvalue - plane[3]
+    side1 = checkvalue >= 0
+    npoints = last - first
+    dat1 = np.count_nonzero(side1)
+    dat2 = npoints - dat1
+    split = npoints >= point_limit and dat1 >= point_limit and dat2 >= point_limit
+    if split:
+        for key in ['order', 'points', 'elem']:
+            seeds[key][first:last] = np.concatenate((seeds[key][first:last][side1], seeds[key][first:last][~side1]))
+        seeds['elem'][first:first + dat1] = ne_current + 1
+        seeds['elem'][first + dat1:last] = ne_current + 2
+        seeds['first'][ne_current + 1] = first
+        seeds['last'][ne_current + 1] = first + dat1
+        seeds['first'][ne_current + 2] = first + dat1
+        seeds['last'][ne_current + 2] = last
+        seeds['last'][ne_parent] = first  # the parent no longer has any seed points
+
+    return {'enough_points': [split, split]}
+
+
+def closest_seed_in_slice(seeds, ne, node):
+    # Position in the partition of the seed point of element ne that is closest to node (the first on ties),
+    # -1 if there are none
+    first = seeds['first'][ne]
+    points = seeds['points'][first:seeds['last'][ne]]
+    mapped = np.nonzero(seeds['elem'][first:seeds['last'][ne]] == ne)[0]
+    dist = np.sqrt((points[mapped, 0] - node[0]) ** 2 + (points[mapped, 1] - node[1]) ** 2 +
+                   (points[mapped, 2] - node[2]) ** 2)
+    mapped = mapped[dist < 1.0e10]
+    dist = dist[dist < 1.0e10]
+    if len(mapped) == 0:
+        return -1
+
+    return first + mapped[np.argmin(dist)]
+
+
 def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_limit,
-                           volume, thickness, ellipticity, datapoints, initial_geom, sorv):
+                           volume, thickness, ellipticity, datapoints, initial_geom, sorv, vectorised=False,
+                           reassign='full', backend=None, checkpoint=None, checkpoint_every=1, max_elements=None,
+                           max_generations=None, wall_time_budget=None, sink=None, orders=False,
+                           legacy_angles=False):
+    # vectorised = True grows each generation with array operations over all parents at once (see
+    # grow_generations), this gives the same tree as the loop below
+    # reassign = 'incremental' (vectorised only), see grow_large_tree
+    # backend = kernels for the loop below, 'python' or 'numba' (see growth_kernels). The vectorised engine has no
+    #   backends, so giving one for a run that is vectorised is an error
+    # checkpoint, checkpoint_every = checkpoint file and how often to write it (vectorised only), see grow_large_tree
+    # max_elements, max_generations, wall_time_budget = budgets for growth (vectorised only), see grow_large_tree
+    # sink = function given each generation's new nodes and elements (vectorised only), see grow_large_tree
+    # orders = True to return generation, Strahler and Horsfield orders (vectorised only), see grow_large_tree
+    # legacy_angles = True to correct branch angles as earlier versions did, see grow_large_tree
+    if vectorised or reassign != 'full' or checkpoint is not None or max_elements is not None or \
+            max_generations is not None or wall_time_budget is not None or sink is not None or orders:
+        if backend is not None:
+            raise ValueError('backend ' + str(backend) + ' is for the loop engine, this run is vectorised')
+        return grow_chorionic_surface_vectorised(angle_max, angle_min, fraction, min_length, point_limit,
+                                                 volume, thickness, ellipticity, datapoints, initial_geom, sorv,
+                                                 reassign, checkpoint, checkpoint_every, max_elements,
+                                                 max_generations, wall_time_budget, sink, orders, legacy_angles)
     # Calulate axis dimensions of ellipsoid with given volume, thickness and ellipticity
     radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
     z_radius = radii['z_radius']
     x_radius = radii['x_radius']
     y_radius = radii['y_radius']
 
-    # We can estimate the number of elements in the generated model based on the number of data (seed points) to
-    #  pre-allocate data arrays.
-    est_generation = int(np.ceil(np.log(len(datapoints)) / np.log(2)))
-    total_estimated = 0
-
-    for i in range(0, est_generation + 1):
-        total_estimated = total_estimated + 2 ** i
-    # Define the total number of nodes and elements prior to growing, plus the new number expected
-    num_elems_old = len(initial_geom["elems"])
-    num_nodes_old = len(initial_geom["nodes"])
-    num_elems_new = num_elems_old + total_estimated
-    num_nodes_new = num_nodes_old + total_estimated
     original_data = len(datapoints)
-    # Pre-allocation of data arrays
-    # elem_directions = np.zeros((num_elems_new, 3))
-    # elem_order = np.zeros((num_elems_new, 3))
-    node_loc = np.zeros((num_nodes_new, 4))
-    node_loc[0:num_nodes_old][:] = initial_geom["nodes"]
-    elems = np.zeros((num_elems_new, 3), dtype=int)
-    elems[0:num_elems_old][:] = initial_geom["elems"]
-    elem_upstream = np.zeros((num_elems_new, 3), dtype=int)
-    elem_upstream[0:num_elems_old][:] = initial_geom['elem_up']
-    elem_downstream = np.zeros((num_elems_new, 3), dtype=int)
-    elem_downstream[0:num_elems_old][:] = initial_geom['elem_down']
+    # Node and element arrays, these grow as needed while the tree is grown (see reserve_grown_tree)
+    tree = allocate_grown_tree(initial_geom, len(datapoints))
+    node_loc = tree['nodes']
+    elems = tree['elems']
+    elem_upstream = tree['elem_up']
+    elem_downstream = tree['elem_down']
+    tb_list = tree['tb_list']  # list of terminal bronchioles
+    kernels = growth_kernels(backend)
 
     # local arrays
-    nstem = np.zeros((num_elems_new, 2), dtype=int)
-    local_parent_temp = np.zeros(num_elems_new, dtype=int)
-    local_parent = np.zeros(num_elems_new, dtype=int)
+    nstem = np.zeros((len(initial_geom['elems']), 2), dtype=int)
     map_seed_to_elem = np.zeros(len(datapoints), dtype=int)
-    tb_list = np.zeros(2 * len(datapoints), dtype=int)  # number of terminal bronchioles
 
     # initialise local_parent (list of old terminals) to list of terminals in current geometry
     parentlist = group_elem_parent_term(0, initial_geom['elem_down'])
+    local_parent = np.zeros(2 * len(parentlist), dtype=int)  # room for the shuffling of parents below
     local_parent[0:len(parentlist)] = parentlist
 
     num_parents = len(parentlist)  # Curerent number of terminals
@@ -272,7 +367,7 @@ def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_lim
     # it; for multiple parents data_to_mesh is called to calculate
     # the closest parent end-point to each seed point.
     map_seed_to_elem = map_seed_to_elem + local_parent[0]
-    map_seed_to_elem = data_to_mesh(map_seed_to_elem, datapoints, parentlist, node_loc, elems)
+    map_seed_to_elem = kernels['data_to_mesh'](map_seed_to_elem, datapoints, parentlist, node_loc, elems)
     # Assign temporary arrays
     for nd in range(0, len(datapoints)):
         if map_seed_to_elem[nd] != 0:
@@ -319,8 +414,8 @@ def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_lim
     # print('         newgens       #brn       total#       #term      #data')
 
     # Set initial values for local and global nodes and elements
-    ne = num_elems_old - 1  # current maximum element number
-    nnod = num_nodes_old - 1  # current maximum node number
+    ne = tree['ne']  # current maximum element number
+    nnod = tree['nnod']  # current maximum node number
 
     ngen = 0  # for output, look to have each generation of elements recordded
 
@@ -329,27 +424,36 @@ def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_lim
         ngen = ngen + 1  # increment generation from parent for output
         num_parents = num_next_parents  # update the number of current parents
         num_next_parents = 0  # reset the number of local parents for next iteration
+        local_parent_temp = np.zeros(2 * num_parents, dtype=int)
         noelem_gen = 0
         for m in range(0, num_parents):
             ne_parent = local_parent[m]
-            com = mesh_com(ne_parent, map_seed_to_elem, datapoints)
+            # Make room for the two branches this parent could have
+            reserve_grown_tree(tree, ne + 3, nnod + 3)
+            node_loc = tree['nodes']
+            elems = tree['elems']
+            elem_upstream = tree['elem_up']
+            elem_downstream = tree['elem_down']
+            tb_list = tree['tb_list']
+            com = kernels['mesh_com'](ne_parent, map_seed_to_elem, datapoints)
             np_start = int(elems[ne_parent][2])
             np_prt_start = int(elems[ne_parent][1])
             # Split the seed points by the plane defined by the parent branch and the com of the
             # seedpoints attached to it
             if sorv is 'surface':
-                split_data = data_splitby_xy(map_seed_to_elem, datapoints, com, node_loc[np_start][1:3], ne_parent, ne,
-                                             point_limit)
+                split_data = kernels['data_splitby_xy'](map_seed_to_elem, datapoints, com, node_loc[np_start][1:3],
+                                                        ne_parent, ne, point_limit)
             else:
-                split_data = data_splitby_plane(map_seed_to_elem, datapoints, com, node_loc[np_prt_start][1:4],
-                                                node_loc[np_start][1:4], ne_parent, ne, point_limit)
+                split_data = kernels['data_splitby_plane'](map_seed_to_elem, datapoints, com,
+                                                           node_loc[np_prt_start][1:4], node_loc[np_start][1:4],
+                                                           ne_parent, ne, point_limit)
             # Check that there ar enough seedpoints in both groups to proceed
             # Note long term one could allow one group to continue and the other not to
             if split_data['enough_points'][0] and split_data['enough_points'][1]:
                 for n in range(0, 2):
                     branch = True
                     # Calculate centre of mass to grow toward
-                    com = mesh_com(ne + 1, map_seed_to_elem, datapoints)
+                    com = kernels['mesh_com'](ne + 1, map_seed_to_elem, datapoints)
                     # location of start of new element
                     start_node_loc = node_loc[np_start][1:4]
                     # length of new branch
@@ -370,12 +474,13 @@ def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_lim
                         node2 = np.array([start_node_loc[0], start_node_loc[1], 0])
                         # end of new branch
                         node3 = np.array([end_node_loc[0], end_node_loc[1], 0])
-                        end_node = mesh_check_angle(angle_min, angle_max, node1, node2, node3, ne_parent, ne + 1)
+                        end_node = mesh_check_angle(angle_min, angle_max, node1, node2, node3, ne_parent, ne + 1,
+                                                    legacy_angles)
                         end_node_loc[0:2] = end_node[0:2]
                         end_node_loc[2] = pg_utilities.z_from_xy(end_node[0], end_node[1], x_radius, y_radius, z_radius)
                     elif sorv is 'volume':
                         end_node_loc = mesh_check_angle(angle_min, angle_max, node_loc[elems[ne_parent][1]][1:4],
-                                                        start_node_loc, end_node_loc, ne_parent, ne + 1)
+                                                        start_node_loc, end_node_loc, ne_parent, ne + 1, legacy_angles)
 
                     # Create new elements and nodes
                     elems[ne + 1][0] = ne + 1  # creating new element
@@ -396,63 +501,738 @@ def grow_chorionic_surface(angle_max, angle_min, fraction, min_length, point_lim
 
                     noelem_gen = noelem_gen + 1  # Only used for runtime output, number of new elements created in current generation
 
-                    nstem[ne][0] = nstem[ne_parent][0]
-
                     if branch:
                         # We are making a new branch so this one becomes a parent for next time
                         local_parent_temp[num_next_parents] = ne
                         num_next_parents = num_next_parents + 1
                     else:
-                        # Note that this needs to be updated so that the branch and its datapoints get deleted from the list and dont grow nest time
-                        # but for python speed reasons we should leave here for now
-                        local_parent_temp[num_next_parents] = ne
-                        num_next_parents = num_next_parents + 1
-                        # numtb = numtb + 1
+                        # The branch is too short to grow further, so it becomes a terminal and its seed points are
+                        # removed
+                        tb_list[numtb] = ne
+                        numtb = numtb + 1
+                        retired = map_seed_to_elem == ne
+                        map_seed_to_elem[retired] = 0
+                        remaining_data = remaining_data - np.count_nonzero(retired)
 
             else:  # Not ss so no splitting
                 # Not enough seed points in the set during the split parent branch becomes a terminal
                 tb_list[numtb] = ne_parent
                 numtb = numtb + 1
-                min_dist = 1.0e10
-                count_data = 0
-                for nd in range(0, len(datapoints)):
-                    if map_seed_to_elem[nd] != 0:
-                        if map_seed_to_elem[nd] == ne + 1:
-                            map_seed_to_elem[nd] = ne_parent  # give back to parent
-                        if map_seed_to_elem[nd] == ne + 2:
-                            map_seed_to_elem[nd] = ne_parent
-                        dist = dist_two_vectors(datapoints[nd][:], node_loc[int(elems[ne_parent][2])][1:4])
-                        if dist < min_dist:
-                            if map_seed_to_elem[nd] == ne_parent:
-                                count_data = count_data + 1
-                                nd_min = nd
-                                min_dist = dist
-                if count_data != 0:  # If there were any data points associated
+                nd_min = kernels['give_back_to_parent'](map_seed_to_elem, datapoints, ne_parent, ne,
+                                                        node_loc[int(elems[ne_parent][2])][1:4])
+                if nd_min >= 0:  # If there were any data points associated
                     map_seed_to_elem[nd_min] = 0
                     remaining_data = remaining_data - 1
 
         # .......Copy the temporary list of branches to NE_OLD. These become the
         # .......parent elements for the next branching
 
-        for n in range(0, num_next_parents):
-            local_parent[n] = local_parent_temp[n]
-            nstem[int(local_parent[n])][1] = 0  # initialaw count of data points
+        local_parent = local_parent_temp[0:num_next_parents]
 
         if remaining_data < original_data:  # only need to reallocate data if we have lost some data points
             original_data = remaining_data
             # reallocate datapoints
-            map_seed_to_elem = data_to_mesh(map_seed_to_elem, datapoints, local_parent[0:num_next_parents], node_loc,
-                                            elems)
+            map_seed_to_elem = kernels['data_to_mesh'](map_seed_to_elem, datapoints, local_parent, node_loc, elems)
         # Could potentially make this an optional output at a later date
         # print('   ' + str(ngen) + '   ' + str(noelem_gen) + '   ' + str(ne) +
         #      '   ' + str(numtb) + '   ' + str(remaining_data))
 
-    elems.resize(ne + 1, 3, refcheck=False)
-    elem_upstream.resize(ne + 1, 3, refcheck=False)
-    elem_downstream.resize(ne + 1, 3, refcheck=False)
-    node_loc.resize(nnod + 1, 4, refcheck=False)
+    tree['ne'] = ne
+    tree['nnod'] = nnod
+
+    return trim_grown_tree(tree)
+
+
+def grow_new_seeds(angle_max, angle_min, fraction, min_length, point_limit,
+                   volume, thickness, ellipticity, datapoints, grown_geom, sorv='volume', reassign='full',
+                   orders=False, legacy_angles=False):
+    # Incremental growth, for new seed points (datapoints) added to a tree that has already been grown (grown_geom,
+    # e.g. from grow_large_tree or grow_chorionic_surface). The new seed points are mapped to their closest terminals
+    # of grown_geom (group_elem_parent_term and data_to_mesh), and the bifurcating distributive algorithm carries on
+    # only from the terminals that were given at least two of them, as in grow_chorionic_surface. The existing
+    # elements and nodes keep their numbers and new ones are numbered after them, so the work follows the number of
+    # new seed points rather than the size of the tree
+    # sorv = 'volume' to continue a tree grown by grow_large_tree (or grow_chorionic_surface with 'volume'),
+    #   'surface' to continue a chorionic surface tree
+    # reassign, orders, legacy_angles = as grow_large_tree. If grown_geom already has orders (grown with
+    #   orders = True) they are carried on rather than found again for the whole tree
+    return grow_chorionic_surface_vectorised(angle_max, angle_min, fraction, min_length, point_limit,
+                                             volume, thickness, ellipticity, datapoints, grown_geom, sorv, reassign,
+                                             orders=orders, legacy_angles=legacy_angles)
+
+
+def grow_large_tree_vectorised(angle_max, angle_min, fraction, min_length, point_limit,
+                               volume, thickness, ellipticity, datapoints, initial_geom, processes=1,
+                               reassign='full', checkpoint=None, checkpoint_every=1, max_elements=None,
+                               max_generations=None, wall_time_budget=None, sink=None, orders=False,
+                               legacy_angles=False):
+    # Generation synchronous version of grow_large_tree. Each stem is still grown in turn, but within a stem a whole
+    # generation of parents is centre of mass'd, split and branched with array operations (grow_generations)
+    # Inputs and outputs are as for grow_large_tree
+    # processes > 1 grows the stems in a pool of worker processes instead (see grow_stems_in_parallel)
+    budget = new_budget(max_elements, max_generations, wall_time_budget)
+    radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
+    datapoints = np.asarray(datapoints, dtype=float)
+    tree = allocate_grown_tree(initial_geom, len(datapoints))
+    if orders:
+        track_orders(tree, initial_geom)
 
-    return {'nodes': node_loc, 'elems': elems, 'elem_up': elem_upstream, 'elem_down': elem_downstream}
+    parentlist = group_elem_parent_term(0, initial_geom['elem_down'])  # master parent list
+
+    # Map each seed point to its closest stem
+    map_seed_to_elem = np.zeros(len(datapoints), dtype=int) + parentlist[0]
+    map_seed_to_elem = data_to_mesh(map_seed_to_elem, datapoints, parentlist, tree['nodes'], tree['elems'],
+                                    'grid')
+
+    seeds = partition_seeds(map_seed_to_elem, datapoints, len(tree['elems']))
+    growth_args = (angle_max, angle_min, fraction, min_length, point_limit, radii, 'volume', reassign, legacy_angles)
+    if processes > 1:
+        if checkpoint is not None or budget is not None or sink is not None or orders:
+            raise ValueError('checkpoint, budgets, sink and orders are not supported with processes > 1')
+        return grow_stems_in_parallel(seeds, parentlist, initial_geom, processes, growth_args)
+
+    if checkpoint is not None:
+        checkpoint = new_checkpoint(checkpoint, checkpoint_every, 'large_tree', growth_args)
+        checkpoint['state'].update({'parentlist': parentlist, 'points': seeds['points'], 'elem': seeds['elem'],
+                                    'first': seeds['first'], 'last': seeds['last']})
+    if sink is not None:
+        sink(tree['nodes'][0:tree['nnod'] + 1], tree['elems'][0:tree['ne'] + 1])
+    grow_stems(tree, seeds, parentlist, growth_args, checkpoint, budget=budget, sink=sink)
+
+    geom = trim_grown_tree(tree)
+    if budget is not None:
+        geom['status'] = growth_status(budget, np.count_nonzero(seeds['elem']))
+
+    return geom
+
+
+def grow_stems(tree, seeds, parentlist, growth_args, checkpoint=None, resume_stem=None, budget=None, sink=None):
+    # Grows the stems in parentlist one after another with grow_generations, each from its slice of the seed
+    # partition. growth_args = trailing arguments of grow_generations
+    # resume_stem = (stem number, local_parent, remaining_data, original_data) to start part way through growing a
+    #   stem, as saved in a checkpoint
+    # budget = from new_budget. max_generations applies to each stem, the others stop growth of all the stems left
+    #   once they are reached. budget['hit'] is the last budget that stopped a stem
+    # sink = as grow_generations
+    hit = None
+    first_stem = 0
+    if resume_stem is not None:
+        first_stem = resume_stem[0]
+    for npar in range(first_stem, len(parentlist)):
+        print('Generating children for parent ' + str(npar) + '(elem #' + str(parentlist[npar]) + ') of a total of ' + str(len(parentlist)))
+        current_parent = parentlist[npar]
+        data_current_parent = seeds['points'][seeds['first'][current_parent]:seeds['last'][current_parent]]
+        map_seed_to_elem_new = seeds['elem'][seeds['first'][current_parent]:seeds['last'][current_parent]]
+        local_parent = np.array([current_parent])
+        remaining_data = len(data_current_parent)
+        original_data = len(data_current_parent)
+        if resume_stem is not None and npar == first_stem:
+            local_parent, remaining_data, original_data = resume_stem[1:4]
+        if checkpoint is not None:
+            checkpoint['state']['stem'] = npar
+        grow_generations(tree, data_current_parent, map_seed_to_elem_new, local_parent, remaining_data, original_data,
+                         *growth_args, checkpoint=checkpoint, budget=budget, sink=sink)
+        if budget is not None and budget['hit'] is not None:
+            hit = budget['hit']
+            if hit != 'max_generations':
+                break
+    if budget is not None:
+        budget['hit'] = hit
+
+
+def grow_stems_in_parallel(seeds, parentlist, initial_geom, processes, growth_args):
+    # Grows the subtree of each stem in parentlist in a pool of worker processes. Stems don't share seed points, so
+    # each worker grows its stem as if it were the only one (numbering new elements and nodes from the end of
+    # initial_geom) and the subtrees are then renumbered in parentlist order, giving the same numbering as growing
+    # the stems one after another. The seed points are shared with the workers rather than copied to each task.
+    # A branch exactly in line with its parent is nudged with np.random (mesh_check_angle), which the workers can't
+    # draw in the serial order, so stems whose worker used np.random are grown again here in turn. The tree (and the
+    # random state afterwards) is then the same as growing the stems serially
+    # seeds = partition from partition_seeds, growth_args = trailing arguments of grow_generations
+    shared_points = multiprocessing.RawArray('d', max(1, seeds['points'].size))
+    np.frombuffer(shared_points, dtype=float)[0:seeds['points'].size] = seeds['points'].ravel()
+    stems = [(stem, seeds['first'][stem], seeds['last'][stem]) for stem in parentlist]
+    # the largest stems are started first so they don't hold up the end of the run
+    by_size = sorted(range(0, len(stems)), key=lambda n: stems[n][2] - stems[n][1], reverse=True)
+    pool = multiprocessing.Pool(processes, init_stem_worker,
+                                (shared_points, len(seeds['points']), initial_geom, growth_args))
+    try:
+        subtrees = pool.map(grow_stem, [stems[n] for n in by_size], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    subtree_of_stem = [None] * len(stems)
+    for n in range(0, len(stems)):
+        subtree_of_stem[by_size[n]] = subtrees[n]
+    for n in range(0, len(stems)):
+        if subtree_of_stem[n]['used_random']:
+            stem, first, last = stems[n]
+            subtree_of_stem[n] = grow_stem_subtree(stem, seeds['points'][first:last], len(seeds['points']),
+                                                   initial_geom, growth_args)
+
+    return merge_stem_subtrees(initial_geom, parentlist, subtree_of_stem)
+
+
+stem_worker_data = {}  # seed points and growth parameters of a worker process in grow_stems_in_parallel
+
+
+def init_stem_worker(shared_points, num_data, initial_geom, growth_args):
+    stem_worker_data['points'] = np.frombuffer(shared_points, dtype=float)[0:3 * num_data].reshape(num_data, 3)
+    stem_worker_data['initial_geom'] = initial_geom
+    stem_worker_data['growth_args'] = growth_args
+
+
+def grow_stem(stem_range):
+    # Worker task, grows the subtree of one stem from its slice of the shared seed points
+    # stem_range = (stem, first, last)
+    stem, first, last = stem_range
+    return grow_stem_subtree(stem, stem_worker_data['points'][first:last], len(stem_worker_data['points']),
+                             stem_worker_data['initial_geom'], stem_worker_data['growth_args'])
+
+
+def grow_stem_subtree(stem, data_current_parent, num_data, initial_geom, growth_args):
+    # Grows stem (a terminal of initial_geom) from its seed points, returning only the new elements and nodes and
+    # whether any random numbers were drawn. num_data = total number of seed points (sizes the arrays as grow_large_tree)
+    print('Generating children for elem #' + str(stem))
+    tree = allocate_grown_tree(initial_geom, num_data)
+    map_seed_to_elem_new = np.zeros(len(data_current_parent), dtype=int) + stem
+    random_state = np.random.get_state()
+    grow_generations(tree, data_current_parent, map_seed_to_elem_new, np.array([stem]), len(data_current_parent),
+                     len(data_current_parent), *growth_args)
+    used_random = random_state[2] != np.random.get_state()[2] or not np.array_equal(random_state[1],
+                                                                                    np.random.get_state()[1])
+    num_elems_old = len(initial_geom['elems'])
+    num_nodes_old = len(initial_geom['nodes'])
+
+    return {'nodes': tree['nodes'][num_nodes_old:tree['nnod'] + 1], 'elems': tree['elems'][num_elems_old:tree['ne'] + 1],
+            'elem_up': tree['elem_up'][num_elems_old:tree['ne'] + 1],
+            'elem_down': tree['elem_down'][num_elems_old:tree['ne'] + 1], 'stem_down': tree['elem_down'][stem],
+            'used_random': used_random}
+
+
+def merge_stem_subtrees(initial_geom, stems, subtrees):
+    # Joins subtrees grown separately from initial_geom (new elements and nodes of each numbered from the end of
+    # initial_geom) into one tree, renumbering each subtree's new elements and nodes to follow the previous subtree's
+    num_elems_old = len(initial_geom['elems'])
+    num_nodes_old = len(initial_geom['nodes'])
+    tree = allocate_grown_tree(initial_geom, 1)
+    num_elems = num_elems_old + sum([len(subtree['elems']) for subtree in subtrees])
+    num_nodes = num_nodes_old + sum([len(subtree['nodes']) for subtree in subtrees])
+    tree['elems'].resize(num_elems, 3, refcheck=False)
+    tree['elem_up'].resize(num_elems, 3, refcheck=False)
+    tree['elem_down'].resize(num_elems, 3, refcheck=False)
+    tree['nodes'].resize(num_nodes, 4, refcheck=False)
+
+    ne = num_elems_old
+    nnod = num_nodes_old
+    for n in range(0, len(stems)):
+        subtree = subtrees[n]
+        elem_offset = ne - num_elems_old
+        node_offset = nnod - num_nodes_old
+        num_new_elems = len(subtree['elems'])
+        num_new_nodes = len(subtree['nodes'])
+        elems = subtree['elems'].copy()
+        elems[:, 0] = elems[:, 0] + elem_offset
+        elems[:, 1:3] = renumber_new(elems[:, 1:3], num_nodes_old, node_offset)
+        tree['elems'][ne:ne + num_new_elems] = elems
+        for key in ['elem_up', 'elem_down']:
+            tree[key][ne:ne + num_new_elems, 0] = subtree[key][:, 0]
+            tree[key][ne:ne + num_new_elems, 1:3] = renumber_new(subtree[key][:, 1:3], num_elems_old, elem_offset)
+        tree['elem_down'][stems[n], 0] = subtree['stem_down'][0]
+        tree['elem_down'][stems[n], 1:3] = renumber_new(subtree['stem_down'][1:3], num_elems_old, elem_offset)
+        tree['nodes'][nnod:nnod + num_new_nodes] = subtree['nodes']
+        tree['nodes'][nnod:nnod + num_new_nodes, 0] = subtree['nodes'][:, 0] + node_offset
+        ne = ne + num_new_elems
+        nnod = nnod + num_new_nodes
+
+    return {'nodes': tree['nodes'], 'elems': tree['elems'], 'elem_up': tree['elem_up'],
+            'elem_down': tree['elem_down']}
+
+
+def renumber_new(numbers, num_old, offset):
+    # Adds offset to the element or node numbers that are new (at least num_old)
+    return np.where(numbers >= num_old, numbers + offset, numbers)
+
+
+def grow_chorionic_surface_vectorised(angle_max, angle_min, fraction, min_length, point_limit,
+                                      volume, thickness, ellipticity, datapoints, initial_geom, sorv,
+                                      reassign='full', checkpoint=None, checkpoint_every=1, max_elements=None,
+                                      max_generations=None, wall_time_budget=None, sink=None, orders=False,
+                                      legacy_angles=False):
+    # Generation synchronous version of grow_chorionic_surface, all terminals of the initial geometry are grown
+    # together with each generation handled by array operations (grow_generations)
+    # Inputs and outputs are as for grow_chorionic_surface
+    budget = new_budget(max_elements, max_generations, wall_time_budget)
+    radii = pg_utilities.calculate_ellipse_radii(volume, thickness, ellipticity)
+    datapoints = np.asarray(datapoints, dtype=float)
+    tree = allocate_grown_tree(initial_geom, len(datapoints))
+    if orders:
+        track_orders(tree, initial_geom)
+
+    # initialise parents to list of terminals in current geometry and map each seed point to its closest terminal
+    parentlist = group_elem_parent_term(0, initial_geom['elem_down'])
+    map_seed_to_elem = np.zeros(len(datapoints), dtype=int) + parentlist[0]
+    map_seed_to_elem = data_to_mesh(map_seed_to_elem, datapoints, parentlist, tree['nodes'], tree['elems'],
+                                    'grid')
+    nstem = np.bincount(map_seed_to_elem[map_seed_to_elem != 0], minlength=len(tree['elems']))
+
+    # Terminals with no seed points are not parents, terminals with only one seed point become terminals
+    # straight away and their seed point is removed from the group
+    local_parent = parentlist[nstem[parentlist] != 0]
+    single = local_parent[nstem[local_parent] < 2]
+    map_seed_to_elem[np.in1d(map_seed_to_elem, single)] = 0
+    tree['tb_list'][0:len(single)] = single
+    tree['numtb'] = len(single)
+    local_parent = local_parent[nstem[local_parent] >= 2]
+
+    remaining_data = np.count_nonzero(map_seed_to_elem > 0)
+    growth_args = (angle_max, angle_min, fraction, min_length, point_limit, radii, sorv, reassign, legacy_angles)
+    if checkpoint is not None:
+        checkpoint = new_checkpoint(checkpoint, checkpoint_every, 'chorionic_surface', growth_args)
+        checkpoint['state']['datapoints'] = datapoints
+    if sink is not None:
+        sink(tree['nodes'][0:tree['nnod'] + 1], tree['elems'][0:tree['ne'] + 1])
+    grow_generations(tree, datapoints, map_seed_to_elem, local_parent, remaining_data, len(datapoints),
+                     *growth_args, checkpoint=checkpoint, budget=budget, sink=sink)
+
+    geom = trim_grown_tree(tree)
+    if budget is not None:
+        geom['status'] = growth_status(budget, np.count_nonzero(map_seed_to_elem))
+
+    return geom
+
+
+def new_budget(max_elements, max_generations, wall_time_budget):
+    # Budgets for growth checked by grow_generations before each generation, None if there are none. The wall time
+    # budget starts now. hit = the budget that stopped growth
+    if max_elements is None and max_generations is None and wall_time_budget is None:
+        return None
+    stop_time = None
+    if wall_time_budget is not None:
+        stop_time = time.time() + wall_time_budget
+
+    return {'max_elements': max_elements, 'max_generations': max_generations, 'stop_time': stop_time, 'hit': None}
+
+
+def budget_hit(budget, num_elems, num_parents, ngen):
+    # The budget, if any, that stops growth before the next generation. num_elems = elements so far, num_parents =
+    # parents of the next generation (which could add two elements each), ngen = generations grown so far
+    if budget['max_elements'] is not None and num_elems + 2 * num_parents > budget['max_elements']:
+        return 'max_elements'
+    if budget['max_generations'] is not None and ngen >= budget['max_generations']:
+        return 'max_generations'
+    if budget['stop_time'] is not None and time.time() >= budget['stop_time']:
+        return 'wall_time_budget'
+
+    return None
+
+
+def growth_status(budget, unassigned_seeds):
+    # Status of growth with a budget, returned with the geometry
+    if budget['hit'] is not None:
+        print('WARNING: growth stopped by ' + budget['hit'] + ' with ' + str(unassigned_seeds) +
+              ' seed points unassigned')
+
+    return {'budget_hit': budget['hit'], 'unassigned_seeds': unassigned_seeds}
+
+
+def new_checkpoint(filename, every, engine, growth_args):
+    # Checkpoint settings passed to grow_generations. state holds what is saved besides the tree and the seed point
+    # allocation of the current generation: how to carry on growing (the engine, growth_args) and anything the
+    # engine needs to continue (added by the engine)
+    angle_max, angle_min, fraction, min_length, point_limit, radii, sorv, reassign, legacy_angles = growth_args
+    state = {'engine': engine, 'angle_max': angle_max, 'angle_min': angle_min, 'fraction': fraction,
+             'min_length': min_length, 'point_limit': point_limit, 'x_radius': radii['x_radius'],
+             'y_radius': radii['y_radius'], 'z_radius': radii['z_radius'], 'sorv': sorv, 'reassign': reassign,
+             'legacy_angles': legacy_angles}
+
+    return {'filename': filename, 'every': every, 'generation': 0, 'state': state}
+
+
+def save_checkpoint(checkpoint, tree, map_seed_to_elem, local_parent, remaining_data, original_data):
+    # Saves the state of growth at the end of a generation of grow_generations to checkpoint['filename'] (a numpy .npz
+    # file) along with the numpy random state. The file is written under a temporary name and then renamed, so an
+    # interruption while writing leaves the previous checkpoint as it was
+    random_state = np.random.get_state()
+    arrays = dict(checkpoint['state'])
+    arrays.update({'nodes': tree['nodes'][0:tree['nnod'] + 1], 'elems': tree['elems'][0:tree['ne'] + 1],
+                   'elem_up': tree['elem_up'][0:tree['ne'] + 1], 'elem_down': tree['elem_down'][0:tree['ne'] + 1],
+                   'tb_list': tree['tb_list'][0:tree['numtb']], 'map_seed_to_elem': map_seed_to_elem,
+                   'local_parent': local_parent, 'remaining_data': remaining_data, 'original_data': original_data,
+                   'every': checkpoint['every'], 'generation': checkpoint['generation'],
+                   'random_key': random_state[1], 'random_pos': random_state[2], 'random_has_gauss': random_state[3],
+                   'random_gauss': random_state[4]})
+    if tree['orders'] is not None:
+        for key in ['generation', 'strahler', 'horsfield']:
+            arrays['orders_' + key] = tree['orders'][key][0:tree['ne'] + 1]
+    temporary = checkpoint['filename'] + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temporary, checkpoint['filename'])
+
+
+def resume_tree_growth(filename):
+    # Continues growing a tree from a checkpoint saved by grow_large_tree or grow_chorionic_surface, giving the same
+    # tree as a run that was not interrupted. Checkpoints carry on being written to the same file
+    # Returns the geometry as grow_large_tree or grow_chorionic_surface
+    # Everything is copied out of the checkpoint and the file closed before growth continues, as the checkpoint is
+    # then replaced by new ones
+    with np.load(filename) as saved:
+        random_state = ('MT19937', np.array(saved['random_key']), int(saved['random_pos']),
+                        int(saved['random_has_gauss']), float(saved['random_gauss']))
+        tree = {'nodes': np.array(saved['nodes']), 'elems': np.array(saved['elems']),
+                'elem_up': np.array(saved['elem_up']), 'elem_down': np.array(saved['elem_down']),
+                'tb_list': np.array(saved['tb_list'])}
+        tree['ne'] = len(tree['elems']) - 1
+        tree['nnod'] = len(tree['nodes']) - 1
+        tree['numtb'] = len(tree['tb_list'])
+        tree['orders'] = None
+        if 'orders_strahler' in saved.files:
+            tree['orders'] = {'generation': np.array(saved['orders_generation']),
+                              'strahler': np.array(saved['orders_strahler']),
+                              'horsfield': np.array(saved['orders_horsfield'])}
+        radii = {'x_radius': float(saved['x_radius']), 'y_radius': float(saved['y_radius']),
+                 'z_radius': float(saved['z_radius'])}
+        # checkpoints from before legacy_angles was saved were grown with the legacy angle correction
+        legacy_angles = True
+        if 'legacy_angles' in saved.files:
+            legacy_angles = bool(saved['legacy_angles'])
+        growth_args = (float(saved['angle_max']), float(saved['angle_min']), float(saved['fraction']),
+                       float(saved['min_length']), int(saved['point_limit']), radii, str(saved['sorv']),
+                       str(saved['reassign']), legacy_angles)
+        engine = str(saved['engine'])
+        checkpoint = new_checkpoint(filename, int(saved['every']), engine, growth_args)
+        checkpoint['generation'] = int(saved['generation'])
+        local_parent = np.array(saved['local_parent'])
+        remaining_data = int(saved['remaining_data'])
+        original_data = int(saved['original_data'])
+        if engine == 'large_tree':
+            seeds = {'points': np.array(saved['points']), 'elem': np.array(saved['elem']),
+                     'first': np.array(saved['first']), 'last': np.array(saved['last'])}
+            parentlist = np.array(saved['parentlist'])
+            stem = int(saved['stem'])
+        else:
+            datapoints = np.array(saved['datapoints'])
+            map_seed_to_elem = np.array(saved['map_seed_to_elem'])
+
+    np.random.set_state(random_state)
+    if engine == 'large_tree':
+        checkpoint['state'].update({'parentlist': parentlist, 'points': seeds['points'], 'elem': seeds['elem'],
+                                    'first': seeds['first'], 'last': seeds['last']})
+        grow_stems(tree, seeds, parentlist, growth_args, checkpoint, (stem, local_parent, remaining_data, original_data))
+    else:
+        checkpoint['state']['datapoints'] = datapoints
+        grow_generations(tree, datapoints, map_seed_to_elem, local_parent, remaining_data, original_data,
+                         *growth_args, checkpoint=checkpoint)
+
+    return trim_grown_tree(tree)
+
+
+def allocate_grown_tree(initial_geom, num_data):
+    # Allocates node, element and connectivity arrays for growing from initial_geom with num_data seed points
+    # The arrays start with room for num_data new elements and nodes and are grown as needed by reserve_grown_tree,
+    # then trimmed to the elements and nodes actually created by trim_grown_tree
+    num_elems_old = len(initial_geom['elems'])
+    num_nodes_old = len(initial_geom['nodes'])
+    num_elems_new = num_elems_old + num_data
+    num_nodes_new = num_nodes_old + num_data
+
+    node_loc = np.zeros((num_nodes_new, 4))
+    node_loc[0:num_nodes_old][:] = initial_geom['nodes']
+    elems = np.zeros((num_elems_new, 3), dtype=int)
+    elems[0:num_elems_old][:] = initial_geom['elems']
+    elem_upstream = np.zeros((num_elems_new, 3), dtype=int)
+    elem_upstream[0:num_elems_old][:] = initial_geom['elem_up']
+    elem_downstream = np.zeros((num_elems_new, 3), dtype=int)
+    elem_downstream[0:num_elems_old][:] = initial_geom['elem_down']
+
+    return {'nodes': node_loc, 'elems': elems, 'elem_up': elem_upstream, 'elem_down': elem_downstream,
+            'ne': num_elems_old - 1, 'nnod': num_nodes_old - 1,
+            'tb_list': np.zeros(num_elems_new, dtype=int), 'numtb': 0, 'orders': None}
+
+
+def track_orders(tree, initial_geom):
+    # Starts keeping track of the generation, Strahler and Horsfield orders of the elements of a tree from
+    # allocate_grown_tree (see update_orders). The orders of the elements of initial_geom are taken from it if it has
+    # them (e.g. it was grown with orders), or else found with analyse_tree.evaluate_orders
+    num_elems_old = len(initial_geom['elems'])
+    if 'strahler' in initial_geom:
+        initial = initial_geom
+    else:
+        initial = analyse_tree.evaluate_orders(initial_geom['nodes'], np.asarray(initial_geom['elems'], dtype=int))
+    tree['orders'] = {}
+    for key in ['generation', 'strahler', 'horsfield']:
+        tree['orders'][key] = np.zeros(len(tree['elems']), dtype=int)
+        tree['orders'][key][0:num_elems_old] = initial[key][0:num_elems_old]
+
+
+def update_orders(tree, split_parent, new_elems):
+    # Brings the orders of a tree being grown up to date after each of split_parent has branched into two new
+    # elements (new_elems, in pairs). The new elements are terminals a generation on from their parent. The Strahler
+    # and Horsfield orders of the parents are then found again from their children, and so on up the tree for as long
+    # as they change. The orders follow the rules of analyse_tree.evaluate_orders
+    orders = tree['orders']
+    elem_upstream = tree['elem_up']
+    elem_downstream = tree['elem_down']
+    parent = elem_upstream[new_elems, 1]
+    orders['generation'][new_elems] = np.where(parent == 0, 1, orders['generation'][parent] + 1)
+    orders['strahler'][new_elems] = 1
+    orders['horsfield'][new_elems] = 1
+    changed = np.asarray(split_parent, dtype=int)
+    while len(changed) != 0:
+        changed = np.unique(changed)
+        num_children = elem_downstream[changed, 0]
+        strahler1 = orders['strahler'][elem_downstream[changed, 1]]
+        strahler2 = orders['strahler'][elem_downstream[changed, 2]]
+        horsfield1 = orders['horsfield'][elem_downstream[changed, 1]]
+        horsfield2 = orders['horsfield'][elem_downstream[changed, 2]]
+        strahler = np.ones(len(changed), dtype=int)
+        horsfield = np.ones(len(changed), dtype=int)
+        # a single child continues its parent, two children give a bifurcation
+        one = num_children == 1
+        strahler[one] = strahler1[one]
+        horsfield[one] = horsfield1[one]
+        two = num_children >= 2
+        strahler[two] = np.where(strahler1 == strahler2, strahler1 + 1, np.maximum(strahler1, strahler2))[two]
+        horsfield[two] = np.maximum(1, np.maximum(horsfield1, horsfield2))[two] + 1
+        moved = (strahler != orders['strahler'][changed]) | (horsfield != orders['horsfield'][changed])
+        orders['strahler'][changed] = strahler
+        orders['horsfield'][changed] = horsfield
+        changed = changed[moved & (elem_upstream[changed, 0] != 0)]
+        changed = elem_upstream[changed, 1]
+
+
+def reserve_grown_tree(tree, num_elems, num_nodes):
+    # Makes sure the arrays of a tree from allocate_grown_tree have room for num_elems elements and num_nodes nodes
+    # The arrays are replaced by bigger ones when needed, so anything holding the old arrays must fetch them again
+    reserve_rows(tree, ['elems', 'elem_up', 'elem_down', 'tb_list'], num_elems)
+    reserve_rows(tree, ['nodes'], num_nodes)
+    if tree['orders'] is not None:
+        reserve_rows(tree['orders'], ['generation', 'strahler', 'horsfield'], num_elems)
+
+
+def reserve_rows(arrays, keys, num_rows):
+    # Makes sure each of arrays[key] has at least num_rows rows. An array that is too short is replaced by a copy
+    # with (at least) twice as many rows, the new rows set to zero, so adding rows one at a time costs amortised
+    # constant time
+    for key in keys:
+        old = arrays[key]
+        if len(old) < num_rows:
+            grown = np.zeros((max(num_rows, 2 * len(old)),) + old.shape[1:], dtype=old.dtype)
+            grown[0:len(old)] = old
+            arrays[key] = grown
+
+
+def trim_grown_tree(tree):
+    # Trims the arrays of a grown tree to the elements and nodes actually created. The arrays are shrunk in place and
+    # returned as they are, without copying
+    ne = tree['ne']
+    nnod = tree['nnod']
+    tree['elems'].resize(ne + 1, 3, refcheck=False)
+    tree['elem_up'].resize(ne + 1, 3, refcheck=False)
+    tree['elem_down'].resize(ne + 1, 3, refcheck=False)
+    tree['nodes'].resize(nnod + 1, 4, refcheck=False)
+    geom = {'nodes': tree['nodes'], 'elems': tree['elems'], 'elem_up': tree['elem_up'], 'elem_down': tree['elem_down']}
+    if tree['orders'] is not None:
+        for key in ['generation', 'strahler', 'horsfield']:
+            tree['orders'][key].resize(ne + 1, refcheck=False)
+            geom[key] = tree['orders'][key]
+
+    return geom
+
+
+def grow_generations(tree, datapoints, map_seed_to_elem, local_parent, remaining_data, original_data,
+                     angle_max, angle_min, fraction, min_length, point_limit, radii, sorv, reassign='full',
+                     legacy_angles=False, checkpoint=None, budget=None, sink=None):
+    # Bifurcating distributive algorithm with each generation processed as a whole
+    # tree = arrays and counters from allocate_grown_tree, updated in place
+    # datapoints = seed points, map_seed_to_elem = element each seed point belongs to (0 if removed), updated in place
+    # local_parent = elements to branch from in the first generation
+    # remaining_data, original_data = as in grow_chorionic_surface, decide when seed points need reallocating
+    # sorv = 'surface' to split seeds by a line in x-y and keep new nodes on the ellipsoid surface, 'volume' to split by
+    #   a plane in 3D
+    # reassign = 'full' to reassign every seed point to its closest parent whenever seed points have been lost, as
+    #   data_to_mesh in the one parent at a time algorithm, 'incremental' to only reassign the seed points left with
+    #   parents that became terminals this generation (the rest stay with the branch they were split to). The cost
+    #   then follows the number of new terminals rather than the number of seed points, but the tree is not the same
+    # legacy_angles = True to correct branch angles as earlier versions did (see mesh_check_angles)
+    # checkpoint = settings from new_checkpoint, if given the state of growth is saved (save_checkpoint) after every
+    #   checkpoint['every'] generations
+    # budget = from new_budget, if given growth stops before any generation that would go over it (budget['hit'] is
+    #   then set), leaving the seed points of the parents not grown mapped to them
+    # sink = function called as sink(nodes, elems) with the rows of the nodes and elements created in each generation
+    #   (the rows are also kept in tree, a sink does not reduce memory)
+    # Elements, nodes and seed point allocations are identical to growing one parent at a time as in grow_large_tree
+    # and grow_chorionic_surface: parents are visited in order and each one that splits takes the next two element
+    # numbers
+    x_radius = radii['x_radius']
+    y_radius = radii['y_radius']
+    z_radius = radii['z_radius']
+
+    slot_of_elem = np.zeros(len(tree['elems']), dtype=int) - 1  # position of an element in the current list of parents
+    local_parent = np.asarray(local_parent, dtype=int)
+    ngen = 0
+    while len(local_parent) != 0:
+        num_parents = len(local_parent)
+        if budget is not None:
+            budget['hit'] = budget_hit(budget, tree['ne'] + 1, num_parents, ngen)
+            if budget['hit'] is not None:
+                break
+        ngen = ngen + 1
+        ne = tree['ne']
+        nnod = tree['nnod']
+        # Make room for two branches from every parent
+        reserve_grown_tree(tree, ne + 1 + 2 * num_parents, nnod + 1 + 2 * num_parents)
+        node_loc = tree['nodes']
+        elems = tree['elems']
+        elem_upstream = tree['elem_up']
+        elem_downstream = tree['elem_down']
+        if len(slot_of_elem) < len(elems):
+            slot_of_elem = np.concatenate((slot_of_elem, np.zeros(len(elems) - len(slot_of_elem), dtype=int) - 1))
+        slot_of_elem[local_parent] = np.arange(num_parents)
+
+        # seed points belonging to each parent
+        seeds = np.nonzero(map_seed_to_elem)[0]
+        seed_slot = slot_of_elem[map_seed_to_elem[seeds]]
+        seeds = seeds[seed_slot >= 0]
+        seed_slot = seed_slot[seed_slot >= 0]
+        points = datapoints[seeds]
+        com = mesh_com_groups(seed_slot, points, num_parents)
+        num_points = com['num_points']
+        com = com['com']
+
+        np_start = elems[local_parent, 2]
+        np_prt_start = elems[local_parent, 1]
+        start_node_loc = node_loc[np_start, 1:4]
+        # Split the seed points by the plane (or line) defined by the parent branch and the com of its seed points
+        if sorv == 'surface':
+            checkvalue = (start_node_loc[seed_slot, 0] - com[seed_slot, 0]) * (points[:, 1] - com[seed_slot, 1]) \
+                         - (points[:, 0] - com[seed_slot, 0]) * (start_node_loc[seed_slot, 1] - com[seed_slot, 1])
+        else:
+            plane = pg_utilities.planes_from_3_pts(com, node_loc[np_prt_start, 1:4], start_node_loc)[seed_slot]
+            checkvalue = plane[:, 0] * points[:, 0] + plane[:, 1] * points[:, 1] + plane[:, 2] * points[:, 2]
+            checkvalue = -1.0 * checkvalue - plane[:, 3]
+        first_group = checkvalue >= 0
+        dat1 = np.bincount(seed_slot[first_group], minlength=num_parents)
+        dat2 = num_points - dat1
+        # Check that there are enough seed points in both groups to proceed
+        split = (num_points >= point_limit) & (dat1 >= point_limit) & (dat2 >= point_limit)
+
+        # Parents that split take the next two element numbers, in order, and their seed points move to the children
+        split_slot = np.nonzero(split)[0]
+        num_new = 2 * len(split_slot)
+        child_of_slot = np.zeros(num_parents, dtype=int) - 1
+        child_of_slot[split_slot] = 2 * np.arange(len(split_slot))
+        seed_split = split[seed_slot]
+        seed_child = child_of_slot[seed_slot[seed_split]] + np.where(first_group[seed_split], 0, 1)
+        map_seed_to_elem[seeds[seed_split]] = ne + 1 + seed_child
+
+        # Grow each new branch a fraction of the way towards the com of its seed points
+        child_parent = np.repeat(local_parent[split_slot], 2)
+        start_child = np.repeat(start_node_loc[split_slot], 2, axis=0)
+        com_child = mesh_com_groups(seed_child, points[seed_split], num_new)['com']
+        length_new = branch_lengths(fraction * (com_child - start_child))
+        branch = length_new >= min_length
+        length_new[~branch] = min_length
+        end_node_loc = start_child + length_new[:, np.newaxis] * (com_child - start_child) / \
+                       branch_lengths(com_child - start_child)[:, np.newaxis]
+        # Checks that branch angles are appropriate, for all new branches at once. Branches are in element order so
+        # the random perturbation of (anti-)parallel branches is drawn in the same order as in the one parent at a
+        # time algorithm
+        parent_start = node_loc[elems[child_parent, 1]]
+        if sorv == 'surface':
+            # the first node is as in grow_chorionic_surface
+            node1 = np.zeros((num_new, 3))
+            node1[:, 0:2] = parent_start[:, 0:2]
+            node2 = np.zeros((num_new, 3))
+            node2[:, 0:2] = start_child[:, 0:2]
+            node3 = np.zeros((num_new, 3))
+            node3[:, 0:2] = end_node_loc[:, 0:2]
+            end_node = mesh_check_angles(angle_min, angle_max, node1, node2, node3, legacy_angles=legacy_angles)
+            end_node_loc[:, 0:2] = end_node[:, 0:2]
+            # z is found one branch at a time, squaring a numpy scalar rounds differently to squaring an array
+            for nb in range(0, num_new):
+                end_node_loc[nb][2] = pg_utilities.z_from_xy(end_node[nb][0], end_node[nb][1], x_radius, y_radius,
+                                                             z_radius)
+        elif sorv == 'volume':
+            end_node_loc = mesh_check_angles(angle_min, angle_max, parent_start[:, 1:4], start_child, end_node_loc,
+                                             legacy_angles=legacy_angles)
+
+        # Create new elements and nodes
+        new_elems = ne + 1 + np.arange(num_new)
+        new_nodes = nnod + 1 + np.arange(num_new)
+        elems[new_elems, 0] = new_elems
+        elems[new_elems, 1] = np.repeat(np_start[split_slot], 2)
+        elems[new_elems, 2] = new_nodes
+        elem_upstream[new_elems, 0] = 1  # each new element has one parent
+        elem_upstream[new_elems, 1] = child_parent
+        elem_downstream[new_elems, 0] = 0  # and no children yet
+        split_parent = local_parent[split_slot]
+        num_children = elem_downstream[split_parent, 0]
+        elem_downstream[split_parent, num_children + 1] = new_elems[0::2]
+        elem_downstream[split_parent, num_children + 2] = new_elems[1::2]
+        elem_downstream[split_parent, 0] = num_children + 2
+        node_loc[new_nodes, 0] = new_nodes
+        node_loc[new_nodes, 1:4] = end_node_loc
+        tree['ne'] = ne + num_new
+        tree['nnod'] = nnod + num_new
+        if sink is not None and num_new != 0:
+            sink(node_loc[new_nodes], elems[new_elems])
+        if tree['orders'] is not None:
+            update_orders(tree, split_parent, new_elems)
+
+        # Parents that did not split become terminals, and the seed point closest to the end of each is removed
+        failed_slot = np.nonzero(~split)[0]
+        numtb = tree['numtb']
+        tree['tb_list'][numtb:numtb + len(failed_slot)] = local_parent[failed_slot]
+        tree['numtb'] = numtb + len(failed_slot)
+        seed_failed = ~seed_split
+        if np.any(seed_failed):
+            failed_seeds = seeds[seed_failed]
+            failed_seed_slot = seed_slot[seed_failed]
+            end_failed = start_node_loc[failed_seed_slot]
+            failed_points = points[seed_failed]
+            dist = np.sqrt((failed_points[:, 0] - end_failed[:, 0]) ** 2 + (failed_points[:, 1] - end_failed[:, 1]) ** 2
+                           + (failed_points[:, 2] - end_failed[:, 2]) ** 2)
+            in_range = dist < 1.0e10
+            # sort by parent, then distance, then seed number so the first of each parent is its closest seed point
+            order = np.lexsort((failed_seeds[in_range], dist[in_range], failed_seed_slot[in_range]))
+            sorted_slot = failed_seed_slot[in_range][order]
+            first_of_slot = np.ones(len(order), dtype=bool)
+            first_of_slot[1:] = sorted_slot[1:] != sorted_slot[:-1]
+            closest = failed_seeds[in_range][order][first_of_slot]
+            map_seed_to_elem[closest] = 0
+            remaining_data = remaining_data - len(closest)
+
+        # New branches that are too short become terminals and their seed points are removed, the rest are parents
+        # for the next generation
+        retired = new_elems[~branch]
+        numtb = tree['numtb']
+        tree['tb_list'][numtb:numtb + len(retired)] = retired
+        tree['numtb'] = numtb + len(retired)
+        if len(retired) != 0:
+            retired_seeds = seeds[seed_split][np.isin(map_seed_to_elem[seeds[seed_split]], retired)]
+            map_seed_to_elem[retired_seeds] = 0
+            remaining_data = remaining_data - len(retired_seeds)
+
+        slot_of_elem[local_parent] = -1
+        local_parent = new_elems[branch]
+        if remaining_data < original_data:  # only need to reallocate data if we have lost some data points
+            original_data = remaining_data
+            if reassign == 'incremental':
+                orphans = seeds[seed_failed]
+                orphans = orphans[map_seed_to_elem[orphans] != 0]
+                map_seed_to_elem[orphans] = data_to_mesh(map_seed_to_elem[orphans], datapoints[orphans], local_parent,
+                                                         node_loc, elems, 'grid')
+            else:
+                data_to_mesh(map_seed_to_elem, datapoints, local_parent, node_loc, elems, 'grid')
+
+        if checkpoint is not None:
+            checkpoint['generation'] = checkpoint['generation'] + 1
+            if checkpoint['generation'] % checkpoint['every'] == 0:
+                save_checkpoint(checkpoint, tree, map_seed_to_elem, local_parent, remaining_data, original_data)
+
+    return map_seed_to_elem
 
 
 def refine_1D(initial_geom, from_elem):
@@ -574,105 +1354,77 @@ def add_stem_villi(initial_geom, from_elem, sv_length):
             'elem_down': elem_connectivity['elem_down']}
 
 
-def mesh_check_angle(angle_min, angle_max, node1, node2, node3, ne_parent, myno):
-    normal_to_plane = np.zeros(3)
-    vector_cross_n = np.zeros(3)
-    vector1 = (node2 - node1)
-    vector1_u = vector1 / np.linalg.norm(vector1)
-    vector2 = (node3 - node2)
-    vector2_u = vector2 / np.linalg.norm(vector2)
-    # angle = pg_utilities.angle_two_vectors(vector1, vector2)
-    # if angle == 0:
-    #    print('in',vector1 / np.linalg.norm(vector1),vector2 / np.linalg.norm(vector2))
-
-    if (np.isclose(vector1_u, vector2_u)).all() or (np.isclose(vector1_u, -1.0 * vector2_u)).all():
+def mesh_check_angle(angle_min, angle_max, node1, node2, node3, ne_parent, myno, legacy_angles=False):
+    # Checks the angle of the branch node2 -> node3 to its parent node1 -> node2 (see mesh_check_angles)
+    node3 = mesh_check_angles(angle_min, angle_max, np.array([node1], dtype=float), np.array([node2], dtype=float),
+                              np.array([node3], dtype=float), legacy_angles=legacy_angles)
+
+    return node3[0]
+
+
+def mesh_check_angles(angle_min, angle_max, node1, node2, node3, rng=np.random, legacy_angles=False):
+    # Checks the branch angles of a whole generation of new branches at once
+    # node1, node2 = n x 3 arrays of the start and end of each parent, node3 = end of each new branch (starting at node2)
+    # Branches at an angle to their parent of less than angle_min or more than angle_max are rotated about the normal
+    # to the plane of the two branches onto the bound they are outside of, keeping their length. Returns the
+    # (corrected) end of each new branch
+    # A branch (anti-)parallel to its parent is first perturbed slightly with rng.uniform (np.random by default, or
+    # e.g. a np.random.RandomState), drawing three numbers for each such branch in row order
+    # legacy_angles = True uses the rotation of earlier versions of placentagen, to grow the same trees as they did.
+    # Its normal has the y component of the wrong sign and its rotation matrix uses the non-unit normal in two
+    # entries, so it does not bring branches onto the bounds and changes their length
+    node3 = np.array(node3, dtype=float)
+    vector1 = node2 - node1
+    vector1_u = vector1 / pg_utilities.vector_lengths(vector1)[:, np.newaxis]
+    vector2 = node3 - node2
+    vector2_u = vector2 / pg_utilities.vector_lengths(vector2)[:, np.newaxis]
+
+    aligned = np.all(np.isclose(vector1_u, vector2_u), axis=1) | np.all(np.isclose(vector1_u, -1.0 * vector2_u), axis=1)
+    if np.any(aligned):
         #   perturb new node slightly to 'misalign vectors and allow for normal to plane to be calculated
-        length = np.linalg.norm(vector2)
-        node3[0] = node3[0] + np.random.uniform(-0.01 * length, 0.01 * length)
-        node3[1] = node3[1] + np.random.uniform(-0.01 * length, 0.01 * length)
-        node3[2] = node3[2] + np.random.uniform(-0.01 * length, 0.01 * length)
+        length = pg_utilities.vector_lengths(vector2[aligned])[:, np.newaxis]
+        node3[aligned] = node3[aligned] + rng.uniform(-0.01 * length, 0.01 * length, (len(length), 3))
         vector2 = node3 - node2
 
-    # want to rotate vector 2 wrt vector 1
-    angle = pg_utilities.angle_two_vectors(vector1, vector2)
-    if angle == 0:
-        print('out', vector1 / np.linalg.norm(vector1), vector2 / np.linalg.norm(vector2))
-
-    normal_to_plane[0] = (vector2[1] * vector1[2] - vector2[2] * vector1[1])
-    normal_to_plane[1] = (vector2[0] * vector1[2] - vector2[2] * vector1[0])
-    normal_to_plane[2] = (vector2[0] * vector1[1] - vector2[1] * vector1[0])
-
-    normal_to_plane_u = normal_to_plane / np.linalg.norm(normal_to_plane)
-
-    vector_cross_n[0] = (vector1[1] * normal_to_plane[2] - vector1[2] * normal_to_plane[1])
-    vector_cross_n[1] = (vector1[0] * normal_to_plane[2] - vector1[2] * normal_to_plane[0])
-    vector_cross_n[2] = (vector1[0] * normal_to_plane[1] - vector1[1] * normal_to_plane[0])
-
-    dotprod = np.dot(vector2, vector_cross_n)
-
-    if dotprod < 0:
-        angle = -1 * angle
-
-    if abs(angle) < angle_min:
-        # Need to adjust node3 to get a angle equal to  angle_min
-        angle0 = abs(angle)
-        angle_rot = (angle0 - angle_min)  # amount of angle to add
-
-        # need to rotate around axis normal to the plane that the original and the vector make
-        # unit vector normal to plane:
-        R = np.zeros((3, 3))
-        R[0][0] = np.cos(angle_rot) + normal_to_plane_u[0] ** 2 * (1 - np.cos(angle_rot))
-        R[0][1] = normal_to_plane_u[0] * normal_to_plane_u[1] * (1 - np.cos(angle_rot)) - normal_to_plane_u[2] * np.sin(
-            angle_rot)
-        R[0][2] = normal_to_plane_u[0] * normal_to_plane[2] * (1 - np.cos(angle_rot)) + normal_to_plane_u[1] * np.sin(
-            angle_rot)
-        R[1][0] = normal_to_plane_u[0] * normal_to_plane_u[1] * (1 - np.cos(angle_rot)) + normal_to_plane_u[2] * np.sin(
-            angle_rot)
-        R[1][1] = np.cos(angle_rot) + normal_to_plane_u[1] ** 2 * (1 - np.cos(angle_rot))
-        R[1][2] = normal_to_plane_u[1] * normal_to_plane_u[2] * (1 - np.cos(angle_rot)) - normal_to_plane_u[0] * np.sin(
-            angle_rot)
-        R[2][0] = normal_to_plane_u[0] * normal_to_plane[2] * (1 - np.cos(angle_rot)) - normal_to_plane_u[1] * np.sin(
-            angle_rot)
-        R[2][1] = normal_to_plane_u[1] * normal_to_plane_u[2] * (1 - np.cos(angle_rot)) + normal_to_plane_u[0] * np.sin(
-            angle_rot)
-        R[2][2] = np.cos(angle_rot) + normal_to_plane_u[2] ** 2 * (1 - np.cos(angle_rot))
-        nu_vec = np.zeros(3)
-        nu_vec[0] = R[0][0] * vector2[0] + R[0][1] * vector2[1] + R[0][2] * vector2[2]
-        nu_vec[1] = R[1][0] * vector2[0] + R[1][1] * vector2[1] + R[1][2] * vector2[2]
-        nu_vec[2] = R[2][0] * vector2[0] + R[2][1] * vector2[1] + R[2][2] * vector2[2]
-
-        node3 = node2 + nu_vec
-
-    elif abs(angle) > angle_max:
-        # Need to adjust node3 to get a angle equal to  angle_max
-        angle0 = abs(angle)
-        angle_rot = (angle0 - angle_max)  # amount of angle to add
-
-        # need to rotate around axis normal to the plane that the original and the vector make
-        # unit vector normal to plane:
-        R = np.zeros((3, 3))
-        R[0][0] = np.cos(angle_rot) + normal_to_plane_u[0] ** 2 * (1 - np.cos(angle_rot))
-        R[0][1] = normal_to_plane_u[0] * normal_to_plane_u[1] * (1 - np.cos(angle_rot)) - normal_to_plane_u[2] * np.sin(
-            angle_rot)
-        R[0][2] = normal_to_plane_u[0] * normal_to_plane[2] * (1 - np.cos(angle_rot)) + normal_to_plane_u[1] * np.sin(
-            angle_rot)
-        R[1][0] = normal_to_plane_u[0] * normal_to_plane_u[1] * (1 - np.cos(angle_rot)) + normal_to_plane_u[2] * np.sin(
-            angle_rot)
-        R[1][1] = np.cos(angle_rot) + normal_to_plane_u[1] ** 2 * (1 - np.cos(angle_rot))
-        R[1][2] = normal_to_plane_u[1] * normal_to_plane_u[2] * (1 - np.cos(angle_rot)) - normal_to_plane_u[0] * np.sin(
-            angle_rot)
-        R[2][0] = normal_to_plane_u[0] * normal_to_plane[2] * (1 - np.cos(angle_rot)) - normal_to_plane_u[1] * np.sin(
-            angle_rot)
-        R[2][1] = normal_to_plane_u[1] * normal_to_plane_u[2] * (1 - np.cos(angle_rot)) + normal_to_plane_u[0] * np.sin(
-            angle_rot)
-        R[2][2] = np.cos(angle_rot) + normal_to_plane_u[2] ** 2 * (1 - np.cos(angle_rot))
-
-        nu_vec = np.zeros(3)
-        nu_vec[0] = R[0][0] * vector2[0] + R[0][1] * vector2[1] + R[0][2] * vector2[2]
-        nu_vec[1] = R[1][0] * vector2[0] + R[1][1] * vector2[1] + R[1][2] * vector2[2]
-        nu_vec[2] = R[2][0] * vector2[0] + R[2][1] * vector2[1] + R[2][2] * vector2[2]
-
-        node3 = node2 + nu_vec
+    # want to rotate vector 2 wrt vector 1, by the amount it is outside of the range of allowed angles
+    angle = pg_utilities.angles_two_vectors(vector1, vector2)
+    angle_rot = np.where(angle < angle_min, angle - angle_min, angle - angle_max)
+    rotate = np.nonzero((angle < angle_min) | (angle > angle_max))[0]
+    if len(rotate) == 0:
+        return node3
+    angle_rot = angle_rot[rotate]
+    vector1 = vector1[rotate]
+    vector2 = vector2[rotate]
+
+    # normal = vector2 x vector1, rotating vector2 about it by a positive angle brings it towards vector1
+    normal_to_plane = np.zeros((len(rotate), 3))
+    normal_to_plane[:, 0] = (vector2[:, 1] * vector1[:, 2] - vector2[:, 2] * vector1[:, 1])
+    normal_to_plane[:, 1] = (vector2[:, 2] * vector1[:, 0] - vector2[:, 0] * vector1[:, 2])
+    normal_to_plane[:, 2] = (vector2[:, 0] * vector1[:, 1] - vector2[:, 1] * vector1[:, 0])
+    if legacy_angles:
+        normal_to_plane[:, 1] = -1.0 * normal_to_plane[:, 1]
+    normal_to_plane_u = normal_to_plane / pg_utilities.vector_lengths(normal_to_plane)[:, np.newaxis]
+    if legacy_angles:
+        normal_z = normal_to_plane[:, 2]
+    else:
+        normal_z = normal_to_plane_u[:, 2]
+
+    # Rotation of vector2 around the normal to the plane
+    cos_rot = np.cos(angle_rot)
+    sin_rot = np.sin(angle_rot)
+    R = np.zeros((len(rotate), 3, 3))
+    R[:, 0, 0] = cos_rot + normal_to_plane_u[:, 0] ** 2 * (1 - cos_rot)
+    R[:, 0, 1] = normal_to_plane_u[:, 0] * normal_to_plane_u[:, 1] * (1 - cos_rot) - normal_to_plane_u[:, 2] * sin_rot
+    R[:, 0, 2] = normal_to_plane_u[:, 0] * normal_z * (1 - cos_rot) + normal_to_plane_u[:, 1] * sin_rot
+    R[:, 1, 0] = normal_to_plane_u[:, 0] * normal_to_plane_u[:, 1] * (1 - cos_rot) + normal_to_plane_u[:, 2] * sin_rot
+    R[:, 1, 1] = cos_rot + normal_to_plane_u[:, 1] ** 2 * (1 - cos_rot)
+    R[:, 1, 2] = normal_to_plane_u[:, 1] * normal_to_plane_u[:, 2] * (1 - cos_rot) - normal_to_plane_u[:, 0] * sin_rot
+    R[:, 2, 0] = normal_to_plane_u[:, 0] * normal_z * (1 - cos_rot) - normal_to_plane_u[:, 1] * sin_rot
+    R[:, 2, 1] = normal_to_plane_u[:, 1] * normal_to_plane_u[:, 2] * (1 - cos_rot) + normal_to_plane_u[:, 0] * sin_rot
+    R[:, 2, 2] = cos_rot + normal_to_plane_u[:, 2] ** 2 * (1 - cos_rot)
+    nu_vec = R[:, :, 0] * vector2[:, 0:1] + R[:, :, 1] * vector2[:, 1:2] + R[:, :, 2] * vector2[:, 2:3]
+
+    node3[rotate] = node2[rotate] + nu_vec
 
     return node3
 
@@ -757,6 +1509,50 @@ def data_splitby_plane(ld, datapoints, x0, x1, x2, ne_parent, ne_current, point_
     return {'enough_points': ss}
 
 
+def give_back_to_parent(ld, datapoints, ne_parent, ne_current, node):
+    # Gives seed points split to ne_current + 1 and ne_current + 2 back to ne_parent (when it could not branch), and
+    # finds the seed point of ne_parent closest to node. Returns its number, -1 if ne_parent has no seed points
+    min_dist = 1.0e10
+    nd_min = -1
+    for nd in range(0, len(datapoints)):
+        if ld[nd] != 0:
+            if ld[nd] == ne_current + 1:
+                ld[nd] = ne_parent  # give back to parent
+            if ld[nd] == ne_current + 2:
+                ld[nd] = ne_parent
+            dist = dist_two_vectors(datapoints[nd][:], node)
+            if dist < min_dist:
+                if ld[nd] == ne_parent:
+                    nd_min = nd
+                    min_dist = dist
+
+    return nd_min
+
+
+def growth_kernels(backend=None):
+    # The per seed point kernels of the one parent at a time algorithm: mesh_com, data_splitby_xy, data_splitby_plane,
+    # data_to_mesh (loop method) and give_back_to_parent
+    # backend = 'python' for the functions in this module (plain Python loops over the seed points), 'numba' for
+    #   compiled versions of them (see grow_kernels), which give identical trees. None uses the PLACENTAGEN_BACKEND
+    #   environment variable, or 'python' if it isn't set. 'numpy', the earlier name of 'python', is still accepted
+    # If numba isn't installed the python backend is used
+    if backend is None:
+        backend = os.environ.get('PLACENTAGEN_BACKEND', 'python')
+    if backend == 'numpy':
+        print('WARNING: the numpy backend is now called python')
+        backend = 'python'
+    if backend == 'numba':
+        kernels = grow_kernels.compiled_kernels()
+        if kernels is not None:
+            return kernels
+        print('WARNING: numba is not installed, using the python backend')
+    elif backend != 'python':
+        raise ValueError('Unknown backend ' + str(backend) + ', use python or numba')
+
+    return {'mesh_com': mesh_com, 'data_splitby_xy': data_splitby_xy, 'data_splitby_plane': data_splitby_plane,
+            'data_to_mesh': data_to_mesh, 'give_back_to_parent': give_back_to_parent}
+
+
 def calc_branch_direction(vector):
     length = 0.0
     for i in range(0, len(vector)):
@@ -775,53 +1571,48 @@ def dist_two_vectors(vector1, vector2):
 
 
 def group_elem_parent_term(ne_parent, elem_downstream):
-    parentlist = np.zeros(1000, dtype=int)
-    ne_old = np.zeros(1000, dtype=int)
-    ntemp_list = np.zeros(1000, dtype=int)
-    ne_temp = np.zeros(1000, dtype=int)
-
-    NT_BNS = 1
-    ne_old[0] = ne_parent
-    ne_count = 0
-    ntemp_list[ne_count] = 0
-    while NT_BNS != 0:
-        num_nodes = NT_BNS
-        NT_BNS = 0
-        for m in range(1, num_nodes + 1):
-            ne0 = int(ne_old[m])
-            for n in range(0, int(elem_downstream[ne0][0])):
-                NT_BNS = NT_BNS + 1
-                ne_temp[NT_BNS] = elem_downstream[ne0][n + 1]
-        for n in range(1, NT_BNS + 1):
-            ne_old[n] = ne_temp[n]
-            ne_count = ne_count + 1
-            ntemp_list[ne_count] = ne_temp[n]
-    ntemp_list[0] = ne_count
-    num_in_list = 0
-    for noelem in range(1, ne_count + 1):
-        ne = int(ntemp_list[noelem])
-        if elem_downstream[ne][0] == 0:
-            num_in_list = num_in_list + 1
-            parentlist[num_in_list - 1] = ne
-    parentlist.resize(num_in_list)
-    ne_old.resize(num_in_list)
-    ntemp_list.resize(num_in_list)
-    ne_temp.resize(num_in_list)
-    print('Grouped by parent,' + str(ne_parent) + ' No in parent list,' + str(num_in_list))
+    # Returns the terminal elements downstream of ne_parent, in breadth first order (children in the order they are
+    # listed in elem_downstream). The tree is walked one generation at a time, so it can be any size
+    elem_downstream = np.asarray(elem_downstream, dtype=int)
+    generation = np.array([ne_parent])
+    downstream = []
+    while len(generation) != 0:
+        num_children = elem_downstream[generation, 0]
+        children = elem_downstream[generation, 1:]
+        generation = children[np.arange(children.shape[1]) < num_children[:, np.newaxis]]
+        downstream.append(generation)
+    downstream = np.concatenate(downstream)
+    parentlist = downstream[elem_downstream[downstream, 0] == 0]
+    print('Grouped by parent,' + str(ne_parent) + ' No in parent list,' + str(len(parentlist)))
 
     return parentlist
 
 
-def data_to_mesh(ld, datapoints, parentlist, node_loc, elems):
+def data_to_mesh(ld, datapoints, parentlist, node_loc, elems, method='loop'):
     # Assigns data(seed) points to the closest ending of branches in the current generation.
+    # method = 'loop' measures every seed point to every branch ending, 'grid' finds the closest ending using a
+    # uniform grid spatial index. Both give the same assignment (the first branch in parentlist wins a tie)
+    if method == 'grid':
+        parentlist = np.asarray(parentlist, dtype=int)
+        seeds = np.nonzero(ld)[0]
+        ends = np.asarray(node_loc)[np.asarray(elems)[parentlist, 2].astype(int)][:, 1:4]
+        finite = np.all(np.isfinite(ends), axis=1)  # a seed is never closest to an undefined node
+        ld[seeds] = 0
+        if np.any(finite):
+            index = pg_utilities.build_grid_index(ends[finite])
+            closest = pg_utilities.nearest_in_grid_index(index, np.asarray(datapoints)[seeds])
+            found = closest['dist'] < 1e10
+            ld[seeds[found]] = parentlist[finite][closest['index'][found]]
+        return ld
+
     for nd in range(0, len(datapoints)):
         if ld[nd] != 0:
             ne_min = 0
             min_dist = 1e10
             for noelem in range(0, len(parentlist)):
                 ne = int(parentlist[noelem])
-                np = int(elems[ne][2])
-                dist = dist_two_vectors(node_loc[np][1:4], datapoints[nd])
+                nnod = int(elems[ne][2])
+                dist = dist_two_vectors(node_loc[nnod][1:4], datapoints[nd])
                 if dist < min_dist:
                     ne_min = ne
                     min_dist = dist
@@ -990,3 +1781,31 @@ def mesh_com(ld_val, ld, datapoints):
         com = com / dat
 
     return com
+
+
+def branch_lengths(vectors):
+    # Length of each row of an n x 3 array of branch vectors
+    # np.linalg.norm goes through a BLAS dot product whose rounding depends on the memory alignment of the vector,
+    # so each row is copied to a fresh array before taking its norm. The lengths are then bit for bit the same as in
+    # the one branch at a time algorithm, which matters because seed points sitting on a splitting plane (e.g. the
+    # only seed point of a branch) are assigned by the sign of a round-off sized number
+    lengths = np.zeros(len(vectors))
+    for nb in range(0, len(vectors)):
+        lengths[nb] = np.linalg.norm(np.array(vectors[nb]))
+
+    return lengths
+
+
+def mesh_com_groups(groups, datapoints, num_groups):
+    # Centre of mass of every group of seed points at once
+    # groups = group index (0 to num_groups - 1) of each seed point
+    # Sums are accumulated in seed point order, as in mesh_com, so each centre of mass is identical to calling
+    # mesh_com for that group. Groups with no seed points have a centre of mass at the origin.
+    num_in_group = np.bincount(groups, minlength=num_groups)
+    com = np.zeros((num_groups, 3))
+    for nj in range(0, 3):
+        com[:, nj] = np.bincount(groups, weights=datapoints[:, nj], minlength=num_groups)
+    has_data = num_in_group != 0
+    com[has_data] = com[has_data] / num_in_group[has_data][:, np.newaxis]
+
+    return {'com': com, 'num_points': num_in_group}
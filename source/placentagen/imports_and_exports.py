@@ -1,18 +1,37 @@
 #!/usr/bin/env python
+import asyncio
+import concurrent.futures
+import gzip
+import itertools
+import json
+import os
+import re
+
 import numpy as np
 
-def export_ex_coords(data, groupname, filename, type):
+def export_ex_coords(data, groupname, filename, type, compress=False):
     # Exports coordinates to exnode or exdata format
     # data = array of data
     # groupname = what you want your data to be called in cmgui
     # filename = file name without extension
     # type = exnode or exdata
+    # compress = write a gzip compressed file (filename.type.gz)
     data_length = len(
         data[0])  # if this is 3 then number nodes or data automatically if 4 then node numbers are given as
     # first entry
-    data_num = len(data)
     filename = filename + '.' + type
-    f = open(filename, 'w')
+    f = open_ex_output(filename, compress)
+    write_exnode_header(f, groupname)
+    if data_length == 4:
+        write_exnodes(f, data)
+    else:
+        write_blocks(f, node_format, [list(range(1, len(data) + 1)), ex_values(data, 0), ex_values(data, 1),
+                                      ex_values(data, 2)])
+    f.close()
+
+
+def write_exnode_header(f, groupname):
+    # Writes the group name and coordinate field of an exnode or exdata file to the open file f
     f.write(" Group name: %s\n" % groupname)
     f.write(" #Fields=1\n")
     f.write(" 1) coordinates, coordinate, rectangular cartesian, #Components=3\n")
@@ -20,28 +39,30 @@ def export_ex_coords(data, groupname, filename, type):
     f.write(" y.  Value index=1, #Derivatives=0\n")
     f.write(" z.  Value index=1, #Derivatives=0\n")
 
-    for x in range(0, data_num):
-        if data_length is 4:
-            f.write("Node:  "        "%s\n" % int(data[x][0] + 1))
-            f.write("          %s\n" % data[x][1])
-            f.write("          %s\n" % data[x][2])
-            f.write("          %s\n" % data[x][3])
-        else:
-            f.write("Node:  "        "%s\n" % (x + 1))
-            f.write("          %s\n" % data[x][0])
-            f.write("          %s\n" % data[x][1])
-            f.write("          %s\n" % data[x][2])
-    f.close()
+
+node_format = "Node:  %s\n          %s\n          %s\n          %s\n"
 
 
-def export_exelem_1d(data, groupname, filename):
+def write_exnodes(f, data):
+    # Writes nodes (rows of node number, x, y, z, numbered from 0) to the open exnode file f
+    write_blocks(f, node_format, [ex_numbers(data, 0), ex_values(data, 1), ex_values(data, 2), ex_values(data, 3)])
+
+
+def export_exelem_1d(data, groupname, filename, compress=False):
     # Exports element locations to exelem format
     # data = array of data
     # groupname = what you want your data to be called in cmgui
     # filename = file name without extension
-    data_num = len(data)
+    # compress = write a gzip compressed file (filename.exelem.gz)
     filename = filename + '.exelem'
-    f = open(filename, 'w')
+    f = open_ex_output(filename, compress)
+    write_exelem_1d_header(f, groupname)
+    write_exelems_1d(f, data)
+    f.close()
+
+
+def write_exelem_1d_header(f, groupname):
+    # Writes the group name, shape and coordinate field of a 1D exelem file to the open file f
     f.write(" Group name: %s\n" % groupname)
     f.write(" Shape.  Dimension=1\n")
     f.write(" #Scale factor sets= 1\n")
@@ -49,149 +70,131 @@ def export_exelem_1d(data, groupname, filename):
     f.write(" #Nodes=           2\n")
     f.write(" #Fields=1\n")
     f.write(" 1) coordinates, coordinate, rectangular cartesian, #Components=3\n")
-    f.write("   x.  l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 2\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   1\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   2\n")
-    f.write("   y.  l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 2\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   1\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   2\n")
-    f.write("   z.  l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 2\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   1\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   2\n")
-    for x in range(0, data_num):
-        f.write(" Element:            %s 0 0\n" % int(data[x][0] + 1))
-        f.write("   Nodes:\n")
-        f.write("                %s            %s\n" % (int(data[x][1] + 1), int(data[x][2] + 1)))
-        f.write("   Scale factors:\n")
-        f.write("       0.1000000000000000E+01   0.1000000000000000E+01\n")
-    f.close()
+    for component in ['x', 'y', 'z']:
+        f.write("   %s.  l.Lagrange, no modify, standard node based.\n" % component)
+        f.write("     #Nodes= 2\n")
+        f.write("      1.  #Values=1\n")
+        f.write("       Value indices:     1\n")
+        f.write("       Scale factor indices:   1\n")
+        f.write("      2.  #Values=1\n")
+        f.write("       Value indices:     1\n")
+        f.write("       Scale factor indices:   2\n")
+
+
+def write_exelems_1d(f, data):
+    # Writes elements (rows of element number, start node, end node, numbered from 0) to the open exelem file f
+    write_blocks(f, " Element:            %s 0 0\n   Nodes:\n                %s            %s\n   Scale factors:\n"
+                    "       0.1000000000000000E+01   0.1000000000000000E+01\n",
+                 [ex_numbers(data, 0), ex_numbers(data, 1), ex_numbers(data, 2)])
+
+
+ex_block_size = 20000  # number of nodes or elements formatted and written at a time
+
+
+def write_blocks(f, record_format, columns):
+    # Writes one record_format per row of the columns (lists of the values of each row), a block of rows at a time
+    # Each block is formatted with a single % on record_format repeated, so values are written exactly as
+    # record_format % values would write them row by row
+    num_rows = len(columns[0])
+    for start in range(0, num_rows, ex_block_size):
+        block = zip(*[column[start:start + ex_block_size] for column in columns])
+        f.write(record_format * min(ex_block_size, num_rows - start) % tuple(itertools.chain.from_iterable(block)))
+
+
+def ex_values(data, column=None):
+    # The values data[x][column] (data[x] if column is None) for all x, as objects '%s' writes in the same way. Float64
+    # and integer arrays are converted to Python numbers in one go, as they print the same
+    if column is None:
+        values = data
+    elif isinstance(data, np.ndarray) and data.ndim == 2:
+        values = data[:, column]
+    else:
+        return [data[x][column] for x in range(0, len(data))]
+    if isinstance(values, np.ndarray) and values.ndim == 1 and (values.dtype == np.float64 or values.dtype.kind in 'biu'):
+        return values.tolist()
+
+    return [values[x] for x in range(0, len(values))]
+
+
+def ex_numbers(data, column):
+    # The node or element numbers int(data[x][column] + 1) for all x, for numbers stored from 0 and written from 1
+    if isinstance(data, np.ndarray) and data.ndim == 2:
+        values = data[:, column]
+    else:
+        values = np.array([data[x][column] for x in range(0, len(data))])
+
+    return (values + 1).astype(np.int64).tolist()
+
 
+def open_ex_output(filename, compress):
+    # Opens filename to write an ex file to, or filename.gz when compress is True
+    if compress:
+        return gzip.open(filename + '.gz', 'wt', compresslevel=6)
 
-def export_exelem_3d_linear(data, groupname, filename):
+    return open(filename, 'w')
+
+
+def open_ex_stream(groupname, filename):
+    # Opens filename.exnode and filename.exelem to be written a few nodes and elements at a time, e.g. a generation
+    # at a time while a tree is grown: pass sink=lambda nodes, elems: write_ex_stream(stream, nodes, elems) to
+    # grow_large_tree or grow_chorionic_surface. The files are flushed after each write so they can be loaded into
+    # cmgui while the tree is still growing. Returns the stream (the two open files), close with close_ex_stream
+    # This streams the writing only, growth still keeps the whole tree in memory (see grow_large_tree)
+    stream = {'exnode': open(filename + '.exnode', 'w'), 'exelem': open(filename + '.exelem', 'w')}
+    write_exnode_header(stream['exnode'], groupname)
+    write_exelem_1d_header(stream['exelem'], groupname)
+
+    return stream
+
+
+def write_ex_stream(stream, nodes, elems):
+    # Appends nodes (rows as in export_ex_coords) and 1D elements (rows as in export_exelem_1d) to a stream from
+    # open_ex_stream
+    write_exnodes(stream['exnode'], nodes)
+    write_exelems_1d(stream['exelem'], elems)
+    stream['exnode'].flush()
+    stream['exelem'].flush()
+
+
+def close_ex_stream(stream):
+    stream['exnode'].close()
+    stream['exelem'].close()
+
+
+def export_exelem_3d_linear(data, groupname, filename, compress=False):
     # Exports element locations to exelem format
     # data = array of data
     # groupname = what you want your data to be called in cmgui
     # filename = file name without extension
-    data_num = len(data)
+    # compress = write a gzip compressed file (filename.exelem.gz)
     filename = filename + '.exelem'
-    f = open(filename, 'w')
+    f = open_ex_output(filename, compress)
     f.write(" Group name: %s\n" % groupname)
     f.write(" Shape. Dimension=3 line*line*line\n")
     f.write(" #Scale factor sets= 0\n")
     f.write(" #Nodes=           8\n")
     f.write(" #Fields=1\n")
     f.write(" 1) coordinates, coordinate, rectangular cartesian, #Components=3\n")
-    f.write("   x.  l.Lagrange*l.Lagrange*l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 8\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      3.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      4.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      5.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      6.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      7.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      8.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("   y.  l.Lagrange*l.Lagrange*l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 8\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      3.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      4.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      5.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      6.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      7.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      8.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("   z.  l.Lagrange*l.Lagrange*l.Lagrange, no modify, standard node based.\n")
-    f.write("     #Nodes= 8\n")
-    f.write("      1.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      2.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      3.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      4.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      5.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      6.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      7.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    f.write("      8.  #Values=1\n")
-    f.write("       Value indices:     1\n")
-    f.write("       Scale factor indices:   0\n")
-    for x in range(0, data_num):
-        f.write(" Element:            %s 0 0\n" % int(data[x][0] + 1))
-        f.write("   Nodes:")
-        f.write(
-            "                %s            %s            %s            %s            %s            %s            %s            %s\n" % (
-                int(data[x][1] + 1), int(data[x][2] + 1), int(data[x][3] + 1), int(data[x][4] + 1), int(data[x][5] + 1),
-                int(data[x][6] + 1), int(data[x][7] + 1), int(data[x][8] + 1)))
+    for component in ['x', 'y', 'z']:
+        f.write("   %s.  l.Lagrange*l.Lagrange*l.Lagrange, no modify, standard node based.\n" % component)
+        f.write("     #Nodes= 8\n")
+        for node in range(1, 9):
+            f.write("      %s.  #Values=1\n" % node)
+            f.write("       Value indices:     1\n")
+            f.write("       Scale factor indices:   0\n")
+    write_blocks(f, " Element:            %s 0 0\n   Nodes:" + "                %s" + "            %s" * 7 + "\n",
+                 [ex_numbers(data, column) for column in range(0, 9)])
 
     f.close()
 
-def export_exfield_3d_linear(data, groupname, fieldname, filename):
+def export_exfield_3d_linear(data, groupname, fieldname, filename, compress=False):
     # Exports element locations to exelem format
     # data = array of data
     # groupname = what you want your data to be called in cmgui
     # filename = file name without extension
-    data_num = len(data)
+    # compress = write a gzip compressed file (filename.exelem.gz)
     filename = filename + '.exelem'
-    f = open(filename, 'w')
+    f = open_ex_output(filename, compress)
     f.write(" Group name: %s\n" % groupname)
     f.write(" Shape. Dimension=3 line*line*line\n")
     f.write(" #Scale factor sets= 0\n")
@@ -202,23 +205,20 @@ def export_exfield_3d_linear(data, groupname, fieldname, filename):
     f.write("   #xi1=1 \n")
     f.write("   #xi2=1 \n")
     f.write("   #xi3=1 \n")
-    for x in range(0, data_num):
-        f.write(" Element:            %s 0 0\n" % int(x + 1))
-        f.write("   Values:\n")
-        f.write(
-            "           %s       %s       %s       %s       %s       %s       %s       %s\n" % (
-                data[x], data[x], data[x], data[x], data[x], data[x], data[x], data[x]))
+    values = [str(value) for value in ex_values(data)]  # each value is written 8 times, so format it once
+    write_blocks(f, " Element:            %s 0 0\n   Values:\n" + "           %s" + "       %s" * 7 + "\n",
+                 [list(range(1, len(data) + 1))] + [values] * 8)
 
     f.close()
 
-def export_exfield_1d_linear(data, groupname, fieldname, filename):
+def export_exfield_1d_linear(data, groupname, fieldname, filename, compress=False):
     # Exports element locations to exelem format
     # data = array of data
     # groupname = what you want your data to be called in cmgui
     # filename = file name without extension
-    data_num = len(data)
+    # compress = write a gzip compressed file (filename.exelem.gz)
     filename = filename + '.exelem'
-    f = open(filename, 'w')
+    f = open_ex_output(filename, compress)
     f.write(" Group name: %s\n" % groupname)
     f.write(" Shape.  Dimension=1\n")
     f.write(" #Scale factor sets= 0\n")
@@ -227,76 +227,401 @@ def export_exfield_1d_linear(data, groupname, fieldname, filename):
     f.write(" 1) %s, field, rectangular cartesian, #Components=1\n" % fieldname)
     f.write("   %s.  l.Lagrange, no modify, grid based.\n" % fieldname)
     f.write("   #xi1=1 \n")
-    for x in range(0, data_num):
-        f.write(" Element:            %s 0 0\n" % int(x + 1))
-        f.write("   Values:\n")
-        f.write(
-            "           %s       %s\n" % (
-                data[x], data[x]))
+    values = [str(value) for value in ex_values(data)]
+    write_blocks(f, " Element:            %s 0 0\n   Values:\n           %s       %s\n",
+                 [list(range(1, len(data) + 1)), values, values])
     f.close()
 
 
+binary_magic = b'PGBIN\x00\x00\x00'  # first 8 bytes of a placentagen binary file
+binary_format_version = 1  # version of the header schema written by export_binary
+binary_alignment = 64  # arrays start at multiples of this many bytes
+
+
+def export_binary(data, filename, kind='tree'):
+    # Exports a dict of arrays to placentagen's binary format (filename.pgbin), which keeps the dtype and precision of
+    # every value and is loaded with import_binary
+    # data = dict of arrays, numbers or strings. Entries that are dicts (e.g. orders, status) are stored one level
+    #   down, entries that are None are left out
+    # kind = 'tree' (needs nodes and elems, e.g. a geometry dict with elem_up, elem_down and fields such as radius
+    #   or orders), 'grid' (a sampling grid and fields on it) or 'index' (from index_ex_file)
+    # The file is an 8 byte magic number, data_start (little-endian uint64), a JSON header (format version, kind, and
+    # the name, dtype, shape and byte offset of each array from data_start) padded with zero bytes, and then from
+    # data_start the raw little-endian arrays. data_start is the byte offset in the file of the array data, not the
+    # length of the header: it is the end of the header rounded up to a multiple of 64, and each array is also
+    # aligned to 64 bytes. Arrays are stored column by column so that one column can be read on its own
+    # The file is written under a temporary name and then renamed, so arrays still memory mapped from a file it
+    # replaces keep their data rather than being truncated under the caller
+    if kind not in ['tree', 'grid', 'index']:
+        raise ValueError('Unknown binary kind ' + str(kind) + ', expected tree, grid or index')
+    if kind == 'tree' and ('nodes' not in data or 'elems' not in data):
+        raise ValueError('A binary tree needs nodes and elems')
+    arrays = []
+    for name in data:
+        if isinstance(data[name], dict):
+            arrays = arrays + [(name + '/' + key, data[name][key]) for key in data[name]]
+        else:
+            arrays.append((name, data[name]))
+    entries = []
+    offset = 0
+    for name, value in arrays:
+        if value is None:
+            continue
+        value = np.asarray(value)
+        if value.dtype.hasobject:
+            raise ValueError('Cannot store ' + name + ' in binary format, its values are not numbers or strings')
+        value = value.astype(value.dtype.newbyteorder('<'), copy=False)
+        offset = offset + (-offset) % binary_alignment
+        entries.append({'name': name, 'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset,
+                        'array': value})
+        offset = offset + value.nbytes
+    header = json.dumps({'version': binary_format_version, 'kind': kind,
+                         'arrays': [{key: entry[key] for key in ['name', 'dtype', 'shape', 'offset']}
+                                    for entry in entries]}).encode()
+    data_start = len(binary_magic) + 8 + len(header)
+    data_start = data_start + (-data_start) % binary_alignment
+    temporary = filename + '.pgbin.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(binary_magic)
+        f.write(np.uint64(data_start).astype('<u8').tobytes())
+        f.write(header)
+        for entry in entries:
+            f.write(bytes(data_start + entry['offset'] - f.tell()))
+            f.write(entry['array'].tobytes(order='F'))
+    os.replace(temporary, filename + '.pgbin')
+
+
+def import_binary(filename, mode='r'):
+    # Imports a file written by export_binary as a dict of arrays, memory mapped so that only the parts used are read
+    # from disk. Entries that were dicts are dicts again
+    # mode = 'r' (read only), 'c' (changes are kept in memory) or 'r+' (changes are written to the file), as for
+    #   np.memmap
+    header = read_binary_header(filename)
+    data = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if int(np.prod(shape)) == 0 or len(shape) == 0:  # np.memmap cannot map empty arrays or scalars
+            with open(filename, 'rb') as f:
+                f.seek(header['data_start'] + entry['offset'])
+                value = np.frombuffer(f.read(dtype.itemsize * int(np.prod(shape))), dtype=dtype).reshape(shape)
+            value = value[()] if len(shape) == 0 else value.copy()
+        else:
+            value = np.memmap(filename, dtype=dtype, mode=mode, offset=header['data_start'] + entry['offset'],
+                              shape=shape, order='F')
+        if '/' in entry['name']:
+            name, key = entry['name'].split('/', 1)
+            data.setdefault(name, {})[key] = value
+        else:
+            data[entry['name']] = value
+
+    return data
+
+
+def read_binary_header(filename):
+    # Header of a file written by export_binary: version, kind, data_start and arrays (name, dtype, shape and offset
+    # of each array from data_start)
+    with open(filename, 'rb') as f:
+        if f.read(len(binary_magic)) != binary_magic:
+            raise ValueError(filename + ' is not a placentagen binary file')
+        data_start = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(data_start - len(binary_magic) - 8).rstrip(b'\x00').decode())
+    if header['version'] > binary_format_version:
+        raise ValueError(filename + ' has binary format version ' + str(header['version']) +
+                         ', this placentagen reads up to version ' + str(binary_format_version))
+    header['data_start'] = data_start
+
+    return header
+
+
 def import_exnode_tree(filename):
-    # count nodes for check of correct number for the user, plus use in future arrays
-    count_node = 0
-    # Initialise array of node numbers and values
-    node_array = np.empty((0,7))
-    # open file
-    with open(filename) as f:
-        # loop through lines of file
-        while 1:
-            line = f.readline()
-            if not line:
-                break  # exit if done with all lines
-            # identifying whether there is a node defined here
-            line_type = str.split(line)[0]
-            if (line_type == 'Node:'):  # line defines new node
-                count_node = count_node + 1  # count the node
-                count_atribute = 0  # intitalise attributes of the node (coordinates, radius)
-                node_array=np.append(node_array,np.zeros((1,7)),axis = 0)  # initialise a list of attributes for each node
-                node_array[count_node - 1][count_atribute] = int(str.split(line)[1])-1
-            else:
-                line_num = is_float(line_type)  # checking if the line is a number
-                if (line_num):  # it is a number
-                    if not "index" in line:
-                        count_atribute = count_atribute + 1
-                        node_array[count_node - 1][count_atribute] = float(str.split(line)[0])
-    total_nodes = count_node
+    # Reads the node numbers (from 0) and up to six values per node (coordinates, radius, ...) of an exnode file,
+    # which may be gzip compressed. The file is read in one pass and the array built at the end
+    with open_ex_file(filename) as f:
+        return read_exnode_lines(f)
+
+
+def read_exnode_lines(lines):
+    # Nodes (as import_exnode_tree) of the lines of an exnode file, or of part of one
+    numbers = []  # node numbers in file order
+    values = []  # the values of all nodes in file order
+    num_values = []  # number of values of each node
+    for line in lines:
+        tokens = line.split(None, 2)
+        if len(tokens) == 0:
+            continue
+        if tokens[0] == 'Node:':  # line defines new node
+            numbers.append(int(tokens[1]) - 1)
+            num_values.append(0)
+        elif 'index' not in line and len(numbers) > 0:
+            # any line of a node whose first token is a number (including nan or inf) is a value
+            try:
+                values.append(float(tokens[0]))
+            except ValueError:  # not a number
+                continue
+            num_values[-1] = num_values[-1] + 1
+    total_nodes = len(numbers)
+    node_array = np.zeros((total_nodes, 7))
+    node_array[:, 0] = numbers
+    rows = np.repeat(np.arange(total_nodes), num_values)
+    node_array[rows, value_columns(num_values)] = values
+
     return {'total_nodes': total_nodes, 'nodes': node_array}
 
 
 def import_exelem_tree(filename):
-    # count element for check of correct number for the user, plus use in future arrays
-    count_el = 0
-    # Initialise array of el numbers and values
-    el_array = np.empty((0,3),dtype = int)
-    # open file
-    with open(filename) as f:
-        # loop through lines of file
-        while 1:
-            line = f.readline()
-            if not line:
-                break  # exit if done with all lines
-            # identifying whether there is an element defined here
-            line_type = str.split(line)[0]
-
-            if (line_type == 'Element:'):  # line dedfines new el
-                count_el = count_el + 1  # count the el
-                count_atribute = 0  # intitalise attributes of the el (1st el, 2nd el)
-                el_array = np.append(el_array, np.zeros((1, 3),dtype = int), axis=0)
-                el_array[count_el - 1][count_atribute] = int(str.split(line)[1])-1
-            else:
-                line_num = is_float(line_type)  # checking if the line is a number
-                if (line_num):  # it is a number
-                    if "#Values" not in line and "l.Lagrange" not in line and "0.1000000000000000E+01" not in line:
-                        count_atribute = count_atribute + 1
-                        el_array[count_el - 1][count_atribute] = float(str.split(line)[0])-1  # first node of element
-                        el_array[count_el - 1][count_atribute + 1] = float(str.split(line)[1])-1  # 2nd node of element
-
-    total_el = count_el
+    # Reads the element numbers and the two nodes of each element (all numbered from 0) of a 1D exelem file, which
+    # may be gzip compressed. The file is read in one pass and the array built at the end
+    with open_ex_file(filename) as f:
+        return read_exelem_lines(f)
+
+
+def read_exelem_lines(lines):
+    # Elements (as import_exelem_tree) of the lines of an exelem file, or of part of one
+    numbers = []  # element numbers in file order
+    elem_nodes = []  # the start and end nodes of all elements in file order
+    num_values = []  # number of node lines of each element
+    for line in lines:
+        tokens = line.split(None, 2)
+        if len(tokens) == 0:
+            continue
+        if tokens[0] == 'Element:':  # line defines new el
+            numbers.append(int(tokens[1]) - 1)
+            num_values.append(0)
+        elif tokens[0][0] in number_start and len(numbers) > 0 and is_float(tokens[0]):
+            if '#Values' not in line and 'l.Lagrange' not in line and '0.1000000000000000E+01' not in line:
+                elem_nodes.append(float(tokens[0]) - 1)
+                elem_nodes.append(float(tokens[1]) - 1)
+                num_values[-1] = num_values[-1] + 1
+    total_el = len(numbers)
+    el_array = np.zeros((total_el, 3), dtype=int)
+    el_array[:, 0] = numbers
+    if len(elem_nodes) > 0:
+        rows = np.repeat(np.arange(total_el), num_values)
+        columns = value_columns(num_values)
+        elem_nodes = np.array(elem_nodes).reshape(-1, 2)
+        el_array[rows, columns] = elem_nodes[:, 0]
+        el_array[rows, columns + 1] = elem_nodes[:, 1]
+
     return {'total_elems': total_el, 'elems': el_array}
 
 
+number_start = set('0123456789+-.')  # characters an element's node number in an exelem file can start with
+
+
+def open_ex_file(filename):
+    # Opens an ex file for reading as text, decompressing it if it is gzip compressed (whatever its extension)
+    with open(filename, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    if compressed:
+        return gzip.open(filename, 'rt')
+
+    return open(filename)
+
+
+def value_columns(num_values):
+    # Column of each value read for a node or element: the values of each start in column 1
+    num_values = np.asarray(num_values, dtype=int)
+    starts = np.cumsum(num_values) - num_values
+
+    return 1 + np.arange(np.sum(num_values)) - np.repeat(starts, num_values)
+
+
+def import_ex_trees(file_pairs, threads=4):
+    # Imports many trees, each an (exnode, exelem) pair of file names, parsing the files in a pool of threads so that
+    # waiting for the disk (and gzip decompression) overlaps with parsing. Returns one dict per pair, in the order
+    # given: exnode, exelem, nodes, elems, total_nodes, total_elems (as from import_exnode_tree and import_exelem_tree)
+    # and error. A file that cannot be read does not stop the others: its arrays are None and error says why
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        nodes = [pool.submit(try_io, pair[0], import_exnode_tree, pair[0]) for pair in file_pairs]
+        elems = [pool.submit(try_io, pair[1], import_exelem_tree, pair[1]) for pair in file_pairs]
+        return [imported_tree(file_pairs[n], nodes[n].result(), elems[n].result()) for n in range(0, len(file_pairs))]
+
+
+async def import_ex_trees_async(file_pairs, threads=4):
+    # import_ex_trees for asyncio: files are parsed in a pool of threads while the event loop carries on
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        nodes = [loop.run_in_executor(pool, try_io, pair[0], import_exnode_tree, pair[0]) for pair in file_pairs]
+        elems = [loop.run_in_executor(pool, try_io, pair[1], import_exelem_tree, pair[1]) for pair in file_pairs]
+        nodes = await asyncio.gather(*nodes)
+        elems = await asyncio.gather(*elems)
+
+    return [imported_tree(file_pairs[n], nodes[n], elems[n]) for n in range(0, len(file_pairs))]
+
+
+def imported_tree(file_pair, nodes, elems):
+    # One result of import_ex_trees from the results of try_io for its exnode and exelem files
+    errors = [error for error in [nodes['error'], elems['error']] if error is not None]
+    tree = {'exnode': file_pair[0], 'exelem': file_pair[1], 'nodes': None, 'elems': None, 'total_nodes': None,
+            'total_elems': None, 'error': '; '.join(errors) if len(errors) > 0 else None}
+    if nodes['error'] is None:
+        tree['nodes'] = nodes['result']['nodes']
+        tree['total_nodes'] = nodes['result']['total_nodes']
+    if elems['error'] is None:
+        tree['elems'] = elems['result']['elems']
+        tree['total_elems'] = elems['result']['total_elems']
+    if tree['error'] is not None:
+        print('WARNING: ' + tree['error'])
+
+    return tree
+
+
+def export_ex_trees(trees, threads=4, compress=False):
+    # Exports many trees, each a dict of nodes, elems, groupname and filename (without extension), to exnode and
+    # exelem files as export_ex_coords and export_exelem_1d do, writing in a pool of threads
+    # Returns the error of each tree in the order given, None for trees that were written. A tree that cannot be
+    # written does not stop the others
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        written = [[pool.submit(try_io, tree['filename'] + extension, function, tree, compress)
+                    for extension, function in ex_tree_writers] for tree in trees]
+        return [exported_tree([task.result() for task in tasks]) for tasks in written]
+
+
+async def export_ex_trees_async(trees, threads=4, compress=False):
+    # export_ex_trees for asyncio: files are written in a pool of threads while the event loop carries on
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        written = [asyncio.gather(*[loop.run_in_executor(pool, try_io, tree['filename'] + extension, function, tree,
+                                                         compress) for extension, function in ex_tree_writers])
+                   for tree in trees]
+        written = await asyncio.gather(*written)
+
+    return [exported_tree(results) for results in written]
+
+
+def export_tree_nodes(tree, compress):
+    export_ex_coords(tree['nodes'], tree['groupname'], tree['filename'], 'exnode', compress)
+
+
+def export_tree_elems(tree, compress):
+    export_exelem_1d(tree['elems'], tree['groupname'], tree['filename'], compress)
+
+
+ex_tree_writers = [('.exnode', export_tree_nodes), ('.exelem', export_tree_elems)]
+
+
+def exported_tree(results):
+    # Error of one tree of export_ex_trees from the results of try_io for its exnode and exelem files
+    errors = [result['error'] for result in results if result['error'] is not None]
+    if len(errors) == 0:
+        return None
+    print('WARNING: ' + '; '.join(errors))
+
+    return '; '.join(errors)
+
+
+def try_io(filename, function, *args):
+    # Runs function(*args) to read or write filename, returning {'result': what it returned, 'error': None}, or
+    # {'result': None, 'error': what went wrong} if it raised an exception
+    try:
+        return {'result': function(*args), 'error': None}
+    except Exception as error:
+        return {'result': None, 'error': filename + ': ' + type(error).__name__ + ': ' + str(error)}
+
+
+ex_record_start = {b'Node:': re.compile(rb'Node:[ \t]*(\d+)'), b'Element:': re.compile(rb'Element:[ \t]*(\d+)')}
+ex_index_chunk_size = 1 << 26  # bytes of an ex file scanned at a time by index_ex_file
+
+
+def index_ex_file(filename):
+    # Index of the node or element records of an (uncompressed) exnode or exelem file: numbers = node or element
+    # numbers (from 0, sorted), starts = byte offset of each record, ends = byte offset of the record after it in the
+    # file (or the end of the file). The index is kept in a sidecar file, filename.pgbin, which is used again while
+    # the size and modification time of the file are unchanged
+    sidecar = filename + '.pgbin'
+    stat = os.stat(filename)
+    if os.path.exists(sidecar):
+        try:
+            index = import_binary(sidecar)
+        except ValueError:  # not an index this version can read, write it again
+            index = None
+        if index is not None and index['size'] == stat.st_size and index['mtime'] == stat.st_mtime_ns:
+            return index
+    records = scan_ex_records(filename)
+    order = np.argsort(records['numbers'], kind='stable')
+    export_binary({'numbers': records['numbers'][order], 'starts': records['starts'][order],
+                   'ends': records['ends'][order], 'size': np.int64(stat.st_size),
+                   'mtime': np.int64(stat.st_mtime_ns)}, filename, kind='index')
+
+    return import_binary(sidecar)
+
+
+def scan_ex_records(filename):
+    # Numbers (from 0), start and end byte offsets of the node or element records of an ex file, in file order. The
+    # file is read in large chunks and searched for the record keyword (Node: or Element:, whichever comes first),
+    # not parsed line by line. A record starts at its keyword, which has to follow white space as it starts a line
+    numbers = []
+    starts = []
+    keyword = None
+    with open(filename, 'rb') as f:
+        if f.read(2) == b'\x1f\x8b':
+            raise ValueError(filename + ' is gzip compressed, it has to be decompressed to be indexed')
+        f.seek(0)
+        position = 0  # offset in the file of the start of rest
+        rest = b''  # part of a line left at the end of the last chunk
+        while True:
+            chunk = f.read(ex_index_chunk_size)
+            block = rest + chunk
+            if len(chunk) > 0:
+                block = block[:block.rfind(b'\n') + 1]
+            if keyword is None:
+                found = {word: block.find(word) for word in ex_record_start if block.find(word) >= 0}
+                keyword = min(found, key=found.get) if len(found) > 0 else None
+            if keyword is not None:
+                matches = [(match.start(), match.group(1)) for match in ex_record_start[keyword].finditer(block)]
+                if len(matches) > 0:
+                    offsets, block_numbers = zip(*matches)
+                    offsets = np.array(offsets, dtype=np.int64)
+                    before = np.frombuffer(b'\n' + block, dtype=np.uint8)[offsets]  # character before each keyword
+                    line_start = np.isin(before, np.frombuffer(b' \t\r\n', dtype=np.uint8))
+                    starts.append(position + offsets[line_start])
+                    numbers.append(np.array(block_numbers)[line_start].astype(np.int64) - 1)
+            if len(chunk) == 0:
+                break
+            rest = (rest + chunk)[len(block):]
+            position = position + len(block)
+        size = f.tell()
+    starts = np.concatenate(starts + [np.zeros(0, dtype=np.int64)])
+    numbers = np.concatenate(numbers + [np.zeros(0, dtype=np.int64)])
+
+    return {'numbers': numbers, 'starts': starts, 'ends': np.append(starts[1:], size).astype(np.int64)}
+
+
+def read_ex_nodes(filename, node_numbers):
+    # The nodes with the given numbers (from 0) of an exnode file, as import_exnode_tree would read them but in the
+    # order asked for. Only their records are read, using index_ex_file
+    return read_exnode_lines(ex_record_lines(filename, node_numbers))
+
+
+def read_ex_elems(filename, elem_numbers):
+    # The elements with the given numbers (from 0) of an exelem file, as import_exelem_tree would read them but in the
+    # order asked for. Only their records are read, using index_ex_file
+    return read_exelem_lines(ex_record_lines(filename, elem_numbers))
+
+
+def ex_record_lines(filename, numbers):
+    # Lines of the records of the given node or element numbers of an ex file, in the order of numbers
+    index = index_ex_file(filename)
+    numbers = np.atleast_1d(np.asarray(numbers, dtype=np.int64))
+    found = np.searchsorted(index['numbers'], numbers)
+    missing = found >= len(index['numbers'])
+    missing[~missing] = index['numbers'][found[~missing]] != numbers[~missing]
+    if np.any(missing):
+        raise ValueError('Records ' + str(numbers[missing][0:10].tolist()) + ' are not in ' + filename)
+    starts = index['starts'][found]
+    ends = index['ends'][found]
+    records = [''] * len(numbers)
+    with open(filename, 'rb') as f:
+        for nr in np.argsort(starts, kind='stable'):  # read in file order
+            f.seek(starts[nr])
+            records[nr] = f.read(ends[nr] - starts[nr]).decode()
+            if not records[nr].endswith('\n'):
+                records[nr] = records[nr] + '\n'
+
+    return ''.join(records).splitlines(True)
+
+
 def is_float(str):
     try:
         num = float(str)
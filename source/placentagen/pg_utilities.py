@@ -54,31 +54,51 @@ def angle_two_vectors(vector1, vector2):
     return angle
 
 
+def angles_two_vectors(vectors1, vectors2):
+    # As angle_two_vectors but for n pairs of vectors at once, vectors1 and vectors2 are n x 3 arrays
+    # Lengths and dot products are summed component by component rather than with np.linalg.norm and np.dot
+    vectors1_u = vectors1 / vector_lengths(vectors1)[:, np.newaxis]
+    vectors2_u = vectors2 / vector_lengths(vectors2)[:, np.newaxis]
+
+    dotprod = vectors1_u[:, 0] * vectors2_u[:, 0] + vectors1_u[:, 1] * vectors2_u[:, 1] + \
+              vectors1_u[:, 2] * vectors2_u[:, 2]
+    with np.errstate(invalid='ignore'):
+        angle = np.where(np.isclose(1.0, dotprod), np.sqrt(2 * np.abs(1 - dotprod)), np.arccos(dotprod))
+    angle[np.all(np.equal(vectors1_u, -1.0 * vectors2_u), axis=1)] = np.pi  # vectors are anti-parallel
+    angle[np.all(np.equal(vectors1_u, vectors2_u), axis=1)] = 0.0  # vectors are parallel
+
+    return angle
+
+
+def vector_lengths(vectors):
+    # Length of each row of an n x 3 array of vectors
+    return np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2 + vectors[:, 2] ** 2)
+
+
 def element_connectivity_1D(node_loc, elems):
-    # Initialise connectivity arrays
+    # Finds the elements upstream and downstream of each element. The elements downstream of an element are the
+    # others at its second node, in element order, and it is upstream of each of them. Elements are grouped by node
+    # with a sort rather than looped over, so any number of elements can share a node
+    # Returns elem_up and elem_down (the count and then the elements, number of elements x 3, or more columns if an
+    # element has more than two), and the same in CSR form: the elements downstream of ne are
+    # down[down_offsets[ne]:down_offsets[ne + 1]], and likewise for up and up_offsets
+    elems = np.asarray(elems).astype(int)
     num_elems = len(elems)
-    elem_upstream = np.zeros((num_elems, 3), dtype=int)
-    elem_downstream = np.zeros((num_elems, 3), dtype=int)
-    num_nodes = len(node_loc)
-    elems_at_node = np.zeros((num_nodes, 4), dtype=int)
-    # determine elements that are associated with each node
-    for ne in range(0, num_elems):
-        for nn in range(1, 3):
-            nnod = elems[ne][nn]
-            elems_at_node[nnod][0] = elems_at_node[nnod][0] + 1
-            elems_at_node[nnod][elems_at_node[nnod][0]] = ne
-    # assign connectivity
-    for ne in range(0, num_elems):
-        nnod2 = elems[ne][2]  # second node in elem
-        for noelem in range(1, elems_at_node[nnod2][0] + 1):
-            ne2 = elems_at_node[nnod2][noelem]
-            if ne2 != ne:
-                elem_upstream[ne2][0] = elem_upstream[ne2][0] + 1
-                elem_upstream[ne2][elem_upstream[ne2][0]] = ne
-                elem_downstream[ne][0] = elem_downstream[ne][0] + 1
-                elem_downstream[ne][elem_downstream[ne][0]] = ne2
-
-    return {'elem_up': elem_upstream, 'elem_down': elem_downstream}
+    # ends of elements, element ne has positions 2 * ne (first node) and 2 * ne + 1 (second node)
+    at_node = group_by_index(elems[:, 1:3].ravel(), len(node_loc))
+    at_second_node = gather_groups(at_node, elems[:, 2])
+    other = at_second_node['members'] // 2
+    elem = np.repeat(np.arange(num_elems), np.diff(at_second_node['offsets']))
+    downstream = other != elem
+    down = other[downstream]
+    down_offsets = np.zeros(num_elems + 1, dtype=int)
+    down_offsets[1:] = np.cumsum(np.bincount(elem[downstream], minlength=num_elems))
+    up_groups = group_by_index(down, num_elems)
+    up = elem[downstream][up_groups['order']]
+    up_offsets = up_groups['offsets']
+
+    return {'elem_up': padded_connectivity(up_offsets, up), 'elem_down': padded_connectivity(down_offsets, down),
+            'up_offsets': up_offsets, 'up': up, 'down_offsets': down_offsets, 'down': down}
 
 
 def plane_from_3_pts(x0, x1, x2, normalise):
@@ -108,6 +128,24 @@ def plane_from_3_pts(x0, x1, x2, normalise):
     return norml
 
 
+def planes_from_3_pts(x0, x1, x2):
+    # As plane_from_3_pts (raw normal, not normalised) but for n sets of points at once
+    # x0, x1, x2 are n x 3 arrays, returns an n x 4 array of plane coefficients aX + bY + cZ + d = 0
+    # The arithmetic is done in the same order as plane_from_3_pts so the planes are identical
+    norml = np.zeros((len(x0), 4))
+    diff1 = x1 - x0
+    diff2 = x1 - x2
+
+    norml[:, 0] = diff1[:, 1] * diff2[:, 2] - diff1[:, 2] * diff2[:, 1]
+    norml[:, 1] = diff1[:, 2] * diff2[:, 0] - diff1[:, 0] * diff2[:, 2]
+    norml[:, 2] = diff1[:, 0] * diff2[:, 1] - diff1[:, 1] * diff2[:, 0]
+
+    for nj in range(0, 3):
+        norml[:, 3] = norml[:, 3] - norml[:, nj] * x0[:, nj]
+
+    return norml
+
+
 def check_colinear(x0, x1, x2):
     colinear = False
     vector1 = (x1 - x0) / np.linalg.norm(x1 - x0)
@@ -121,3 +159,158 @@ def check_colinear(x0, x1, x2):
         colinear = True
 
     return colinear
+
+
+def build_grid_index(points, points_per_cell=2.0):
+    # Builds a uniform grid spatial index over an n x 3 array of points for nearest point queries
+    # points_per_cell = target average number of points in each grid cell
+    # Points are stored cell by cell (CSR style: the points in cell i are order[cell_start[i]:cell_start[i + 1]]),
+    # and keep their original order within a cell
+    points = np.array(points, dtype=float)
+    origin = points.min(axis=0)
+    extent = points.max(axis=0) - origin
+    spread = extent > 0
+    cell_size = 1.0
+    while np.any(spread):
+        # choose cells of roughly equal volume (or area if the points are flat) holding points_per_cell points,
+        # directions thinner than a cell are treated as flat so the grid doesn't blow up in the others
+        cell_size = (np.prod(extent[spread]) * points_per_cell / len(points)) ** (1.0 / np.count_nonzero(spread))
+        if np.all(extent[spread] >= cell_size):
+            break
+        spread = spread & (extent >= cell_size)
+    shape = (np.floor(extent / cell_size)).astype(int) + 1
+    cell = grid_cell_of(points, origin, cell_size, shape)
+    cell_id = (cell[:, 0] * shape[1] + cell[:, 1]) * shape[2] + cell[:, 2]
+    order = np.argsort(cell_id, kind='stable')
+    cell_start = np.zeros(np.prod(shape) + 1, dtype=int)
+    cell_start[1:] = np.cumsum(np.bincount(cell_id, minlength=np.prod(shape)))
+
+    return {'points': points, 'origin': origin, 'cell_size': cell_size, 'shape': shape, 'order': order,
+            'cell_start': cell_start}
+
+
+def grid_cell_of(points, origin, cell_size, shape):
+    # Grid cell (i, j, k) containing each point, points outside the grid are put in the closest cell on its edge
+    cell = np.floor((points - origin) / cell_size).astype(int)
+    return np.minimum(np.maximum(cell, 0), shape - 1)
+
+
+def nearest_in_grid_index(index, query_points, max_candidates=2000000):
+    # Finds the closest indexed point to each query point
+    # index = grid index from build_grid_index
+    # query_points = m x 3 array
+    # max_candidates = bounds the number of point pairs compared at once (memory use)
+    # Returns the position (in the indexed points) of the closest point and its distance. When several points are
+    # equally close the first one in the indexed points wins. Distances are calculated exactly as in
+    # grow_tree.dist_two_vectors so results are the same as a brute force search.
+    query_points = np.asarray(query_points, dtype=float)
+    points = index['points']
+    shape = index['shape']
+    cell_size = index['cell_size']
+    num_query = len(query_points)
+    nearest = np.zeros(num_query, dtype=int) - 1
+    nearest_dist = np.zeros(num_query) + np.inf
+    if num_query == 0 or len(points) == 0:
+        return {'index': nearest, 'dist': nearest_dist}
+
+    query_cell = grid_cell_of(query_points, index['origin'], cell_size, shape)
+    active = np.arange(num_query)
+    ring = 0
+    while len(active) != 0:
+        # cells at a chebyshev distance of exactly ring cells from the query point's cell
+        offsets = np.indices((2 * ring + 1, 2 * ring + 1, 2 * ring + 1)).reshape(3, -1).T - ring
+        offsets = offsets[np.abs(offsets).max(axis=1) == ring]
+        offsets = offsets[np.all(np.abs(offsets) <= shape - 1, axis=1)]
+        chunk_size = max(1, int(max_candidates / max(1, len(offsets))))
+        for chunk_start in range(0, len(active), chunk_size):
+            query = active[chunk_start:chunk_start + chunk_size]
+            cells = query_cell[query][:, np.newaxis, :] + offsets[np.newaxis, :, :]
+            in_grid = np.all((cells >= 0) & (cells < shape), axis=2)
+            cell_query = np.nonzero(in_grid)[0]
+            cells = cells[in_grid]
+            cell_id = (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+            first = index['cell_start'][cell_id]
+            num_in_cell = index['cell_start'][cell_id + 1] - first
+            num_candidates = np.sum(num_in_cell)
+            if num_candidates == 0:
+                continue
+            # every (query point, indexed point) pair in these cells
+            candidate_query = query[np.repeat(cell_query, num_in_cell)]
+            position = np.arange(num_candidates) - np.repeat(np.cumsum(num_in_cell) - num_in_cell, num_in_cell)
+            candidate = index['order'][np.repeat(first, num_in_cell) + position]
+            dist = np.sqrt((points[candidate, 0] - query_points[candidate_query, 0]) ** 2 +
+                           (points[candidate, 1] - query_points[candidate_query, 1]) ** 2 +
+                           (points[candidate, 2] - query_points[candidate_query, 2]) ** 2)
+            # closest candidate of each query point, lowest position on ties
+            order = np.lexsort((candidate, dist, candidate_query))
+            candidate_query = candidate_query[order]
+            first_of_query = np.ones(len(order), dtype=bool)
+            first_of_query[1:] = candidate_query[1:] != candidate_query[:-1]
+            candidate_query = candidate_query[first_of_query]
+            candidate = candidate[order][first_of_query]
+            dist = dist[order][first_of_query]
+            better = (dist < nearest_dist[candidate_query]) | (
+                    (dist == nearest_dist[candidate_query]) & (candidate < nearest[candidate_query]))
+            nearest[candidate_query[better]] = candidate[better]
+            nearest_dist[candidate_query[better]] = dist[better]
+        # Points in cells further out are at least ring cell widths away, so query points with a closer point (or
+        # for which every cell has been searched) are done
+        searched_all = ring >= np.max(shape) - 1
+        if searched_all:
+            break
+        active = active[nearest_dist[active] >= (ring - 1.0e-6) * cell_size]
+        ring = ring + 1
+
+    return {'index': nearest, 'dist': nearest_dist}
+
+
+def group_by_index(index, num_groups):
+    # Groups positions 0..n-1 by index (an integer from 0 to num_groups - 1 for each position) with a stable sort.
+    # The positions with index i are order[offsets[i]:offsets[i + 1]], in increasing order
+    index = np.asarray(index)
+    order = np.argsort(index, kind='stable')
+    offsets = np.zeros(num_groups + 1, dtype=int)
+    offsets[1:] = np.cumsum(np.bincount(index, minlength=num_groups))
+
+    return {'order': order, 'offsets': offsets}
+
+
+def gather_groups(groups, keys):
+    # For each key, the members of group key of groups (from group_by_index), as CSR arrays: the members for key k
+    # are members[offsets[k]:offsets[k + 1]]
+    keys = np.asarray(keys)
+    first = groups['offsets'][keys]
+    counts = groups['offsets'][keys + 1] - first
+    offsets = np.zeros(len(keys) + 1, dtype=int)
+    offsets[1:] = np.cumsum(counts)
+    members = groups['order'][np.repeat(first - offsets[:-1], counts) + np.arange(offsets[-1])]
+
+    return {'offsets': offsets, 'members': members}
+
+
+def padded_connectivity(offsets, members):
+    # elem_up or elem_down style array (count, then the elements) from CSR offsets and members. There are three
+    # columns, or more if any count is more than two
+    counts = np.diff(offsets)
+    num_columns = max(2, np.max(counts, initial=0)) + 1
+    padded = np.zeros((len(counts), num_columns), dtype=int)
+    padded[:, 0] = counts
+    rows = np.repeat(np.arange(len(counts)), counts)
+    columns = np.arange(len(members)) - np.repeat(offsets[:-1], counts) + 1
+    padded[rows, columns] = members
+
+    return padded
+
+
+def mirror_fold(coords, tolerance=1e-9):
+    # For sorted coordinates along one axis, the index each one mirrors onto about 0 in the upper half,
+    # max(i, n - 1 - i), so that values only need to be found for coords[n // 2:]. The coordinates must be symmetric
+    # about 0 to within tolerance times their largest size, and None is returned if they are not
+    coords = np.asarray(coords, dtype=float)
+    if len(coords) == 0:
+        return None
+    if not np.all(np.abs(coords + coords[::-1]) <= tolerance * np.max(np.abs(coords))):
+        return None
+    index = np.arange(len(coords))
+
+    return np.maximum(index, len(coords) - 1 - index)
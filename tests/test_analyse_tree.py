@@ -1,8 +1,10 @@
 
 from unittest import TestCase
 
+import io
 import numpy as np
 import unittest
+from unittest import mock
 import placentagen
 import os
 TESTDATA_FILENAME = os.path.join(os.path.dirname(__file__), 'Testdata/Small.exnode')
@@ -23,6 +25,39 @@ class Test_Terminal_Br(TestCase):
         term_br  = placentagen.calc_terminal_branch(noddata['nodes'],eldata['elems'])
         self.assertTrue(term_br['total_terminals'] == 2)
 
+
+class Test_tree_property(TestCase):
+
+    def setUp(self):
+        self.nodes = np.array([[0, 0., 0., 0.], [1, 0., 0., 1.], [2, 1., 0., 2.], [3, -1., 0., 2.]])
+        self.elems = np.array([[0, 0, 1], [1, 1, 2], [2, 1, 3]])
+
+    def test_property_cached(self):
+        with mock.patch('placentagen.pg_utilities.element_connectivity_1D',
+                        wraps=placentagen.pg_utilities.element_connectivity_1D) as connectivity:
+            orders = placentagen.tree_property(self.nodes, self.elems, 'orders')
+            terminals = placentagen.tree_property(self.nodes, self.elems, 'terminals')
+            placentagen.define_radius_by_order(self.nodes, self.elems, 'strahler', 0, 1.0, 0.5)
+            self.assertTrue(connectivity.call_count == 1)
+        self.assertTrue(placentagen.tree_property(self.nodes, self.elems, 'orders') is orders)
+        self.assertTrue(np.array_equal(orders['strahler'], [2, 1, 1]))
+        self.assertTrue(np.array_equal(terminals['terminal_elems'], [1, 2]))
+        self.assertTrue(np.array_equal(placentagen.tree_property(self.nodes, self.elems, 'terminal_coords'),
+                                       [[1., 0., 2.], [-1., 0., 2.]]))
+        self.assertFalse(orders['strahler'].flags.writeable)
+
+    def test_property_invalidated(self):
+        lengths = placentagen.tree_property(self.nodes, self.elems, 'lengths')
+        self.assertTrue(np.allclose(lengths, [1., np.sqrt(2.), np.sqrt(2.)]))
+        self.nodes[2, 3] = 1.
+        self.assertTrue(np.allclose(placentagen.tree_property(self.nodes, self.elems, 'lengths'),
+                                    [1., 1., np.sqrt(2.)]))
+        self.elems[2, 1] = 0
+        terminals = placentagen.tree_property(self.nodes, self.elems, 'terminals')
+        self.assertTrue(np.array_equal(terminals['terminal_elems'], [1, 2]))
+        self.assertTrue(np.array_equal(placentagen.tree_property(self.nodes, self.elems, 'orders')['strahler'],
+                                       [1, 1, 1]))
+
       
 class test_pl_vol_in_grid(TestCase):
         
@@ -40,6 +75,89 @@ class test_pl_vol_in_grid(TestCase):
         self.assertTrue(np.isclose(pl_vol['pl_vol_in_grid'][0], 0.12485807941))
         self.assertTrue(abs(pl_vol['pl_vol_in_grid']-1./8.)/(1./8)<1e-2)#looking for less than 1% error in expected volume of 1/8
 
+    def test_pl_vol_chunked(self):
+        volume = 5
+        thickness = 1
+        ellipticity = 1.5
+        rectangular_mesh = placentagen.gen_rectangular_mesh(volume, thickness, ellipticity, 0.3, 0.3, 0.3)
+        pl_vol = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10)
+        with mock.patch('placentagen.analyse_tree.grid_chunk_bytes', 3 * 8 * 10 * 10):
+            pl_vol_chunked = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10)
+        self.assertTrue(np.array_equal(pl_vol['pl_vol_in_grid'], pl_vol_chunked['pl_vol_in_grid']))
+        self.assertTrue(np.array_equal(pl_vol['non_empty_rects'], np.flatnonzero(pl_vol['pl_vol_in_grid'] > 0)))
+        self.assertTrue(abs(np.sum(pl_vol['pl_vol_in_grid']) - volume) / volume < 1e-2)
+
+    def test_pl_vol_symmetry(self):
+        volume = 5
+        thickness = 1
+        ellipticity = 1.5
+        rectangular_mesh = placentagen.gen_rectangular_mesh(volume, thickness, ellipticity, 0.3, 0.4, 0.25)
+        pl_vol = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10)
+        pl_vol_octant = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10,
+                                                           symmetry=True)
+        self.assertTrue(np.allclose(pl_vol['pl_vol_in_grid'], pl_vol_octant['pl_vol_in_grid'], rtol=0, atol=1e-14))
+        self.assertTrue(np.array_equal(pl_vol['non_empty_rects'], pl_vol_octant['non_empty_rects']))
+        octant = placentagen.analyse_tree.grid_octant_cells(rectangular_mesh['nodes'], rectangular_mesh['elems'])
+        self.assertTrue(len(octant['cells']) * 6 < rectangular_mesh['total_elems'])
+        self.assertTrue(np.all(rectangular_mesh['nodes'][rectangular_mesh['elems'][octant['cells'], 8]] > 0))
+
+    def test_pl_vol_symmetry_fallback(self):
+        volume = 5
+        thickness = 1
+        ellipticity = 1.5
+        rectangular_mesh = placentagen.gen_rectangular_mesh(volume, thickness, ellipticity, 0.3, 0.4, 0.25)
+        rectangular_mesh['nodes'] = rectangular_mesh['nodes'] + [0.1, 0., 0.]
+        self.assertTrue(placentagen.analyse_tree.grid_octant_cells(rectangular_mesh['nodes'],
+                                                                   rectangular_mesh['elems']) is None)
+        pl_vol = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10)
+        pl_vol_octant = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 10,
+                                                           symmetry=True)
+        self.assertTrue(np.array_equal(pl_vol['pl_vol_in_grid'], pl_vol_octant['pl_vol_in_grid']))
+
+    def test_pl_vol_adaptive_margin(self):
+        thickness = (3.0 * 1 / (4.0 * np.pi)) ** (1.0 / 3.0) * 2.0  # mm
+        rectangular_mesh = {}
+        rectangular_mesh['nodes'] = [[0., 0., 0.], [thickness / 2.0, 0., 0.], [0., thickness / 2.0, 0.],
+                                     [thickness / 2.0, thickness / 2.0, 0.], [0., 0., thickness / 2.0],
+                                     [thickness / 2.0, 0., thickness / 2.0], [0., thickness / 2.0, thickness / 2.0],
+                                     [thickness / 2.0, thickness / 2.0, thickness / 2.0]]
+        rectangular_mesh['elems'] = [[0, 0, 1, 2, 3, 4, 5, 6, 7]]
+        rectangular_mesh['total_nodes'] = 8
+        rectangular_mesh['total_elems'] = 1
+        pl_vol = placentagen.ellipse_volume_to_grid_adaptive(rectangular_mesh, 1, thickness, 1.0, 1e-10)
+        self.assertTrue(abs(pl_vol['pl_vol_in_grid'][0] - 1. / 8.) < 1e-10)
+        self.assertTrue(pl_vol['vol_error_in_grid'][0] < 1e-10)
+
+    def test_pl_vol_adaptive_total(self):
+        volume = 5
+        thickness = 1.3
+        ellipticity = 1.5
+        rectangular_mesh = placentagen.gen_rectangular_mesh(volume, thickness, ellipticity, 0.3, 0.3, 0.3)
+        for tolerance in [1e-4, 1e-8]:
+            pl_vol = placentagen.ellipse_volume_to_grid_adaptive(rectangular_mesh, volume, thickness, ellipticity,
+                                                                 tolerance)
+            self.assertTrue(abs(np.sum(pl_vol['pl_vol_in_grid']) - volume) < tolerance)
+            self.assertTrue(np.sum(pl_vol['vol_error_in_grid']) < tolerance)
+        pl_vol_trapezoid = placentagen.ellipse_volume_to_grid(rectangular_mesh, volume, thickness, ellipticity, 25)
+        self.assertTrue(np.allclose(pl_vol['pl_vol_in_grid'], pl_vol_trapezoid['pl_vol_in_grid'], atol=1e-3))
+
+    def test_pl_vol_adaptive_roundoff(self):
+        volume = 5e5
+        thickness = 25
+        rectangular_mesh = placentagen.gen_rectangular_mesh(volume, thickness, 1, 8, 8, 4)
+        # a tolerance below round-off stops at the round-off error of each part rather than halving to the limit
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            pl_vol = placentagen.ellipse_volume_to_grid_adaptive(rectangular_mesh, volume, thickness, 1, 0.0)
+        self.assertFalse('WARNING' in out.getvalue())
+        self.assertTrue(abs(np.sum(pl_vol['pl_vol_in_grid']) - volume) < 1e-8)
+        # if intervals run over the cap they are accepted with a warning
+        with mock.patch('placentagen.analyse_tree.adaptive_max_intervals', 16):
+            with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+                pl_vol_capped = placentagen.ellipse_volume_to_grid_adaptive(rectangular_mesh, volume, thickness, 1,
+                                                                            1e-12)
+        self.assertTrue('WARNING: adaptive quadrature did not reach the tolerance' in out.getvalue())
+        self.assertTrue(np.allclose(pl_vol['pl_vol_in_grid'], pl_vol_capped['pl_vol_in_grid'], rtol=0, atol=1e-2))
+
     def test_pl_vol_complete_inside(self):
         thickness =  2  # mm
         ellipticity = 1.6  # no units
@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import numpy as np
+import unittest
+import placentagen
+
+
+class Test_compact_tree(TestCase):
+    def seed_geom(self):
+        seed_geom = {}
+        seed_geom['nodes'] = [[0, 0, 1, 0], [1, 0, .1, 0], [2, -0.1, 0.1, 0], [3, 0.1, 0.1, 0]]
+        seed_geom['elems'] = [[0, 0, 1], [1, 1, 2], [2, 1, 3]]
+        seed_geom['elem_up'] = [[0, 0, 0], [1, 0, 0], [1, 0, 0]]
+        seed_geom['elem_down'] = [[2, 1, 2], [0, 0, 0], [0, 0, 0]]
+        return seed_geom
+
+    def test_round_trip(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                           1, 1, 1, data, self.seed_geom())
+        tree = placentagen.compact_tree_from_geom(geom)
+        geom_back = placentagen.geom_from_compact_tree(tree)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_back[key]))
+
+    def test_children_and_parents(self):
+        tree = placentagen.compact_tree_from_geom(self.seed_geom())
+        self.assertTrue(np.array_equal(placentagen.children_of(tree, 0), [1, 2]))
+        self.assertTrue(np.array_equal(placentagen.parents_of(tree, 2), [0]))
+        self.assertTrue(len(placentagen.parents_of(tree, 0)) == 0)
+        self.assertTrue(np.shares_memory(placentagen.children_of(tree, 0), tree['children']))
+        self.assertTrue(tree['edges'].dtype == np.int32)
+
+    def test_more_than_two_children(self):
+        coords = [[0, 0, 1], [0, 0, 0], [1, 0, -1], [0, 1, -1], [-1, 0, -1], [0, -1, -1]]
+        edges = [[0, 1], [1, 2], [1, 3], [1, 4], [1, 5]]
+        tree = placentagen.compact_tree(coords, edges)
+        self.assertTrue(np.array_equal(placentagen.children_of(tree, 0), [1, 2, 3, 4]))
+        self.assertTrue(np.array_equal(placentagen.num_children(tree), [4, 0, 0, 0, 0]))
+        geom = placentagen.geom_from_compact_tree(tree)
+        self.assertTrue(np.array_equal(geom['elem_down'][0], [4, 1, 2, 3, 4]))
+        self.assertTrue(np.array_equal(geom['elem_up'][:, 0:2], [[0, 0], [1, 0], [1, 0], [1, 0], [1, 0]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
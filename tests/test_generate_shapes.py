@@ -12,6 +12,11 @@ class Test_generate_data(TestCase):
         array_test = np.isclose(datapoints, [0.0, 0.0, 0.0])
         self.assertTrue(array_test.all)
 
+    def test_data_in_ellipsoid_symmetry(self):
+        datapoints = placentagen.equispaced_data_in_ellipsoid(2000, 10.0, 1.5, 1.3)
+        datapoints_octant = placentagen.equispaced_data_in_ellipsoid(2000, 10.0, 1.5, 1.3, symmetry=True)
+        self.assertTrue(np.array_equal(datapoints, datapoints_octant))
+
     def test_data_on_ellipsoid(self):
         thickness = (3.0 / (4.0 * np.pi)) ** (1.0 / 3.0) * 2.0
         datapoints = placentagen.uniform_data_on_ellipsoid(3, 1.0, thickness, 1.0, 0)
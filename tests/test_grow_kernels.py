@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+import numpy as np
+import unittest
+import os
+import placentagen
+
+
+def seed_geom():
+    seed_geom = {}
+    seed_geom['nodes'] = [[0, 0, 1, 0], [1, 0, .1, 0], [2, -0.1, 0.1, 0], [3, 0.1, 0.1, 0]]
+    seed_geom['elems'] = [[0, 0, 1], [1, 1, 2], [2, 1, 3]]
+    seed_geom['elem_up'] = [[0, 0, 0], [1, 0, 0], [1, 0, 0]]
+    seed_geom['elem_down'] = [[2, 1, 2], [0, 0, 0], [0, 0, 0]]
+    return seed_geom
+
+
+class Test_select_backend(TestCase):
+    def test_python_backend(self):
+        kernels = placentagen.growth_kernels('python')
+        self.assertTrue(kernels['mesh_com'] is placentagen.mesh_com)
+        # the earlier name of the python backend
+        kernels = placentagen.growth_kernels('numpy')
+        self.assertTrue(kernels['mesh_com'] is placentagen.mesh_com)
+
+    def test_environment_backend(self):
+        os.environ['PLACENTAGEN_BACKEND'] = 'python'
+        try:
+            kernels = placentagen.growth_kernels()
+        finally:
+            del os.environ['PLACENTAGEN_BACKEND']
+        self.assertTrue(kernels['data_to_mesh'] is placentagen.data_to_mesh)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, placentagen.growth_kernels, 'fortran')
+
+    def test_backend_not_vectorised(self):
+        data = placentagen.uniform_data_on_ellipsoid(10, 1, 1, 1, 0)
+        for backend in ['numba', 'fortran']:
+            self.assertRaises(ValueError, placentagen.grow_large_tree, 90 * np.pi / 180, 45 * np.pi / 180, 0.5,
+                              0.01, 1, 1, 1, 1, data, seed_geom(), vectorised=True, backend=backend)
+            self.assertRaises(ValueError, placentagen.grow_chorionic_surface, 90 * np.pi / 180, 45 * np.pi / 180,
+                              0.5, 0.01, 1, 1, 1, 1, data, seed_geom(), 'volume', vectorised=True, backend=backend)
+
+
+@unittest.skipIf(placentagen.grow_kernels.numba is None, 'numba is not installed')
+class Test_numba_backend(TestCase):
+    def grow_both(self, grow, *args):
+        geoms = []
+        for backend in ['python', 'numba']:
+            np.random.seed(1)
+            geoms.append(grow(*args, backend=backend))
+        return geoms
+
+    def test_large_tree_same_as_python(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        geoms = self.grow_both(placentagen.grow_large_tree, 90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 1,
+                               1, 1, 1, data, seed_geom())
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geoms[0][key], geoms[1][key]))
+
+    def test_chorion_same_as_python(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        for sorv in ['surface', 'volume']:
+            geoms = self.grow_both(placentagen.grow_chorionic_surface, 90 * np.pi / 180, 45 * np.pi / 180, 0.5,
+                                   0.01, 1, 1, 1, 1, data, seed_geom(), sorv)
+            for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+                self.assertTrue(np.array_equal(geoms[0][key], geoms[1][key]))
+
+    def test_give_back_to_parent(self):
+        np.random.seed(0)
+        data = np.random.uniform(-1, 1, (30, 3))
+        ld = np.random.randint(0, 4, 30)
+        ld_numba = ld.copy()
+        nd_min = placentagen.give_back_to_parent(ld, data, 1, 1, np.array([0.1, 0.2, 0.3]))
+        kernels = placentagen.growth_kernels('numba')
+        self.assertTrue(kernels['give_back_to_parent'](ld_numba, data, 1, 1, np.array([0.1, 0.2, 0.3])) == nd_min)
+        self.assertTrue(np.array_equal(ld, ld_numba))
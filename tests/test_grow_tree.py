@@ -4,6 +4,9 @@ import numpy as np
 import unittest
 import placentagen
 import os
+import shutil
+import tempfile
+from unittest import mock
 
 class Test_create_trees(TestCase):
     def test_umilical_node(self):
@@ -83,3 +86,365 @@ class Test_add_villi(TestCase):
         initial_geom['elem_down'] = [[1, 1, 0], [0, 0, 0]]
         chorion_and_stem = placentagen.add_stem_villi(initial_geom, from_elem, 0.2)
         self.assertTrue(chorion_and_stem['nodes'][3][3], -0.2)
+
+
+class Test_grow_trees_vectorised(TestCase):
+    def seed_geom(self):
+        seed_geom = {}
+        seed_geom['nodes'] = [[0, 0, 1, 0], [1, 0, .1, 0], [2, -0.1, 0.1, 0], [3, 0.1, 0.1, 0]]
+        seed_geom['elems'] = [[0, 0, 1], [1, 1, 2], [2, 1, 3]]
+        seed_geom['elem_up'] = [[0, 0, 0], [1, 0, 0], [1, 0, 0]]
+        seed_geom['elem_down'] = [[2, 1, 2], [0, 0, 0], [0, 0, 0]]
+        return seed_geom
+
+    def test_large_tree_same_as_loop(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom())
+        np.random.seed(1)
+        geom_vec = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                               1, 1, 1, data.copy(), self.seed_geom(), vectorised=True)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_vec[key]))
+
+    def test_large_tree_legacy_angles(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom(), legacy_angles=True)
+        np.random.seed(1)
+        geom_vec = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                               1, 1, 1, data.copy(), self.seed_geom(), vectorised=True,
+                                               legacy_angles=True)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_vec[key]))
+        np.random.seed(1)
+        geom_exact = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                                 1, 1, 1, data.copy(), self.seed_geom())
+        self.assertFalse(np.array_equal(geom['nodes'], geom_exact['nodes']))
+
+    def test_large_tree_parallel_same_as_loop(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom())
+        np.random.seed(1)
+        geom_par = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                               1, 1, 1, data.copy(), self.seed_geom(), processes=2)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_par[key]))
+
+    def test_short_branches_retired(self):
+        # with a minimum length longer than any branch every new branch is a terminal and doesn't grow further
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        for vectorised in [False, True]:
+            geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 10.0, 2,
+                                               1, 1, 1, data.copy(), self.seed_geom(), vectorised=vectorised)
+            self.assertTrue(len(geom['elems']) == 7)
+            self.assertTrue(np.all(geom['elem_down'][3:7, 0] == 0))
+
+    def test_chorion_surface_same_as_loop(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 5,
+                                                  1, 1, 1, data, self.seed_geom(), 'surface')
+        np.random.seed(1)
+        geom_vec = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 5,
+                                                      1, 1, 1, data, self.seed_geom(), 'surface', vectorised=True)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_vec[key]))
+
+    def test_chorion_volume_same_as_loop(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                  1, 1, 1, data, self.seed_geom(), 'volume')
+        np.random.seed(1)
+        geom_vec = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                      1, 1, 1, data, self.seed_geom(), 'volume', vectorised=True)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_vec[key]))
+
+    def test_incremental_reassign(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 1,
+                                                  1, 1, 1, data, self.seed_geom(), 'volume', reassign='incremental')
+        self.assertTrue(len(geom['elems']) > 3)
+        for ne in range(3, len(geom['elems'])):
+            parent = geom['elem_up'][ne][1]
+            self.assertTrue(ne in geom['elem_down'][parent][1:geom['elem_down'][parent][0] + 1])
+
+    def test_tree_outgrows_initial_arrays(self):
+        np.random.seed(5)
+        data = np.random.uniform(-0.5, 0.5, (100, 3))
+        data = data[data[:, 0] ** 2 + data[:, 1] ** 2 < 0.25]  # inside the chorionic surface
+        np.random.seed(1)
+        geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.4, 0.001, 1,
+                                                  1, 1, 1, data, self.seed_geom(), 'surface')
+        np.random.seed(1)
+        geom_vec = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.4, 0.001, 1,
+                                                      1, 1, 1, data, self.seed_geom(), 'surface', vectorised=True)
+        self.assertTrue(len(geom['elems']) > 3 + len(data))
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_vec[key]))
+
+    def interrupted_growth(self, grow, checkpoint, generations):
+        # Runs grow, stopping it as if the job was killed just after the checkpoint of the given generation is saved
+        save_checkpoint = placentagen.grow_tree.save_checkpoint
+
+        def save_then_stop(checkpoint_settings, *args):
+            save_checkpoint(checkpoint_settings, *args)
+            if checkpoint_settings['generation'] == generations:
+                raise KeyboardInterrupt
+
+        with mock.patch('placentagen.grow_tree.save_checkpoint', side_effect=save_then_stop):
+            self.assertRaises(KeyboardInterrupt, grow)
+        self.assertTrue(os.path.exists(checkpoint))
+
+    def test_resume_large_tree(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        folder = tempfile.mkdtemp()
+        checkpoint = os.path.join(folder, 'growth.npz')
+        try:
+            np.random.seed(1)
+            geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                               1, 1, 1, data.copy(), self.seed_geom())
+            np.random.seed(1)
+            self.interrupted_growth(lambda: placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1,
+                                                                        2, 1, 1, 1, data.copy(), self.seed_geom(),
+                                                                        checkpoint=checkpoint), checkpoint, 3)
+            # the checkpoint is closed before growth carries on and writes new ones over it
+            loaded = []
+            open_when_saved = []
+
+            def load(*args, **kwargs):
+                loaded.append(np_load(*args, **kwargs))
+                return loaded[-1]
+
+            def save(*args):
+                open_when_saved.extend([npz for npz in loaded if npz.fid is not None])
+                save_checkpoint(*args)
+
+            np_load = np.load
+            save_checkpoint = placentagen.grow_tree.save_checkpoint
+            with mock.patch('numpy.load', side_effect=load), \
+                    mock.patch('placentagen.grow_tree.save_checkpoint', side_effect=save):
+                geom_resumed = placentagen.resume_tree_growth(checkpoint)
+            self.assertTrue(len(loaded) == 1 and open_when_saved == [])
+        finally:
+            shutil.rmtree(folder)
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_resumed[key]))
+
+    def test_resume_chorion(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        folder = tempfile.mkdtemp()
+        checkpoint = os.path.join(folder, 'growth.npz')
+        try:
+            for sorv in ['surface', 'volume']:
+                np.random.seed(1)
+                geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                          1, 1, 1, data, self.seed_geom(), sorv)
+                np.random.seed(1)
+                self.interrupted_growth(lambda: placentagen.grow_chorionic_surface(
+                    90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2, 1, 1, 1, data, self.seed_geom(), sorv,
+                    checkpoint=checkpoint, checkpoint_every=2), checkpoint, 2)
+                geom_resumed = placentagen.resume_tree_growth(checkpoint)
+                for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+                    self.assertTrue(np.array_equal(geom[key], geom_resumed[key]))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_group_elem_parent_term_large_tree(self):
+        # a full binary tree of 2047 elements, the terminals are the last 1024 in breadth first order
+        elem_down = np.zeros((2047, 3), dtype=int)
+        elem_down[0:1023, 0] = 2
+        elem_down[0:1023, 1] = 2 * np.arange(1023) + 1
+        elem_down[0:1023, 2] = 2 * np.arange(1023) + 2
+        parentlist = placentagen.group_elem_parent_term(0, elem_down)
+        self.assertTrue(np.array_equal(parentlist, np.arange(1023, 2047)))
+        parentlist = placentagen.group_elem_parent_term(2, elem_down)
+        self.assertTrue(len(parentlist) == 512 and np.all(elem_down[parentlist, 0] == 0))
+
+    def test_grow_new_seeds(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom())
+        num_elems = len(geom['elems'])
+        new_data = np.random.RandomState(0).normal(0.8 * data[0], 0.05, (30, 3))  # new seed points in one region
+        geom_new = placentagen.grow_new_seeds(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                              1, 1, 1, new_data, geom)
+        self.assertTrue(len(geom_new['elems']) > num_elems)
+        # the grown tree is kept as it was and the new branches grow from its terminals
+        for key in ['nodes', 'elems', 'elem_up']:
+            self.assertTrue(np.array_equal(geom[key], geom_new[key][0:len(geom[key])]))
+        for ne in range(num_elems, len(geom_new['elems'])):
+            parent = geom_new['elem_up'][ne][1]
+            self.assertTrue(parent >= num_elems or geom['elem_down'][parent][0] == 0)
+
+    def test_growth_budgets(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom())
+        # budgets that are not reached leave the tree as it was
+        np.random.seed(1)
+        geom_budget = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                                  1, 1, 1, data.copy(), self.seed_geom(), max_elements=1000,
+                                                  max_generations=100, wall_time_budget=1000)
+        self.assertTrue(geom_budget['status'] == {'budget_hit': None, 'unassigned_seeds': 0})
+        for key in ['nodes', 'elems', 'elem_up', 'elem_down']:
+            self.assertTrue(np.array_equal(geom[key], geom_budget[key]))
+
+        geom_budget = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                                  1, 1, 1, data.copy(), self.seed_geom(), max_elements=12)
+        self.assertTrue(geom_budget['status']['budget_hit'] == 'max_elements')
+        self.assertTrue(3 < len(geom_budget['elems']) <= 12)
+        self.assertTrue(len(geom_budget['nodes']) == len(geom_budget['elems']) + 1)
+
+        geom_budget = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                         1, 1, 1, data, self.seed_geom(), 'volume',
+                                                         max_generations=1)
+        self.assertTrue(geom_budget['status']['budget_hit'] == 'max_generations')
+        self.assertTrue(len(geom_budget['elems']) == 7)
+        self.assertTrue(geom_budget['status']['unassigned_seeds'] > 0)
+
+        geom_budget = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                                  1, 1, 1, data.copy(), self.seed_geom(), wall_time_budget=0)
+        self.assertTrue(geom_budget['status'] == {'budget_hit': 'wall_time_budget', 'unassigned_seeds': len(data)})
+        self.assertTrue(len(geom_budget['elems']) == 3)
+
+    def test_generation_budget_each_stem(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        np.random.seed(1)
+        geom = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                           1, 1, 1, data.copy(), self.seed_geom(), vectorised=True, orders=True)
+        np.random.seed(1)
+        geom_budget = placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2,
+                                                  1, 1, 1, data.copy(), self.seed_geom(), max_generations=2,
+                                                  orders=True)
+        self.assertTrue(geom_budget['status']['budget_hit'] == 'max_generations')
+        # both stems are grown, each for two generations
+        for stem in [1, 2]:
+            self.assertTrue(np.count_nonzero(geom_budget['elem_up'][3:, 1] == stem) == 2)
+        self.assertTrue(np.max(geom_budget['generation']) == geom['generation'][1] + 2)
+        self.assertTrue(np.max(geom['generation']) > geom['generation'][1] + 2)
+
+    def test_stream_generations(self):
+        # writing each generation as it is grown gives the same files as exporting the grown tree
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        folder = tempfile.mkdtemp()
+        try:
+            stream = placentagen.open_ex_stream('tree', os.path.join(folder, 'streamed'))
+            geom = placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                      1, 1, 1, data, self.seed_geom(), 'volume',
+                                                      sink=lambda nodes, elems: placentagen.write_ex_stream(stream,
+                                                                                                            nodes,
+                                                                                                            elems))
+            placentagen.close_ex_stream(stream)
+            placentagen.export_ex_coords(geom['nodes'], 'tree', os.path.join(folder, 'exported'), 'exnode')
+            placentagen.export_exelem_1d(geom['elems'], 'tree', os.path.join(folder, 'exported'))
+            for extension in ['.exnode', '.exelem']:
+                with open(os.path.join(folder, 'streamed' + extension)) as f:
+                    streamed = f.read()
+                with open(os.path.join(folder, 'exported' + extension)) as f:
+                    exported = f.read()
+                self.assertTrue(streamed == exported)
+        finally:
+            shutil.rmtree(folder)
+        self.assertTrue(len(geom['elems']) > 3)
+
+    def test_orders_while_growing(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        geoms = [placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                             1, 1, 1, data.copy(), self.seed_geom(), orders=True),
+                 placentagen.grow_chorionic_surface(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.01, 2,
+                                                    1, 1, 1, data, self.seed_geom(), 'surface', orders=True)]
+        for geom in geoms:
+            orders = placentagen.evaluate_orders(geom['nodes'], geom['elems'])
+            self.assertTrue(np.max(orders['strahler']) > 2)
+            for key in ['generation', 'strahler', 'horsfield']:
+                self.assertTrue(np.array_equal(orders[key], geom[key]))
+
+    def test_reserve_grown_tree(self):
+        tree = placentagen.allocate_grown_tree(self.seed_geom(), 2)
+        placentagen.reserve_grown_tree(tree, 100, 50)
+        self.assertTrue(len(tree['elems']) >= 100 and len(tree['nodes']) >= 50)
+        self.assertTrue(np.array_equal(tree['elem_down'][0:3], self.seed_geom()['elem_down']))
+        elems = tree['elems']
+        tree['ne'] = 9
+        self.assertTrue(placentagen.trim_grown_tree(tree)['elems'] is elems)
+        self.assertTrue(len(elems) == 10)
+
+    def test_data_to_mesh_grid_same_as_loop(self):
+        np.random.seed(0)
+        data = np.random.uniform(-1, 1, (100, 3))
+        node_loc = np.zeros((21, 4))
+        node_loc[:, 1:4] = np.random.uniform(-1, 1, (21, 3))
+        node_loc[5] = node_loc[6]  # two branches ending at the same point
+        elems = np.array([[ne, 0, ne + 1] for ne in range(0, 20)])
+        parentlist = np.array([3, 4, 5, 7, 11, 12, 15, 19])
+        ld = np.ones(len(data), dtype=int)
+        ld[0:10] = 0  # seed points that have already been removed
+        ld_loop = placentagen.data_to_mesh(ld.copy(), data, parentlist, node_loc, elems)
+        ld_grid = placentagen.data_to_mesh(ld.copy(), data, parentlist, node_loc, elems, 'grid')
+        self.assertTrue(np.array_equal(ld_loop, ld_grid))
+
+    def test_large_tree_leaves_data_unchanged(self):
+        data = placentagen.uniform_data_on_ellipsoid(50, 1, 1, 1, 0)
+        data_copy = data.copy()
+        placentagen.grow_large_tree(90 * np.pi / 180, 45 * np.pi / 180, 0.5, 0.1, 2, 1, 1, 1, data, self.seed_geom())
+        self.assertTrue(np.array_equal(data, data_copy))
+
+    def test_seed_partition(self):
+        data = np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0], [-1.0, 0.0, 1.0], [5.0, 5.0, 5.0], [-2.0, 1.0, 0.0]])
+        seeds = placentagen.partition_seeds(np.array([2, 1, 2, 0, 2]), data, 6)
+        self.assertTrue(np.array_equal(seeds['order'][seeds['first'][2]:seeds['last'][2]], [0, 2, 4]))
+        self.assertTrue(np.array_equal(placentagen.seed_slice_com(seeds, 2),
+                                       placentagen.mesh_com(2, np.array([2, 1, 2, 0, 2]), data)))
+        # split element 2 by the plane x = -0.5 into elements 4 and 5
+        split = placentagen.split_seed_slice(seeds, np.array([-0.5, 0.0, 0.0]), np.array([-0.5, 1.0, 0.0]),
+                                             np.array([-0.5, 0.0, 1.0]), 2, 3, 1)
+        self.assertTrue(split['enough_points'][0])
+        self.assertTrue(np.array_equal(seeds['order'][seeds['first'][4]:seeds['last'][4]], [0]))
+        self.assertTrue(np.array_equal(seeds['order'][seeds['first'][5]:seeds['last'][5]], [2, 4]))
+        self.assertTrue(np.array_equal(seeds['elem'][seeds['first'][5]:seeds['last'][5]], [5, 5]))
+        self.assertTrue(seeds['last'][2] == seeds['first'][2])
+
+    def test_mesh_com_groups(self):
+        data = np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0], [2.0, 2.0, 2.0], [5.0, 5.0, 5.0]])
+        groups = np.array([0, 0, 2, 2])
+        com = placentagen.mesh_com_groups(groups, data, 3)
+        self.assertTrue(np.array_equal(com['com'][0], placentagen.mesh_com(0, groups, data)))
+        self.assertTrue(np.array_equal(com['com'][1], [0.0, 0.0, 0.0]))
+        self.assertTrue(np.array_equal(com['num_points'], [2, 0, 2]))
+
+    def test_mesh_check_angles(self):
+        np.random.seed(2)
+        node1 = np.random.uniform(-1, 1, (20, 3))
+        node2 = np.random.uniform(-1, 1, (20, 3))
+        node3 = np.random.uniform(-1, 1, (20, 3))
+        node3[3] = node2[3] + 0.5 * (node2[3] - node1[3])  # in line with its parent
+        node3[7] = node2[7] - 0.5 * (node2[7] - node1[7])  # back along its parent
+        np.random.seed(0)
+        one_at_a_time = [placentagen.mesh_check_angle(np.pi / 4, np.pi / 2, node1[nb], node2[nb], node3[nb].copy(), 0, 0)
+                         for nb in range(0, 20)]
+        batched = placentagen.mesh_check_angles(np.pi / 4, np.pi / 2, node1, node2, node3, np.random.RandomState(0))
+        self.assertTrue(np.array_equal(batched, one_at_a_time))
+        self.assertFalse(np.array_equal(batched[3], node3[3]))
+
+    def test_mesh_check_angles_bounds(self):
+        random_state = np.random.RandomState(1)
+        node1 = random_state.uniform(-1, 1, (500, 3))
+        node2 = random_state.uniform(-1, 1, (500, 3))
+        node3 = random_state.uniform(-1, 1, (500, 3))
+        checked = placentagen.mesh_check_angles(np.pi / 4, np.pi / 2, node1, node2, node3)
+        angle = placentagen.pg_utilities.angles_two_vectors(node2 - node1, checked - node2)
+        self.assertTrue(np.all((angle >= np.pi / 4 - 1e-10) & (angle <= np.pi / 2 + 1e-10)))
+        self.assertTrue(np.allclose(np.linalg.norm(checked - node2, axis=1), np.linalg.norm(node3 - node2, axis=1)))
+        in_range = np.linalg.norm(checked - node3, axis=1) == 0
+        self.assertTrue(np.any(in_range) and not np.all(in_range))
+        legacy = placentagen.mesh_check_angles(np.pi / 4, np.pi / 2, node1, node2, node3, legacy_angles=True)
+        self.assertTrue(np.array_equal(legacy[in_range], node3[in_range]))
+        self.assertFalse(np.allclose(legacy, checked))
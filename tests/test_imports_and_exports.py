@@ -1,5 +1,10 @@
+import asyncio
+import gzip
 import os
+import shutil
+import tempfile
 from unittest import TestCase
+from unittest import mock
 import unittest
 import numpy as np
 
@@ -32,6 +37,237 @@ class Test_import_exnode_exelem(TestCase):
         el_array = eldata['elems']
         self.assertTrue(el_array[0][2] == 1)
 
+    def test_import_gzip(self):
+        folder = tempfile.mkdtemp()
+        try:
+            for filename in [TESTDATA_FILENAME, TESTDATA_FILENAME1]:
+                with open(filename, 'rb') as f:
+                    contents = f.read()
+                with gzip.open(os.path.join(folder, os.path.basename(filename) + '.gz'), 'wb') as f:
+                    f.write(contents)
+            nodedata = placentagen.import_exnode_tree(os.path.join(folder, 'Small.exnode.gz'))
+            eldata = placentagen.import_exelem_tree(os.path.join(folder, 'Small.exelem.gz'))
+            self.assertTrue(np.array_equal(nodedata['nodes'], placentagen.import_exnode_tree(TESTDATA_FILENAME)['nodes']))
+            self.assertTrue(np.array_equal(eldata['elems'], placentagen.import_exelem_tree(TESTDATA_FILENAME1)['elems']))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_import_nan_value(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with open(TESTDATA_FILENAME) as f:
+                lines = f.readlines()
+            lines[11] = '    nan\n'  # z of node 1
+            filename = os.path.join(folder, 'Small.exnode')
+            with open(filename, 'w') as f:
+                f.writelines(lines)
+            nodes = placentagen.import_exnode_tree(filename)['nodes']
+            expected = placentagen.import_exnode_tree(TESTDATA_FILENAME)['nodes']
+            expected[0, 3] = np.nan
+            self.assertTrue(np.array_equal(nodes, expected, equal_nan=True))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_import_exported_tree(self):
+        nodes = np.column_stack([np.arange(200), np.random.RandomState(0).rand(200, 3)])
+        elems = np.column_stack([np.arange(199), np.arange(199) // 2, np.arange(1, 200)])
+        folder = tempfile.mkdtemp()
+        try:
+            placentagen.export_ex_coords(nodes, 'tree', os.path.join(folder, 'tree'), 'exnode')
+            placentagen.export_exelem_1d(elems, 'tree', os.path.join(folder, 'tree'))
+            nodedata = placentagen.import_exnode_tree(os.path.join(folder, 'tree.exnode'))
+            eldata = placentagen.import_exelem_tree(os.path.join(folder, 'tree.exelem'))
+            self.assertTrue(nodedata['total_nodes'] == 200 and eldata['total_elems'] == 199)
+            self.assertTrue(np.array_equal(nodedata['nodes'][:, 0:4], nodes))
+            self.assertTrue(np.array_equal(eldata['elems'], elems))
+        finally:
+            shutil.rmtree(folder)
+
+
+
+class Test_export_stream(TestCase):
+
+    def test_stream_same_as_export(self):
+        nodes = np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5], [2, -0.5, 3.0, 2.0]])
+        elems = np.array([[0, 0, 1], [1, 1, 2]])
+        folder = tempfile.mkdtemp()
+        try:
+            stream = placentagen.open_ex_stream('tree', os.path.join(folder, 'streamed'))
+            placentagen.write_ex_stream(stream, nodes[0:2], elems[0:1])
+            placentagen.write_ex_stream(stream, nodes[2:3], elems[1:2])
+            placentagen.close_ex_stream(stream)
+            placentagen.export_ex_coords(nodes, 'tree', os.path.join(folder, 'exported'), 'exnode')
+            placentagen.export_exelem_1d(elems, 'tree', os.path.join(folder, 'exported'))
+            for extension in ['.exnode', '.exelem']:
+                with open(os.path.join(folder, 'streamed' + extension)) as f:
+                    streamed = f.read()
+                with open(os.path.join(folder, 'exported' + extension)) as f:
+                    exported = f.read()
+                self.assertTrue(streamed == exported)
+        finally:
+            shutil.rmtree(folder)
+
+
+class Test_export_ex(TestCase):
+
+    def test_export_exfield_3d_linear(self):
+        folder = tempfile.mkdtemp()
+        try:
+            placentagen.export_exfield_3d_linear(np.array([0.5, 2.0]), 'grid', 'vol', os.path.join(folder, 'field'))
+            with open(os.path.join(folder, 'field.exelem')) as f:
+                lines = f.read().split('\n')
+            self.assertTrue(lines[10:16] == [' Element:            1 0 0', '   Values:',
+                                             '           0.5' + '       0.5' * 7, ' Element:            2 0 0',
+                                             '   Values:', '           2.0' + '       2.0' * 7])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_export_compressed(self):
+        nodes = np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5], [2, -0.5, 3.0, 2.0]])
+        elems = np.array([[0, 0, 1], [1, 1, 2]])
+        folder = tempfile.mkdtemp()
+        try:
+            placentagen.export_ex_coords(nodes, 'tree', os.path.join(folder, 'tree'), 'exnode')
+            placentagen.export_ex_coords(nodes, 'tree', os.path.join(folder, 'tree'), 'exnode', compress=True)
+            placentagen.export_exelem_1d(elems, 'tree', os.path.join(folder, 'tree'), compress=True)
+            with open(os.path.join(folder, 'tree.exnode'), 'rb') as f:
+                plain = f.read()
+            with gzip.open(os.path.join(folder, 'tree.exnode.gz'), 'rb') as f:
+                self.assertTrue(f.read() == plain)
+            eldata = placentagen.import_exelem_tree(os.path.join(folder, 'tree.exelem.gz'))
+            self.assertTrue(np.array_equal(eldata['elems'], elems))
+        finally:
+            shutil.rmtree(folder)
+
+
+class Test_binary(TestCase):
+
+    def test_binary_tree(self):
+        geom = {'nodes': np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5], [2, -0.5, 3.0, 2.0]]),
+                'elems': np.array([[0, 0, 1], [1, 1, 2]]), 'radius': np.array([0.1, 0.05], dtype=np.float32),
+                'orders': {'strahler': np.array([2, 1]), 'generation': np.array([1, 2])}, 'status': None}
+        folder = tempfile.mkdtemp()
+        try:
+            placentagen.export_binary(geom, os.path.join(folder, 'tree'))
+            data = placentagen.import_binary(os.path.join(folder, 'tree.pgbin'))
+            self.assertTrue(isinstance(data['nodes'], np.memmap))
+            self.assertTrue(np.array_equal(data['nodes'], geom['nodes']) and np.array_equal(data['elems'], geom['elems']))
+            self.assertTrue(data['radius'].dtype == np.float32 and np.array_equal(data['radius'], geom['radius']))
+            self.assertTrue(np.array_equal(data['orders']['strahler'], [2, 1]))
+            self.assertTrue('status' not in data)
+            self.assertTrue(data['nodes'].flags['F_CONTIGUOUS'])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_binary_grid(self):
+        grid = {'nodes': np.zeros((0, 3)), 'elems': np.arange(16, dtype='>i4').reshape(2, 8), 'total_elems': 2}
+        folder = tempfile.mkdtemp()
+        try:
+            placentagen.export_binary(grid, os.path.join(folder, 'grid'), kind='grid')
+            data = placentagen.import_binary(os.path.join(folder, 'grid.pgbin'))
+            self.assertTrue(data['nodes'].shape == (0, 3) and data['total_elems'] == 2)
+            self.assertTrue(data['elems'].dtype.str == '<i4' and np.array_equal(data['elems'], grid['elems']))
+            self.assertTrue(placentagen.read_binary_header(os.path.join(folder, 'grid.pgbin'))['kind'] == 'grid')
+            self.assertRaises(ValueError, placentagen.export_binary, {'elems': grid['elems']},
+                              os.path.join(folder, 'tree'))
+            self.assertRaises(ValueError, placentagen.import_binary, TESTDATA_FILENAME)
+        finally:
+            shutil.rmtree(folder)
+
+
+class Test_ex_index(TestCase):
+
+    def test_read_indexed_records(self):
+        folder = tempfile.mkdtemp()
+        try:
+            shutil.copy(TESTDATA_FILENAME, folder)
+            shutil.copy(TESTDATA_FILENAME1, folder)
+            exnode = os.path.join(folder, 'Small.exnode')
+            exelem = os.path.join(folder, 'Small.exelem')
+            nodes = placentagen.import_exnode_tree(exnode)['nodes']
+            elems = placentagen.import_exelem_tree(exelem)['elems']
+            self.assertTrue(np.array_equal(placentagen.read_ex_nodes(exnode, [3, 1])['nodes'], nodes[[3, 1]]))
+            self.assertTrue(np.array_equal(placentagen.read_ex_elems(exelem, [2, 0])['elems'], elems[[2, 0]]))
+            self.assertTrue(os.path.exists(exnode + '.pgbin'))
+            self.assertRaises(ValueError, placentagen.read_ex_nodes, exnode, [4])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_index_reused(self):
+        nodes = np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5], [2, -0.5, 3.0, 2.0]])
+        folder = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(folder, 'tree')
+            placentagen.export_ex_coords(nodes, 'tree', filename, 'exnode')
+            with mock.patch('placentagen.imports_and_exports.scan_ex_records',
+                            wraps=placentagen.scan_ex_records) as scan:
+                placentagen.read_ex_nodes(filename + '.exnode', [1])
+                placentagen.read_ex_nodes(filename + '.exnode', [2])
+                self.assertTrue(scan.call_count == 1)
+                placentagen.export_ex_coords(nodes[0:2] * [1, 10, 10, 10], 'tree', filename, 'exnode')
+                self.assertTrue(np.array_equal(placentagen.read_ex_nodes(filename + '.exnode', [1])['nodes'][0, 1:4],
+                                               nodes[1, 1:4] * 10))
+                self.assertTrue(scan.call_count == 2)
+        finally:
+            shutil.rmtree(folder)
+
+
+    def test_stale_index_replaced(self):
+        # an index still in use keeps its data when the file changes and the index is written again
+        nodes = np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5], [2, -0.5, 3.0, 2.0]])
+        folder = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(folder, 'tree')
+            placentagen.export_ex_coords(nodes, 'tree', filename, 'exnode')
+            index = placentagen.index_ex_file(filename + '.exnode')
+            starts = np.array(index['starts'])
+            placentagen.export_ex_coords(nodes[0:1], 'tree', filename, 'exnode')
+            self.assertTrue(np.array_equal(placentagen.read_ex_nodes(filename + '.exnode', [0])['nodes'][0, 1:4],
+                                           nodes[0, 1:4]))
+            self.assertTrue(np.array_equal(index['starts'], starts))
+            self.assertTrue(len(placentagen.index_ex_file(filename + '.exnode')['starts']) == 1)
+            self.assertFalse(os.path.exists(filename + '.exnode.pgbin.tmp'))
+            del index
+        finally:
+            shutil.rmtree(folder)
+
+
+class Test_batch_io(TestCase):
+
+    def test_batch_export_import(self):
+        trees = [{'nodes': np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5 * n], [2, -0.5, 3.0, 2.0]]),
+                  'elems': np.array([[0, 0, 1], [1, 1, 2]]), 'groupname': 'tree'} for n in range(0, 5)]
+        folder = tempfile.mkdtemp()
+        try:
+            for n in range(0, 5):
+                trees[n]['filename'] = os.path.join(folder, 'tree' + str(n))
+            self.assertTrue(placentagen.export_ex_trees(trees, threads=3) == [None] * 5)
+            with open(trees[2]['filename'] + '.exnode', 'a') as f:
+                f.write('Node:  x\n')
+            pairs = [(tree['filename'] + '.exnode', tree['filename'] + '.exelem') for tree in trees]
+            pairs.append((os.path.join(folder, 'missing.exnode'), pairs[0][1]))
+            for imported in [placentagen.import_ex_trees(pairs, threads=3),
+                             asyncio.run(placentagen.import_ex_trees_async(pairs, threads=3))]:
+                self.assertTrue([tree['exnode'] for tree in imported] == [pair[0] for pair in pairs])
+                self.assertTrue([tree['error'] is None for tree in imported] == [True, True, False, True, True, False])
+                self.assertTrue(imported[2]['nodes'] is None and np.array_equal(imported[2]['elems'], trees[2]['elems']))
+                self.assertTrue(np.array_equal(imported[4]['nodes'][:, 0:4], trees[4]['nodes']))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_batch_export_errors(self):
+        nodes = np.array([[0, 0.0, 0.0, 1.5], [1, 0.25, 0.1, 0.5]])
+        folder = tempfile.mkdtemp()
+        try:
+            trees = [{'nodes': nodes, 'elems': np.array([[0, 0, 1]]), 'groupname': 'tree',
+                      'filename': os.path.join(folder, 'tree')},
+                     {'nodes': nodes, 'elems': np.array([[0, 0, 1]]), 'groupname': 'tree',
+                      'filename': os.path.join(folder, 'no_folder', 'tree')}]
+            errors = asyncio.run(placentagen.export_ex_trees_async(trees, compress=True))
+            self.assertTrue(errors[0] is None and 'no_folder' in errors[1])
+            self.assertTrue(os.path.exists(os.path.join(folder, 'tree.exelem.gz')))
+        finally:
+            shutil.rmtree(folder)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import numpy as np
+import unittest
+from placentagen import pg_utilities
+
+
+class Test_planes(TestCase):
+    def test_planes_same_as_plane(self):
+        x0 = np.array([[0.1, 0.2, 0.3], [1.0, 0.0, 0.0]])
+        x1 = np.array([[0.5, -0.2, 0.7], [0.0, 1.0, 0.0]])
+        x2 = np.array([[-0.3, 0.9, 0.4], [0.0, 0.0, 1.0]])
+        planes = pg_utilities.planes_from_3_pts(x0, x1, x2)
+        for n in range(0, 2):
+            self.assertTrue(np.array_equal(planes[n], pg_utilities.plane_from_3_pts(x0[n], x1[n], x2[n], False)))
+
+
+class Test_grid_index(TestCase):
+    def test_nearest_same_as_brute_force(self):
+        np.random.seed(0)
+        points = np.random.uniform(-1, 1, (200, 3))
+        points[1] = points[0]  # a tie, first point should win
+        query = np.random.uniform(-2, 2, (300, 3))  # some outside the grid
+        query[0] = points[0]
+        index = pg_utilities.build_grid_index(points)
+        nearest = pg_utilities.nearest_in_grid_index(index, query)
+        for nq in range(0, len(query)):
+            dist = np.sqrt((points[:, 0] - query[nq, 0]) ** 2 + (points[:, 1] - query[nq, 1]) ** 2 +
+                           (points[:, 2] - query[nq, 2]) ** 2)
+            self.assertTrue(nearest['index'][nq] == np.argmin(dist))
+            self.assertTrue(nearest['dist'][nq] == np.min(dist))
+
+    def test_nearest_flat_points(self):
+        points = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0], [3.0, 0.0, 0.0]])
+        index = pg_utilities.build_grid_index(points)
+        nearest = pg_utilities.nearest_in_grid_index(index, np.array([[1.5, 1.0, 0.0], [2.9, 0.0, -1.0]]))
+        self.assertTrue(np.array_equal(nearest['index'], [1, 3]))
+
+
+class Test_group_by_index(TestCase):
+    def test_groups(self):
+        groups = pg_utilities.group_by_index([2, 0, 2, 1, 0], 4)
+        self.assertTrue(np.array_equal(groups['order'], [1, 4, 3, 0, 2]))
+        self.assertTrue(np.array_equal(groups['offsets'], [0, 2, 3, 5, 5]))
+        gathered = pg_utilities.gather_groups(groups, [2, 3, 0])
+        self.assertTrue(np.array_equal(gathered['offsets'], [0, 2, 2, 4]))
+        self.assertTrue(np.array_equal(gathered['members'], [0, 2, 1, 4]))
+
+
+class Test_element_connectivity(TestCase):
+    def test_bifurcation(self):
+        nodes = np.zeros((4, 4))
+        elems = [[0, 0, 1], [1, 1, 2], [2, 1, 3]]
+        connectivity = pg_utilities.element_connectivity_1D(nodes, elems)
+        self.assertTrue(np.array_equal(connectivity['elem_down'], [[2, 1, 2], [0, 0, 0], [0, 0, 0]]))
+        self.assertTrue(np.array_equal(connectivity['elem_up'], [[0, 0, 0], [1, 0, 0], [1, 0, 0]]))
+
+    def test_many_elements_at_node(self):
+        # six elements meet at node 1, more than the three columns of elem_down have room for
+        nodes = np.zeros((7, 4))
+        elems = [[0, 0, 1], [1, 1, 2], [2, 1, 3], [3, 1, 4], [4, 1, 5], [5, 1, 6]]
+        connectivity = pg_utilities.element_connectivity_1D(nodes, elems)
+        self.assertTrue(np.array_equal(connectivity['elem_down'][0], [5, 1, 2, 3, 4, 5]))
+        self.assertTrue(np.array_equal(connectivity['down'], [1, 2, 3, 4, 5]))
+        self.assertTrue(np.array_equal(connectivity['down_offsets'], [0, 5, 5, 5, 5, 5, 5]))
+        self.assertTrue(np.array_equal(connectivity['up'], [0, 0, 0, 0, 0]))
+        self.assertTrue(np.array_equal(connectivity['up_offsets'], [0, 0, 1, 2, 3, 4, 5]))
+
+
+if __name__ == '__main__':
+    unittest.main()